@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Measure the ingestion, matching and routing hot paths.
+
+Synthetic logs are generated with a fixed seed, so that results are
+comparable across revisions. Run as::
+
+    $ python benchmarks/bench_pipeline.py [--lines 200000] [--only latency]
+
+Reported are lines/s read and built into messages by
+``EventHandler._process_file``, us/message matched by 1 to 1000
+triggers, the time and bytes taken to build messages with the cursor
+and message records as opposed to namespaces with copied cursors,
+us/message rendered by ``Slack.payload`` for one or two routers, the
+latency of alerts from the write of a line to the receipt of its
+payload by a local stub webhook, and the peak RSS of the process after
+each.
+
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+from kikori.handlers.handler import Cursor
+from kikori.handlers.handler import Message
+from kikori.handlers.text_logger_handler import TextLoggerHandler
+from kikori.observers import Observer
+from kikori.routers.queue import DeliveryQueue
+from kikori.routers.router import Router
+from kikori.routers.slack import Slack
+from kikori.watches import Watches
+
+
+HEADER = r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+:'
+
+LEVELS = ['DEBUG', 'INFO', 'INFO', 'INFO', 'WARNING', 'ERROR']
+
+
+def make_triggers(n):
+    return [{'pattern': HEADER + r'(?P<level>ERROR|WARNING):svc-{:04d} .*'
+             .format(i), 'routers': [{'name': 'bench'}]} for i in range(n)]
+
+
+def make_lines(count, multiline_ratio=0.05, services=100, seed=0):
+    """Generate log lines, some messages followed by tracebacks."""
+    rnd = random.Random(seed)
+    lines = []
+    while len(lines) < count:
+        level = rnd.choice(LEVELS)
+        lines.append('2017-06-01 12:00:00.{:03d}:{}:svc-{:04d} Something '
+                     'happened in the service (id={})'.format(
+                         rnd.randrange(1000), level,
+                         rnd.randrange(services), len(lines)))
+        if rnd.random() < multiline_ratio:
+            lines.append('Traceback (most recent call last):')
+            for i in range(rnd.randrange(2, 10)):
+                lines.append('  File "app.py", line {}, in f{}'.format(
+                    rnd.randrange(1000), i))
+            lines.append('ValueError: something went wrong')
+    return lines[:count]
+
+
+class NullRouter(Router):
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, message, cursor, groupdict, **kwargs):
+        self.count += 1
+
+
+def peak_rss():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _handler(triggers, router):
+    return TextLoggerHandler(r'.*\.log$', HEADER, triggers,
+                             {'bench': router})
+
+
+def _write_log(dir, lines):
+    path = os.path.join(dir, 'bench.log')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def bench_process_file(dir, args):
+    print('\n_process_file ({} lines)'.format(args.lines))
+    print('{:>10} {:>9} {:>12} {:>10}'.format(
+        'multiline', 'triggers', 'lines/s', 'RSS MiB'))
+    for ratio in (0., args.multiline_ratio, 0.5):
+        path = _write_log(dir, make_lines(args.lines, ratio,
+                                          seed=args.seed))
+        for n in (0, args.triggers):
+            handler = _handler(make_triggers(n), NullRouter())
+            if not n:
+                # Read lines and build messages only
+                handler._process_message = lambda message: None
+            best = None
+            for _ in range(3):
+                handler._create_cache_entry(path, from_start=True)
+                handler._readers.pop(path, None)
+                start = time.perf_counter()
+                handler._process_file(path)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            handler.close()
+            print('{:>10.2f} {:>9} {:>12.0f} {:>10.1f}'.format(
+                ratio, n, args.lines / best, peak_rss()))
+
+
+def bench_matching(dir, args):
+    print('\n_process_message')
+    print('{:>9} {:>12} {:>10}'.format('triggers', 'us/message', 'RSS MiB'))
+    path = _write_log(dir, make_lines(min(args.lines, 20000),
+                                      args.multiline_ratio, seed=args.seed))
+    messages = []
+    handler = _handler([], NullRouter())
+    handler._process_message = messages.append
+    handler._create_cache_entry(path, from_start=True)
+    handler._process_file(path)
+    handler.close()
+    for n in (1, 10, 100, 1000):
+        handler = _handler(make_triggers(n), NullRouter())
+        start = time.perf_counter()
+        for message in messages:
+            handler._process_message(message)
+        elapsed = time.perf_counter() - start
+        print('{:>9} {:>12.2f} {:>10.1f}'.format(
+            n, elapsed / len(messages) * 1e6, peak_rss()))
+
+
+class _DictCursor:
+    """A cursor with its attributes in a dict, as records used to be."""
+
+    def __init__(self, path, pos, line=None, dev=None, ino=None,
+                 index=None):
+        self.path = path
+        self.pos = pos
+        self._line = line
+        self.dev = dev
+        self.ino = ino
+        self.index = index
+
+
+def _namespace(text, cursor):
+    return SimpleNamespace(cursor=copy.copy(cursor), lines=[text])
+
+
+def _append(message, line):
+    message.lines.append(line)
+
+
+def _build_messages(lines, cursor_class, create, append):
+    """Build messages out of lines as read from a file, keeping all."""
+    header = re.compile(HEADER.encode())
+    cursor = cursor_class('/var/log/bench.log', 0, 0)
+    messages = []
+    pos = 0
+    for line in lines:
+        pos += len(line) + 1
+        cursor.pos = pos
+        cursor._line += 1
+        if header.match(line):
+            messages.append(create(line, cursor))
+        else:
+            append(messages[-1], line)
+    return messages
+
+
+def bench_records(dir, args):
+    print('\nMessage records ({} lines)'.format(args.lines))
+    print('{:>10} {:>10} {:>12} {:>12}'.format(
+        'records', 'messages', 'us/message', 'B/message'))
+    lines = [line.encode() for line in make_lines(
+        args.lines, args.multiline_ratio, seed=args.seed)]
+    for name, cursor_class, create, append in [
+            ('namespace', _DictCursor, _namespace, _append),
+            ('slotted', Cursor, Message, Message.append)]:
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            messages = _build_messages(lines, cursor_class, create,
+                                       append)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            del messages
+        tracemalloc.start()
+        messages = _build_messages(lines, cursor_class, create, append)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{:>10} {:>10} {:>12.2f} {:>12.0f}'.format(
+            name, len(messages), best / len(messages) * 1e6,
+            size / len(messages)))
+        del messages
+
+
+def bench_payload(dir, args):
+    print('\nSlack.payload')
+    print('{:>10} {:>12} {:>10}'.format('routers', 'us/message', 'RSS MiB'))
+    slacks = [Slack('http://127.0.0.1:{}/'.format(i + 1), channel='#bench',
+                    title='{level} logged!') for i in range(2)]
+    message = make_lines(1, 1., seed=args.seed)[0]
+    kwargs = {'color': '#ff0000', 'title': '{level} logged!'}
+    count = 10000
+    for n in (1, 2):
+        best = None
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(count):
+                # As routed by the handler, with a cursor per message
+                cursor = Cursor('/var/log/bench.log', 100, 10)
+                groupdict = {'level': 'ERROR'}
+                for slack in slacks[:n]:
+                    slack.payload(message, cursor, groupdict, **kwargs)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('{:>10} {:>12.2f} {:>10.1f}'.format(
+            n, best / count * 1e6, peak_rss()))
+
+
+class _Webhook(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    ID = re.compile(r'\(id=(\d+)\)')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        received = time.monotonic()
+        payload = json.loads(body.decode())
+        for i in self.ID.findall(payload['attachments'][0]['text']):
+            self.server.received[int(i)] = received
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_latency(dir, args):
+    print('\nAlert latency ({} alerts/s among {} lines/s for {}s)'.format(
+        args.alert_rate, args.rate, args.duration))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Webhook)
+    server.received = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    slack = Slack('http://127.0.0.1:{}/'.format(server.server_address[1]),
+                  channel='#bench')
+    slack.queue = DeliveryQueue(slack.transmit, size=100000, workers=4)
+    observer = Observer()
+    watches = Watches(observer, lambda conf: _handler(conf['triggers'],
+                                                      slack))
+    log_dir = os.path.join(dir, 'latency')
+    os.mkdir(log_dir)
+    path = os.path.join(log_dir, 'bench.log')
+    open(path, 'w').close()
+    watches.update([{'dir': log_dir,
+                     'triggers': [{'pattern': HEADER + 'ERROR:.*',
+                                   'routers': [{'name': 'bench'}]}]}])
+    observer.start()
+
+    rnd = random.Random(args.seed)
+    written = {}
+    interval = 1. / args.rate
+    start = time.monotonic()
+    with open(path, 'a', buffering=1) as f:
+        for i in range(int(args.rate * args.duration)):
+            at = start + i * interval
+            delay = at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            level = ('ERROR' if rnd.random() < args.alert_rate / args.rate
+                     else 'INFO')
+            if level == 'ERROR':
+                written[i] = time.monotonic()
+            f.write('2017-06-01 12:00:00.000:{}:svc-0000 Something '
+                    'happened (id={})\n'.format(level, i))
+    # Let the last message, which ends at the next header or EOF, go
+    time.sleep(1.)
+
+    observer.stop()
+    observer.join()
+    watches.close()
+    slack.close()
+    server.shutdown()
+
+    latencies = sorted(server.received[i] - t for i, t in written.items()
+                       if i in server.received)
+    if not latencies:
+        print('No alerts received')
+        return
+    print('{:>8} {:>8} {:>9} {:>9} {:>9} {:>10}'.format(
+        'sent', 'received', 'p50 ms', 'p99 ms', 'max ms', 'RSS MiB'))
+    print('{:>8} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.1f}'.format(
+        len(written), len(latencies),
+        latencies[len(latencies) // 2] * 1e3,
+        latencies[int(len(latencies) * .99)] * 1e3,
+        latencies[-1] * 1e3, peak_rss()))
+
+
+BENCHMARKS = {
+    'process_file': bench_process_file,
+    'matching': bench_matching,
+    'records': bench_records,
+    'payload': bench_payload,
+    'latency': bench_latency,
+}
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--only', choices=sorted(BENCHMARKS), action='append',
+                   help='run only the given benchmark(s)')
+    p.add_argument('--lines', type=int, default=200000,
+                   help='lines of synthetic logs to read')
+    p.add_argument('--multiline-ratio', type=float, default=0.05,
+                   help='ratio of messages followed by tracebacks')
+    p.add_argument('--triggers', type=int, default=10,
+                   help='triggers to match while reading')
+    p.add_argument('--rate', type=float, default=1000.,
+                   help='lines/s written in the latency benchmark')
+    p.add_argument('--alert-rate', type=float, default=20.,
+                   help='alerts/s written in the latency benchmark')
+    p.add_argument('--duration', type=float, default=5.,
+                   help='seconds to write for in the latency benchmark')
+    p.add_argument('--seed', type=int, default=0)
+    args = p.parse_args()
+
+    dir = tempfile.mkdtemp(prefix='kikori-bench-')
+    try:
+        for name in args.only or BENCHMARKS:
+            BENCHMARKS[name](dir, args)
+    finally:
+        shutil.rmtree(dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compare sequential trigger matching against the trigger index.
+
+Run as::
+
+    $ python benchmarks/bench_triggers.py
+
+"""
+import random
+import re
+import timeit
+
+from kikori.handlers.trigger_index import TriggerIndex
+
+
+HEADER = r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+:'
+
+
+def make_patterns(n):
+    return [re.compile(HEADER + r'(?P<level>ERROR|WARNING):svc-{:04d} .*'
+                       .format(i)) for i in range(n)]
+
+
+def make_lines(n, count=1000, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        level = rnd.choice(['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+        lines.append('2017-06-01 12:00:00.000:{}:svc-{:04d} Something '
+                     'happened in the service'.format(level,
+                                                      rnd.randrange(2 * n)))
+    return lines
+
+
+def sequential(patterns, lines):
+    for line in lines:
+        for pattern in patterns:
+            pattern.match(line)
+
+
+def indexed(index, patterns, lines):
+    for line in lines:
+        for i in index.candidates(line):
+            patterns[i].match(line)
+
+
+def main():
+    print('{:>8} {:>16} {:>16}'.format('triggers', 'sequential us/line',
+                                       'indexed us/line'))
+    for n in (1, 10, 100, 1000):
+        patterns = make_patterns(n)
+        index = TriggerIndex(patterns)
+        lines = make_lines(n)
+        results = []
+        for stmt in (lambda: sequential(patterns, lines),
+                     lambda: indexed(index, patterns, lines)):
+            t = min(timeit.repeat(stmt, number=1, repeat=3))
+            results.append(t / len(lines) * 1e6)
+        print('{:>8} {:>18.2f} {:>16.2f}'.format(n, *results))
+
+
+if __name__ == '__main__':
+    main()
@@ -64,7 +64,7 @@ setup(
     install_requires=[
         'pyyaml',
         'requests',
-        'watchdog'
+        'watchdog>=4'
     ],
     extras_require={
         'dev': [
@@ -72,6 +72,9 @@ setup(
             'mock>=2.0.0',
             'pytest>=3.1.1',
             'pytest-cov>=2.5.1',
+        ],
+        'json': [
+            'orjson',
         ]
     },
     entry_points={
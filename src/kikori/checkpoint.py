@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import logging
+import os
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """Persist the state of watched files to resume from on restart.
+
+    The state of each file is saved as a dict with the keys ``dev``,
+    ``ino``, ``pos``, ``line`` and ``message``, the last being the
+    text, position and line of the message buffered at ``pos``.
+
+    Args:
+        path (str): The checkpoint file.
+        interval (float): Seconds between periodic saves.
+
+    """
+
+    def __init__(self, path, interval=5.):
+        self.path = path
+        self.interval = interval
+        self._sources = []
+        self._stopped = threading.Event()
+        self._thread = None
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            log.warning('Ignoring corrupt checkpoint file %s', self.path)
+            return {}
+        log.info('Loaded checkpoint for %d file(s) from %s',
+                 len(entries), self.path)
+        return entries
+
+    def get(self, path, st):
+        """Get the saved state of a file if it is still valid.
+
+        Args:
+            path (str): The full path to the file.
+            st (os.stat_result): The current stat of the file.
+
+        Returns:
+            dict: The state, or None if no state is saved or the file
+                has been replaced or truncated since.
+
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        if (entry['dev'], entry['ino']) != (st.st_dev, st.st_ino):
+            log.info('%s has been replaced since checkpoint', path)
+            return None
+        if entry['pos'] > st.st_size:
+            log.info('%s has been truncated since checkpoint', path)
+            return None
+        return entry
+
+    def register(self, source):
+        """Register a callable returning the states to save by path."""
+        self._sources.append(source)
+
+    def unregister(self, source):
+        """Stop saving the states from a registered callable."""
+        self._sources.remove(source)
+
+    def save(self):
+        """Atomically write the current states to the checkpoint file."""
+        entries = {}
+        for source in self._sources:
+            entries.update(source())
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.entries = entries
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.save()
+            except Exception:
+                log.exception('Failed to save checkpoint to %s', self.path)
+
+    def start(self):
+        """Start saving periodically."""
+        self._thread = threading.Thread(target=self._run, name='checkpoint')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """Stop saving periodically and save the final states."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.save()
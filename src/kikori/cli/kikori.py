@@ -23,55 +23,392 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import argparse
+import copy
 import logging
+import re
+import signal
+import sys
 import time
 
 from .. import config
+from .. import metrics
+from ..handlers.json_logger_handler import JSONLoggerHandler
 from ..handlers.text_logger_handler import TextLoggerHandler
 from ..observers import Observer
+from ..watches import Watches
 
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 
+log = logging.getLogger(__name__)
 
-def _main(no_hello=False):
+
+_HANDLERS = {
+    'json': JSONLoggerHandler,
+    'text': TextLoggerHandler,
+}
+
+
+def _create_router(name, conf, delivery=True):
+    if conf['type'] == 'slack':
+        from kikori.routers.slack import Slack
+        router = Slack(conf['webhook_url'],
+                       http=conf.get('http'),
+                       **conf.get('args', {}))
+    else:
+        raise Exception('Unknown router type')
+    router.name = name
+
+    rate_limit_conf = conf.get('rate_limit')
+    if rate_limit_conf is not None:
+        from kikori.routers.ratelimit import TokenBucket
+        router.limiter = TokenBucket(**rate_limit_conf)
+
+    if delivery:
+        _attach_delivery(router, conf)
+
+    coalesce_conf = conf.get('coalesce')
+    if coalesce_conf is not None:
+        from kikori.routers.coalescer import Coalescer
+        router.coalescer = Coalescer(router, **coalesce_conf)
+    return router
+
+
+def _attach_delivery(router, conf):
+    """Attach the delivery queue and outbox configured to a router."""
+    # Attached before the queue, so that no payload is sent without
+    # the outbox once queued
+    outbox_conf = conf.get('outbox')
+    if outbox_conf is not None:
+        from kikori.routers.outbox import Outbox
+        router.outbox = Outbox(router.resend, name=router.name,
+                               **outbox_conf)
+
+    queue_conf = conf.get('queue', {})
+    if queue_conf is not None:
+        from kikori.routers.queue import DeliveryQueue
+        router.queue = DeliveryQueue(router.transmit, name=router.name,
+                                     limiter=router.limiter, **queue_conf)
+
+
+def _terminate(signum, frame):
+    # Shut down once even if signaled again while shutting down
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def _create_routers(no_hello=False):
     routers = {}
     for k, v in config.conf.get('routers', {}).items():
-        if v['type'] == 'slack':
-            from kikori.routers.slack import Slack
-            router = Slack(v['webhook_url'], **v['args'])
-        else:
-            raise Exception('Unknown router type')
+        router = _create_router(k, v)
         if not no_hello:
             router.send_hello()
         routers[k] = router
+    return routers
+
+
+def _reload_routers(routers, confs):
+    """Apply changes in router configs to routers in place.
+
+    All routers changed are created before any is replaced, so that
+    if one fails to be created, e.g., for an invalid template, the
+    routers are left as they are.
+
+    Args:
+        routers (dict): The routers by name.
+        confs (dict): The configs the routers have been created from,
+            updated to the current ones.
+
+    """
+    new_confs = copy.deepcopy(config.conf.get('routers', {}))
+    changed = [name for name in sorted(confs.keys() | new_confs.keys())
+               if new_confs.get(name) != confs.get(name)]
+    # Payloads are sent synchronously until the old router is closed,
+    # so that the two never share a spill file or an outbox
+    created = {}
+    try:
+        for name in changed:
+            if new_confs.get(name) is not None:
+                created[name] = _create_router(name, new_confs[name],
+                                               delivery=False)
+    except Exception:
+        for router in created.values():
+            router.close()
+        raise
+
+    for name in changed:
+        router = created.get(name)
+        if router is None:
+            old = routers.pop(name, None)
+        else:
+            old = routers.get(name)
+            routers[name] = router
+        if old is not None:
+            # Deliver what has been queued with the old config
+            old.close()
+        if router is not None:
+            _attach_delivery(router, new_confs[name])
+        log.info('Router %s %s', name,
+                 'removed' if router is None else 'reloaded')
+    confs.clear()
+    confs.update(new_confs)
+
+
+def _create_checkpoints(suffix=''):
+    checkpoint_conf = config.conf.get('checkpoint')
+    if checkpoint_conf is None:
+        return None
+    from kikori.checkpoint import CheckpointStore
+    checkpoint_conf = dict(checkpoint_conf)
+    checkpoint_conf['path'] += suffix
+    return CheckpointStore(**checkpoint_conf)
+
+
+def _start_metrics(index=None):
+    """Start serving metrics if configured.
+
+    Args:
+        index (int): The index of the shard, which serves on the port
+            next to the parent's plus the index.
+
+    Returns:
+        MetricsServer: The started server, or None.
+
+    """
+    metrics_conf = config.conf.get('metrics')
+    if metrics_conf is None:
+        return None
+    metrics.enable()
+    metrics_conf = dict(metrics_conf)
+    if index is not None and metrics_conf.get('port') is not None:
+        metrics_conf['port'] += 1 + index
+    server = metrics.MetricsServer(**metrics_conf)
+    server.start()
+    return server
+
+
+def _queue_metrics(routers):
+    for name, router in list(routers.items()):
+        if router.queue is not None:
+            yield 'kikori_queue_depth', {'router': name}, len(router.queue)
+            for priority, dropped in list(
+                    router.queue.dropped_by_priority.items()):
+                yield ('kikori_queue_dropped_total',
+                       {'router': name, 'priority': priority}, dropped)
+        if router.outbox is not None:
+            yield ('kikori_outbox_pending', {'router': name},
+                   len(router.outbox))
+            yield ('kikori_outbox_dropped_total', {'router': name},
+                   router.outbox.dropped)
+        if router.limiter is not None:
+            yield ('kikori_rate_limit_wait_seconds_total', {'router': name},
+                   router.limiter.waited)
+
+
+def _lag_metrics(watches):
+    for path, lag in watches.lag().items():
+        yield 'kikori_file_lag_bytes', {'path': path}, lag
 
-    observer = Observer()
 
-    for conf in config.conf.get('watch', []):
-        dir = conf['dir']
+def _watch_confs(shard=None):
+    """Get the watch blocks to handle in this process."""
+    confs = config.conf.get('watch', [])
+    if shard is not None:
+        index, count, shard_by = shard
+        if shard_by == 'dir':
+            confs = [conf for i, conf in enumerate(confs)
+                     if i % count == index]
+    return confs
+
+
+def _create_handler(conf, routers, checkpoints=None, shard=None):
+    handler_shard = None
+    if shard is not None and shard[2] == 'file':
+        handler_shard = shard[:2]
+
+    handler_class = _HANDLERS[conf.get('type', 'text')]
+    if 'files' in conf:
+        # Matched against full paths in events and base names on init
+        filename = r'(?:.*/)?(?:{})$'.format(
+            '|'.join(re.escape(name) for name in conf['files']))
+    else:
         filename = conf['filename']
-        text_pattern = conf['text_pattern']
-        triggers = conf['triggers']
+    # Each line is a message by itself in JSON logs
+    text_pattern = conf.get('text_pattern', '')
+    triggers = conf['triggers']
+    lazy_lineno = conf.get('lineno', 'eager') == 'lazy'
+    debounce = conf.get('debounce', 0.)
+    debounce_bytes = conf.get('debounce_bytes')
+    workers = conf.get('workers', 0)
+    max_lines = conf.get('max_lines', 1000)
+    max_bytes = conf.get('max_bytes', 1 << 20)
+    flush_timeout = conf.get('flush_timeout', 0.)
+    max_open_files = conf.get('max_open_files', 512)
+
+    return handler_class(filename,
+                         text_pattern,
+                         triggers,
+                         routers,
+                         checkpoints=checkpoints,
+                         lazy_lineno=lazy_lineno,
+                         debounce=debounce,
+                         debounce_bytes=debounce_bytes,
+                         workers=workers,
+                         shard=handler_shard,
+                         max_lines=max_lines,
+                         max_bytes=max_bytes,
+                         flush_timeout=flush_timeout,
+                         max_open_files=max_open_files)
+
 
-        event_handler = TextLoggerHandler(filename,
-                                          text_pattern,
-                                          triggers,
-                                          routers)
-        event_handler.init(dir)
+def _serve(routers, checkpoints=None, shard=None, reload_routers=None):
+    """Watch files until interrupted.
 
-        observer.schedule(event_handler, dir, recursive=True)
+    Args:
+        routers (dict): The routers by name.
+        checkpoints (CheckpointStore): The checkpoint store.
+        shard (tuple): The index of this shard, the number of shards
+            and what to shard by, ``dir`` or ``file``.
+        reload_routers (callable): The function to apply changes in
+            routers with when the config is reloaded.
 
+    """
+    start = time.monotonic()
+    observer = Observer(**config.conf.get('observer', {}))
+    # Started first, so that each watch block is observed as soon as
+    # its files are initialized
     observer.start()
+    watches = Watches(observer,
+                      lambda conf: _create_handler(conf, routers,
+                                                   checkpoints, shard),
+                      checkpoints)
+    watches.update(_watch_confs(shard))
+    metrics.register(lambda: _lag_metrics(watches))
+    log.info('Started in %.2fs', time.monotonic() - start)
+
+    if checkpoints is not None:
+        checkpoints.start()
     try:
         while 1:
             time.sleep(1)
+            if config.reloaded.is_set():
+                config.reloaded.clear()
+                try:
+                    if reload_routers is not None:
+                        reload_routers()
+                    watches.update(_watch_confs(shard))
+                except Exception:
+                    # Keep running with what has been applied
+                    log.exception('Failed to reload the config')
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
 
+    watches.close()
+
+    if checkpoints is not None:
+        checkpoints.close()
+
+
+def _run_shard(index, channel, conf_path, count, shard_by):
+    from kikori.shards import RemoteRouter
+
+    # The parent process stops shards with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _terminate)
+
+    def reload_routers():
+        names = config.conf.get('routers', {})
+        for name in list(routers):
+            if name not in names:
+                del routers[name]
+        for name in names:
+            routers.setdefault(name, RemoteRouter(name, channel))
+
+    config.init(conf_path)
+    routers = {}
+    reload_routers()
+    metrics_server = _start_metrics(index)
+    _serve(routers,
+           _create_checkpoints('.{}'.format(index)),
+           shard=(index, count, shard_by),
+           reload_routers=reload_routers)
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+def _main(no_hello=False, workers=1, shard_by='dir'):
+    signal.signal(signal.SIGTERM, _terminate)
+
+    routers = _create_routers(no_hello)
+    router_confs = copy.deepcopy(config.conf.get('routers', {}))
+    metrics.register(lambda: _queue_metrics(routers))
+    metrics_server = _start_metrics()
+
+    def reload_routers():
+        _reload_routers(routers, router_confs)
+
+    if workers > 1:
+        from kikori.shards import run_shards
+        run_shards(routers, workers, _run_shard,
+                   config.conf_path, workers, shard_by,
+                   reload_routers=reload_routers)
+    else:
+        _serve(routers, _create_checkpoints(),
+               reload_routers=reload_routers)
+
+    # Deliver whatever the handlers have queued before exiting
+    for router in routers.values():
+        router.close()
+
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+def _replay(files, output='-', route=False, rate=None, workers=1,
+            watch=None):
+    from kikori.replay import find_watch
+    from kikori.replay import replay
+    from kikori.replay import ReplayRouter
+    from kikori.routers.ratelimit import TokenBucket
+
+    confs = config.conf.get('watch', [])
+    indexed = []
+    for path in files:
+        index = watch if watch is not None else find_watch(path, confs)
+        if index is None:
+            raise SystemExit('No watch block for {}; use --watch to '
+                             'choose one'.format(path))
+        indexed.append((path, index))
+
+    out = None
+    if not route:
+        out = sys.stdout if output == '-' else open(output, 'w')
+    limiter = TokenBucket(rate) if rate else None
+
+    routers = {}
+    for name, conf in config.conf.get('routers', {}).items():
+        if not route:
+            # Payloads are only rendered, at most --rate per second;
+            # nothing is sent, including what is pending in outboxes
+            conf = dict(conf, queue=None, coalesce=None, outbox=None,
+                        rate_limit=None)
+        routers[name] = ReplayRouter(name, _create_router(name, conf),
+                                     out, limiter)
+
+    start = time.monotonic()
+    try:
+        lines = replay(indexed, routers, _create_handler, workers)
+    finally:
+        for router in routers.values():
+            router.close()
+        if out is not None and out is not sys.stdout:
+            out.close()
+    log.info('Replayed %d lines of %d file(s) in %.1fs',
+             lines, len(files), time.monotonic() - start)
+
 
 def main():
     p = argparse.ArgumentParser()
@@ -79,8 +416,49 @@ def main():
         '-c', '--conf', default='conf.yml')
     p.add_argument(
         '--no-hello', action='store_true', default=False)
+    p.add_argument(
+        '--workers', type=int, default=1,
+        help='number of processes to shard watched files across')
+    p.add_argument(
+        '--shard-by', choices=['dir', 'file'], default='dir',
+        help='shard by watch block or by hash of file names')
+
+    subparsers = p.add_subparsers(dest='command')
+    replay_p = subparsers.add_parser(
+        'replay', help='run triggers over existing log files')
+    replay_p.add_argument(
+        'files', nargs='+', help='log files, optionally .gz or .bz2')
+    replay_p.add_argument(
+        '-c', '--conf', default=argparse.SUPPRESS)
+    replay_p.add_argument(
+        '-o', '--output', default='-',
+        help='file to write payloads to as JSON lines (default: stdout)')
+    replay_p.add_argument(
+        '--route', action='store_true', default=False,
+        help='send payloads with the routers instead of writing them')
+    replay_p.add_argument(
+        '--rate', type=float,
+        help='max number of matched messages per second')
+    replay_p.add_argument(
+        '--workers', type=int, default=argparse.SUPPRESS,
+        help='number of processes to replay files with')
+    replay_p.add_argument(
+        '--watch', type=int,
+        help='index of the watch block to replay all files with, '
+             'instead of the one for their directory')
     args = p.parse_args()
 
     config.init(args.conf)
 
-    _main(no_hello=args.no_hello)
+    if args.command == 'replay':
+        _replay(args.files,
+                output=args.output,
+                route=args.route,
+                rate=args.rate,
+                workers=args.workers,
+                watch=args.watch)
+        return
+
+    _main(no_hello=args.no_hello,
+          workers=args.workers,
+          shard_by=args.shard_by)
@@ -22,47 +22,195 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import logging
-import logging.handlers
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
 import random
-import threading
+import shutil
+import signal
+import sys
 import time
 
 
-logging.basicConfig(
-    level='DEBUG',
-    filename='tmp/log/error.log',
-    format=('%(asctime)s.%(msecs)03d '
-            '%(thread)x:%(levelname)s:%(name)s %(message)s'),
-    datefmt='%Y-%m-%d %H:%M:%S')
-log = logging.getLogger(__name__)
+#: Levels of messages and their weights
+LEVELS = (('DEBUG', 60), ('INFO', 30), ('WARNING', 7), ('ERROR', 3))
 
+#: Seconds between writes
+TICK = 0.01
 
-class Logger(threading.Thread):
-    def __init__(self):
-        super(Logger, self).__init__()
-        self.daemon = True
-        self.start()
+
+class Writer:
+    """Write log lines to a file at a target rate.
+
+    Args:
+        path (str): The log file.
+        rate (float): Lines per second.
+        format (str): ``text`` or ``json``, one line per message.
+        traceback_ratio (float): The ratio of messages logged with a
+            traceback, which spans multiple lines in text format.
+        rotate (float): Seconds between rotations, or 0 not to rotate.
+        rotate_mode (str): ``rename`` the file and create a new one, or
+            ``copytruncate`` it in place.
+        keep (int): The number of rotated files to keep.
+        seed (int): The seed of the random content.
+        duration (float): Seconds to write for, or 0 until interrupted.
+
+    """
+
+    def __init__(self, path, rate=100., format='text', traceback_ratio=0.01,
+                 rotate=0., rotate_mode='rename', keep=3, seed=0,
+                 duration=0.):
+        self.path = path
+        self.rate = rate
+        self.format = format
+        self.traceback_ratio = traceback_ratio
+        self.rotate = rotate
+        self.rotate_mode = rotate_mode
+        self.keep = keep
+        self.duration = duration
+        self.count = 0
+        self.messages = 0
+        self.rotations = 0
+        self._random = random.Random(seed)
+        self._levels = [level for level, weight in LEVELS
+                        for _ in range(weight)]
+
+    def message(self, now):
+        """Generate the lines of a message logged at a formatted time."""
+        rnd = self._random
+        if rnd.random() < self.traceback_ratio:
+            level = 'ERROR'
+            traceback = ['Traceback (most recent call last):']
+            for i in range(rnd.randrange(2, 20)):
+                traceback.append('  File "app.py", line {}, in f{}'.format(
+                    rnd.randrange(1000), i))
+            traceback.append('ValueError: something went wrong')
+        else:
+            level = rnd.choice(self._levels)
+            traceback = []
+        self.messages += 1
+        text = 'Something happened (id={})'.format(self.messages)
+        name = 'svc-{:02d}'.format(rnd.randrange(100))
+
+        if self.format == 'json':
+            record = {'time': now, 'level': level, 'name': name,
+                      'message': text}
+            if traceback:
+                record['exc_info'] = '\n'.join(traceback)
+            return [json.dumps(record)]
+        return ['{}:{}:{} {}'.format(now, level, name, text)] + traceback
 
     def run(self):
-        while 1:
-            p = random.random()
-            if p < 0.01:
-                try:
-                    raise Exception('Something happened')
-                except Exception as e:
-                    log.exception('Error (%r)', e)
-            elif p < 0.03:
-                log.warning('I warn you! (%r)' % time.time())
-            elif p < 0.07:
-                log.info('Some informational message (%r)' % time.time())
-            else:
-                log.debug('Some debugging message (%r)' % time.time())
-
-            time.sleep(0 + 0.2 * random.random())
+        """Write until the duration passes or interrupted."""
+        f = open(self.path, 'a')
+        start = time.monotonic()
+        next_rotation = start + self.rotate
+        # Lines written at most at once, so that a writer falling
+        # behind still rotates and stops in time
+        max_lines = max(int(self.rate * TICK * 10), 1)
+        try:
+            while 1:
+                now = time.monotonic()
+                if self.duration and now - start >= self.duration:
+                    break
+                lines = []
+                due = min(int((now - start) * self.rate) - self.count,
+                          max_lines)
+                if due > 0:
+                    formatted = datetime.datetime.now().strftime(
+                        '%Y-%m-%d %H:%M:%S.%f')[:-3]
+                    while len(lines) < due:
+                        lines.extend(self.message(formatted))
+                    f.write('\n'.join(lines) + '\n')
+                    f.flush()
+                    self.count += len(lines)
+                if self.rotate and now >= next_rotation:
+                    f = self._rotate(f)
+                    next_rotation += self.rotate
+                time.sleep(TICK)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            f.close()
+        return self.count, self.rotations
+
+    def _rotate(self, f):
+        for i in range(self.keep - 1, 0, -1):
+            src = '{}.{}'.format(self.path, i)
+            if os.path.exists(src):
+                os.replace(src, '{}.{}'.format(self.path, i + 1))
+        self.rotations += 1
+        if self.rotate_mode == 'copytruncate':
+            shutil.copyfile(self.path, self.path + '.1')
+            f.truncate(0)
+            return f
+        f.close()
+        os.rename(self.path, self.path + '.1')
+        return open(self.path, 'a')
+
+
+def _run(writer, results):
+    results.put(writer.run())
 
 
 def main():
-    logger = Logger()
-    while 1:
-        pass
+    p = argparse.ArgumentParser(
+        description='Write synthetic logs to stress test kikori.')
+    p.add_argument('--dir', default='tmp/log')
+    p.add_argument('--files', type=int, default=1,
+                   help='number of files to write')
+    p.add_argument('--rate', type=float, default=10.,
+                   help='lines per second per file')
+    p.add_argument('--format', choices=['text', 'json'], default='text')
+    p.add_argument('--traceback-ratio', type=float, default=0.01,
+                   help='ratio of messages logged with a traceback')
+    p.add_argument('--rotate', type=float, default=0.,
+                   help='seconds between rotations; 0 not to rotate')
+    p.add_argument('--rotate-mode', choices=['rename', 'copytruncate'],
+                   default='rename')
+    p.add_argument('--keep', type=int, default=3,
+                   help='number of rotated files to keep')
+    p.add_argument('--duration', type=float, default=0.,
+                   help='seconds to write for; 0 until interrupted')
+    p.add_argument('--seed', type=int, default=0)
+    args = p.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    ext = '.json' if args.format == 'json' else '.log'
+    writers = [Writer(os.path.join(args.dir, 'app{:03d}{}'.format(i, ext)),
+                      rate=args.rate,
+                      format=args.format,
+                      traceback_ratio=args.traceback_ratio,
+                      rotate=args.rotate,
+                      rotate_mode=args.rotate_mode,
+                      keep=args.keep,
+                      seed=args.seed + i,
+                      duration=args.duration)
+               for i in range(args.files)]
+
+    # A process per file, so that writers are not bound by one CPU
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_run, args=(w, results))
+                 for w in writers]
+    start = time.monotonic()
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            if p.is_alive():
+                os.kill(p.pid, signal.SIGINT)
+    counts = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    elapsed = time.monotonic() - start
+
+    count = sum(c for c, _ in counts)
+    sys.stderr.write('Wrote {} lines to {} file(s) in {:.1f}s '
+                     '({:.0f} lines/s), rotated {} time(s)\n'.format(
+                         count, len(writers), elapsed, count / elapsed,
+                         sum(r for _, r in counts)))
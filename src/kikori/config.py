@@ -24,6 +24,8 @@
 # SOFTWARE.
 import logging
 import signal
+import threading
+
 import yaml
 
 
@@ -33,6 +35,9 @@ log = logging.getLogger(__name__)
 conf_path = None
 conf = None
 
+#: Set on reload, for the service to apply the new config
+reloaded = threading.Event()
+
 
 def set_conf_path(path):
     globals()['conf_path'] = path
@@ -42,11 +47,16 @@ def load(path=None):
     path = path or globals()['conf_path']
     log.info('Loading app config at %s', path)
     with open(path) as f:
-        globals()['conf'] = yaml.load(f)
+        globals()['conf'] = yaml.safe_load(f)
 
 
 def handler(signum, frame):
-    load()
+    try:
+        load()
+    except Exception:
+        log.exception('Failed to reload app config; keeping the current')
+        return
+    reloaded.set()
 
 
 signal.signal(signal.SIGUSR1, handler)
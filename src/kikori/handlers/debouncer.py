@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class Debouncer:
+    """Collapse items by key and process each key at most once per tick.
+
+    An item added under a key already pending replaces the pending one,
+    so that a burst of events for a file is processed once.
+
+    Args:
+        callback (callable): Called with each item to process.
+        tick (float): Seconds between processing pending items.
+
+    """
+
+    def __init__(self, callback, tick=0.1):
+        self.callback = callback
+        self.tick = tick
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name='debouncer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, key, item):
+        """Add an item to process on the next tick."""
+        with self._lock:
+            self._pending[key] = item
+
+    def pop(self, key):
+        """Remove the item pending for a key.
+
+        Returns:
+            The item, or None if none is pending.
+
+        """
+        with self._lock:
+            return self._pending.pop(key, None)
+
+    def flush(self):
+        """Process all pending items."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for item in pending.values():
+            try:
+                self.callback(item)
+            except Exception:
+                log.exception('Failed to process %r', item)
+
+    def _run(self):
+        while not self._stopped.wait(self.tick):
+            self.flush()
+
+    def close(self):
+        """Stop ticking after processing all pending items."""
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
@@ -22,96 +22,768 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import copy
+import collections
+import concurrent.futures
+import contextlib
+import json
 import logging
 import os
 import re
 import threading
-from types import SimpleNamespace
+import time
+import zlib
 
-from watchdog.events import LoggingEventHandler
+from watchdog.events import EVENT_TYPE_CREATED
+from watchdog.events import EVENT_TYPE_DELETED
+from watchdog.events import EVENT_TYPE_MODIFIED
+from watchdog.events import EVENT_TYPE_MOVED
+from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer  # noqa
 
+from .. import metrics
 from ..utils import count_lines
+from ..utils import LineIndex
+from ..utils import read_lines
+from ..utils.regex import compile_bytes
+from ..utils.tail import TailReader
+from .debouncer import Debouncer
+from .workers import KeyedExecutor
 
 
 log = logging.getLogger(__name__)
 
 
-def _create_cursor(path, pos, line):
-    return SimpleNamespace(path=path, pos=pos, line=line)
+_LINES_READ = metrics.key('kikori_lines_read_total')
+_BYTES_READ = metrics.key('kikori_bytes_read_total')
+_MESSAGES = metrics.key('kikori_messages_total')
+
+
+def _count(counts, key, value=1):
+    counts[key] = counts.get(key, 0) + value
+
+
+# Other events, like those inotify emits for files opened and closed,
+# are of no use to handlers
+_EVENT_TYPES = frozenset([EVENT_TYPE_CREATED,
+                          EVENT_TYPE_DELETED,
+                          EVENT_TYPE_MODIFIED,
+                          EVENT_TYPE_MOVED])
+
+
+class Cursor:
+    """A position in a watched file.
+
+    Args:
+        path (str): The full path to the file.
+        pos (int): The byte offset past the last line read.
+        line (int): The number of lines before ``pos``, or None to
+            count it with ``index`` only when asked for.
+        dev (int): The device of the file.
+        ino (int): The inode of the file.
+        index (LineIndex): The line index of the file.
+
+    """
+
+    __slots__ = ('path', 'pos', '_line', 'dev', 'ino', 'index')
+
+    def __init__(self, path, pos, line=None, dev=None, ino=None,
+                 index=None):
+        self.path = path
+        self.pos = pos
+        self._line = line
+        self.dev = dev
+        self.ino = ino
+        self.index = index
+
+    def __repr__(self):
+        return 'Cursor(path={!r}, pos={!r}, line={!r})'.format(
+            self.path, self.pos, self._line)
+
+    @property
+    def line(self):
+        if self._line is None and self.index is not None:
+            return self.index.line_at(self.pos)
+        return self._line
+
+    def advance(self, pos):
+        """Move past a line ending at a byte offset."""
+        self.pos = pos
+        if self._line is not None:
+            self._line += 1
+
+
+class Message:
+    """A log message buffered line by line.
+
+    Lines beyond the limits of a message are dropped and counted, so
+    that a runaway multiline message takes bounded memory, and noted
+    at the end of its text.
+
+    Only the position of the first line is kept along with the cursor
+    of the file, which keeps advancing, and a cursor of the message is
+    made only when it is asked for, i.e., when the message is routed.
+
+    Args:
+        text (bytes): The first line of the message, or None.
+        cursor (Cursor): The cursor at the end of the first line.
+
+    """
+
+    __slots__ = ('_file', 'pos', '_line', 'truncated', '_first', '_rest',
+                 '_size', '_text')
+
+    #: Appended to the text of a message with lines dropped
+    truncation_marker = '\n[{} more line(s) truncated]'
+
+    def __init__(self, text, cursor):
+        self._file = cursor
+        self.pos = cursor.pos
+        self._line = cursor._line
+        self.truncated = 0
+        self._first = text
+        # The lines after the first, if any
+        self._rest = None
+        self._size = 0 if text is None else len(text)
+        self._text = text
+
+    def __repr__(self):
+        return 'Message(size={!r}, path={!r}, pos={!r})'.format(
+            self._size, self._file.path, self.pos)
+
+    def __len__(self):
+        """The bytes buffered, which are none if no message started."""
+        return self._size
+
+    @property
+    def path(self):
+        """str: The full path to the file of the message."""
+        return self._file.path
+
+    @property
+    def cursor(self):
+        """Cursor: A new cursor at the end of the first line."""
+        f = self._file
+        return Cursor(f.path, self.pos, self._line, f.dev, f.ino, f.index)
+
+    @property
+    def text(self):
+        """bytes: The text of the message, or None."""
+        if self._text is None and self._first is not None:
+            text = b'\n'.join([self._first] + self._rest)
+            if self.truncated:
+                text += self.truncation_marker.format(
+                    self.truncated).encode()
+            self._text = text
+        return self._text
+
+    def append(self, line, max_lines=None, max_bytes=None):
+        """Append a line, or drop it if the message is full.
+
+        Args:
+            line (bytes): The line, without the newline.
+            max_lines (int): The maximum number of lines.
+            max_bytes (int): The maximum number of bytes.
+
+        """
+        rest = self._rest
+        if rest is None:
+            rest = self._rest = []
+        if (self.truncated or
+                max_lines is not None and len(rest) + 1 >= max_lines or
+                max_bytes is not None and
+                self._size + 1 + len(line) > max_bytes):
+            self.truncated += 1
+        else:
+            rest.append(line)
+            self._size += 1 + len(line)
+        self._text = None
 
 
 def create_message(text, cursor):
-    return SimpleNamespace(text=text, cursor=copy.copy(cursor))
+    return Message(text, cursor)
 
 
-class EventHandler(LoggingEventHandler):
+class EventHandler(FileSystemEventHandler):
 
-    def __init__(self, filename, text_pattern, triggers, routers, **kwargs):
+    #: The encoding of watched files
+    encoding = 'utf-8'
+
+    def __init__(self, filename, text_pattern, triggers, routers,
+                 checkpoints=None, lazy_lineno=False, debounce=0.,
+                 debounce_bytes=None, workers=0, shard=None,
+                 max_lines=1000, max_bytes=1 << 20, flush_timeout=0.,
+                 max_open_files=512, **kwargs):
         super(EventHandler, self).__init__(**kwargs)
         self._cache = {}
+        # Open readers of files from the least recently read, of which
+        # at most max_open_files are kept open
+        self._readers = collections.OrderedDict()
+        self.max_open_files = max_open_files
+        # The stats of files found on lazy init, by path, until their
+        # states are initialized on their first events
+        self._unmaterialized = {}
+        # Maps the original path of each rotated file still drained to
+        # its new path
+        self._rotated = {}
         self.filename = re.compile(filename)
-        self.text_pattern = re.compile(text_pattern)
-        self.triggers = [self._load_trigger(t) for t in triggers]
+        self.text_pattern = compile_bytes(text_pattern, self.encoding)
+        self.triggers = []
+        self._loaded_triggers = {}
+        self.set_triggers(triggers)
         self.routers = routers
+        self.lazy_lineno = lazy_lineno
+        # The index of the shard of files to watch and the number of
+        # shards, if files are sharded across processes
+        self.shard = shard
 
+        # Each file is processed under its own lock, so that different
+        # files can be processed concurrently. Entries of the dicts
+        # keyed by path are only replaced or removed under the lock of
+        # the path; the dicts themselves rely on the atomicity of
+        # single dict operations.
         self._lock = threading.Lock()
+        self._file_locks = {}
+
+        # Metrics counted by each thread while processing, recorded at
+        # once afterwards
+        self._local = threading.local()
+
+        # Events are processed by a pool of workers if given, in order
+        # per file
+        self._executor = KeyedExecutor(workers) if workers else None
+
+        self.checkpoints = checkpoints
+        if checkpoints is not None:
+            checkpoints.register(self.checkpoint)
+
+        # Modified events are collapsed per file and processed once
+        # per debounce seconds, or as soon as debounce_bytes are
+        # pending
+        self.debounce_bytes = debounce_bytes
+        self._debouncer = None
+        if debounce:
+            self._debouncer = Debouncer(self._dispatch, debounce)
+
+        # Lines beyond these are dropped from a multiline message
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+
+        # A message at the end of a file is held for continuation lines
+        # until no line is appended for one to two flush_timeout
+        # seconds, rather than assumed complete
+        self._flusher = None
+        if flush_timeout:
+            self._flusher = Debouncer(self._flush_message, flush_timeout)
 
     def _load_trigger(self, trigger):
         raise NotImplementedError
 
+    def set_triggers(self, triggers):
+        """Set the triggers, loading only the ones not loaded before.
+
+        Args:
+            triggers (list): The trigger configs, which are left
+                unmodified.
+
+        Returns:
+            int: The number of triggers loaded.
+
+        """
+        return self.apply_triggers(self.load_triggers(triggers))
+
+    def load_triggers(self, triggers):
+        """Load triggers not loaded before, without setting them.
+
+        Args:
+            triggers (list): The trigger configs, which are left
+                unmodified.
+
+        Returns:
+            tuple: The triggers to set with :meth:`apply_triggers`.
+
+        """
+        loaded = {}
+        result = []
+        for trigger in triggers:
+            key = json.dumps(trigger, sort_keys=True, default=str)
+            if key not in loaded:
+                loaded[key] = self._loaded_triggers.get(key)
+                if loaded[key] is None:
+                    loaded[key] = self._load_trigger(dict(trigger))
+                    label = loaded[key]['label'] = trigger.get('name') or (
+                        trigger['pattern']
+                        if isinstance(trigger['pattern'], str) else
+                        json.dumps(trigger['pattern'], sort_keys=True,
+                                   default=str))
+                    loaded[key]['metric_keys'] = (
+                        metrics.key('kikori_trigger_seconds_total',
+                                    trigger=label),
+                        metrics.key('kikori_trigger_matches_total',
+                                    trigger=label))
+            result.append(loaded[key])
+        return loaded, result
+
+    def apply_triggers(self, triggers):
+        """Set triggers loaded by :meth:`load_triggers`.
+
+        Returns:
+            int: The number of triggers loaded.
+
+        """
+        loaded, result = triggers
+        count = len(loaded.keys() - self._loaded_triggers.keys())
+        self._loaded_triggers = loaded
+        self.triggers = result
+        return count
+
     def dispatch(self, event):
-        if self._is_valid_event(event):
+        if not self.accepts(event):
+            return
+        if self._debouncer is not None:
+            fullpath = self._get_full_path(event.src_path)
+            if (event.event_type == 'modified' and
+                    not self._has_pending_bytes(fullpath)):
+                self._debouncer.add(fullpath, event)
+                return
+            # Keep events for a file in order
+            pending = self._debouncer.pop(fullpath)
+            if pending is not None:
+                self._dispatch(pending)
+        return self._dispatch(event)
+
+    def _dispatch(self, event):
+        if self._executor is None:
             return super().dispatch(event)
+        self._executor.submit(self._get_full_path(event.src_path),
+                              super().dispatch, event)
 
-    def on_created(self, event):
+    def _file_lock(self, path):
+        """Get the lock of a file, to unref by :meth:`_unref_file_locks`.
+
+        The lock of a file no longer watched is dropped once no thread
+        refers to it, so that locks do not pile up for files rotated
+        away or deleted.
+
+        """
         with self._lock:
-            fullpath = self._get_full_path(event.src_path)
-            with open(event.src_path) as f:
-                self._create_cache_entry(fullpath, f)
+            entry = self._file_locks.get(path)
+            if entry is None:
+                entry = self._file_locks[path] = [threading.RLock(), 0]
+            entry[1] += 1
+            return entry[0]
 
-    def on_deleted(self, event):
+    def _unref_file_locks(self, paths):
         with self._lock:
-            self._remove_from_cache(event.src_path)
+            for path in paths:
+                entry = self._file_locks[path]
+                entry[1] -= 1
+                if (not entry[1] and path not in self._cache and
+                        path not in self._rotated):
+                    del self._file_locks[path]
+
+    @contextlib.contextmanager
+    def _locked(self, *paths):
+        """Hold the locks of files, taken in order to avoid deadlocks."""
+        paths = sorted(set(paths) - {None})
+        locks = [self._file_lock(p) for p in paths]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+            self._unref_file_locks(paths)
+
+    def _has_pending_bytes(self, path):
+        """Check if debounce_bytes are pending in a file."""
+        if not self.debounce_bytes:
+            return False
+        cache = self._cache.get(path)
+        if cache is None:
+            return False
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            return False
+        return size - cache[0].pos >= self.debounce_bytes
+
+    def close(self):
+        """Process pending events and close watched files."""
+        if self._debouncer is not None:
+            self._debouncer.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._flusher is not None:
+            self._flusher.close()
+            for path in list(self._cache):
+                with self._locked(path):
+                    self._process_buffered(path)
+        for path in list(self._readers):
+            with self._locked(path):
+                reader = self._readers.pop(path, None)
+                if reader is not None:
+                    reader.close()
+
+    def on_created(self, event):
+        fullpath = self._get_full_path(event.src_path)
+        with self._locked(fullpath, self._rotated.get(fullpath)):
+            self._materialize(fullpath)
+            self._drain_rotated(fullpath)
+            if fullpath in self._cache:
+                self._check_file(fullpath)
+            else:
+                # Whatever is in a new file has been written after it
+                # is created
+                self._create_cache_entry(fullpath, from_start=True)
+
+    def on_deleted(self, event):
+        fullpath = self._get_full_path(event.src_path)
+        with self._locked(fullpath):
+            self._materialize(fullpath)
+            self._drain(fullpath)
 
     def on_modified(self, event):
-        with self._lock:
-            with open(event.src_path, 'r') as f:
-                self._process_file(f)
+        fullpath = self._get_full_path(event.src_path)
+        with self._locked(fullpath, self._rotated.get(fullpath)):
+            self._materialize(fullpath)
+            self._drain_rotated(fullpath)
+            try:
+                if fullpath not in self._cache:
+                    self._create_cache_entry(fullpath, from_start=True)
+                self._check_file(fullpath)
+                self._process_file(fullpath)
+            except FileNotFoundError:
+                # Moved or deleted by the time the event is processed
+                log.debug('%s no longer exists', fullpath)
 
     def on_moved(self, event):
-        with self._lock:
-            self._remove_from_cache(event.src_path)
+        src_path = self._get_full_path(event.src_path)
+        dest_path = self._get_full_path(event.dest_path)
+        with self._locked(src_path, dest_path):
+            self._materialize(src_path, dest_path)
+            if (src_path in self._cache and
+                    self._is_moved_file(src_path, dest_path)):
+                self._move_cache_entry(src_path, dest_path)
+                # Finish what has been written before rotation
+                self._process_file(dest_path)
+                if not self._is_valid_filename(dest_path):
+                    # Keep draining the rotated file until the writer
+                    # switches to a new file at the original path
+                    self._rotated[src_path] = dest_path
+            elif self._is_valid_filename(dest_path):
+                self._drain(dest_path)
+                self._create_cache_entry(dest_path)
 
-    def all_watched_files(self, dir):
-        for root, dirs, filenames in os.walk(dir):
-            for filename in filenames:
-                if not self._is_valid_filename(filename):
-                    continue
-                yield self._get_full_path(os.path.join(root, filename))
-
-    def init(self, dir):
-        for fullpath in self.all_watched_files(dir):
-            with open(fullpath) as f:
-                cache = self._create_cache_entry(fullpath, f)
-            log.info('Caching current state of watched file %s: %r',
-                     fullpath, cache)
-
-    def _create_cache_entry(self, fullpath, f):
-        line = count_lines(f)
-        pos = f.tell()
-        cursor = _create_cursor(path=fullpath, pos=pos, line=line)
+    def _scan_dir(self, path):
+        """List the files to watch and the subdirectories of a directory.
+
+        Returns:
+            tuple: The full paths and stats of the files, and the paths
+                of the subdirectories.
+
+        """
+        files, dirs = [], []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif (self._is_valid_filename(entry.name) and
+                          entry.is_file()):
+                        files.append((self._get_full_path(entry.path),
+                                      entry.stat()))
+        except FileNotFoundError:
+            # Removed since listed
+            log.debug('%s no longer exists', path)
+        return files, dirs
+
+    def scan(self, dir, depth=None, executor=None):
+        """Find and stat the files to watch in a directory.
+
+        Args:
+            dir (str): The directory.
+            depth (int): How many levels of subdirectories to look in,
+                or None for all.
+            executor (concurrent.futures.Executor): The thread pool to
+                list directories in parallel with.
+
+        Yields:
+            tuple: The full path and stat of each file.
+
+        """
+        if executor is None:
+            pending = [(dir, 0)]
+            while pending:
+                path, level = pending.pop()
+                files, dirs = self._scan_dir(path)
+                yield from files
+                if depth is None or level < depth:
+                    pending.extend((d, level + 1) for d in dirs)
+            return
+
+        futures = {executor.submit(self._scan_dir, dir): 0}
+        while futures:
+            done, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                level = futures.pop(future)
+                files, dirs = future.result()
+                yield from files
+                if depth is None or level < depth:
+                    for d in dirs:
+                        futures[executor.submit(self._scan_dir, d)] = \
+                            level + 1
+
+    def lag(self):
+        """Get the bytes written to watched files but not read yet.
+
+        Returns:
+            dict: The bytes by full path.
+
+        """
+        result = {}
+        for path, (cursor, _) in list(self._cache.items()):
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            result[path] = max(size - cursor.pos, 0)
+        return result
+
+    def adopt(self, other):
+        """Take over the states of watched files from another handler.
+
+        The other handler should be closed first, so that the files are
+        read on from where it has stopped. Each file is taken over by
+        one handler only.
+
+        Args:
+            other (EventHandler): The handler replaced by this one.
+
+        """
+        for path in list(other._cache):
+            if self._is_valid_filename(path):
+                self._cache[path] = other._cache.pop(path)
+                if path in other._rotated:
+                    self._rotated[path] = other._rotated.pop(path)
+        for path in list(other._unmaterialized):
+            if self._is_valid_filename(path):
+                self._unmaterialized[path] = other._unmaterialized.pop(path)
+
+    def init(self, dir, depth=None, executor=None, lazy=False):
+        """Initialize the states of the files to watch in a directory.
+
+        Args:
+            dir (str): The directory.
+            depth (int): How many levels of subdirectories to look in,
+                or None for all.
+            executor (concurrent.futures.Executor): The thread pool to
+                list directories in parallel with.
+            lazy (bool): Only stat the files, deferring the rest until
+                their first events, when lines are not counted but
+                indexed as with ``lazy_lineno``.
+
+        Returns:
+            int: The number of files found.
+
+        """
+        files = [(fullpath, st)
+                 for fullpath, st in self.scan(dir, depth, executor)
+                 # Unless adopted from the handler replaced on reload
+                 if fullpath not in self._cache and
+                 fullpath not in self._unmaterialized]
+        if lazy:
+            self._unmaterialized.update(files)
+        else:
+            # Counting lines is bound by the GIL rather than I/O, so
+            # files are initialized one at a time
+            for fullpath, st in files:
+                self._init_file(fullpath, st)
+        return len(files)
+
+    def _materialize(self, *paths):
+        """Initialize the states of files found on lazy init."""
+        for path in paths:
+            st = self._unmaterialized.pop(path, None)
+            if st is None:
+                continue
+            try:
+                # Not to block events by counting lines of a large file
+                self._init_file(path, st, lazy_lineno=True)
+            except FileNotFoundError:
+                log.debug('%s no longer exists', path)
+
+    def _init_file(self, fullpath, st, lazy_lineno=False):
+        with self._locked(fullpath):
+            entry = None
+            from_start = False
+            if self.checkpoints is not None:
+                entry = self.checkpoints.get(fullpath, st)
+                # A file replaced or truncated since checkpoint has
+                # been written anew while kikori was down
+                from_start = (entry is None and
+                              fullpath in self.checkpoints.entries)
+            if entry is None:
+                cache = self._create_cache_entry(fullpath, st, from_start,
+                                                 lazy_lineno)
+                log.info('Caching current state of watched file %s: %r',
+                         fullpath, cache)
+                if from_start:
+                    self._process_file(fullpath)
+            else:
+                cache = self._restore_cache_entry(fullpath, entry,
+                                                  lazy_lineno)
+                log.info('Resuming watched file %s from checkpoint: %r',
+                         fullpath, cache)
+                # Process what has been written since checkpoint
+                self._process_file(fullpath)
+
+    def replay(self, f, path):
+        """Process all lines of a stream as if appended to a new file.
+
+        Args:
+            f: A binary stream.
+            path (str): The full path messages are attributed to.
+
+        Returns:
+            int: The number of lines processed.
+
+        """
+        cursor = Cursor(path, 0, 0)
+        message = create_message(None, cursor)
+        with self._counting():
+            for line, pos in read_lines(f):
+                cursor.advance(pos)
+                message = self._build_message(cursor, message, line)
+            if message.text:
+                self._process_message(message)
+        return cursor.line
+
+    @contextlib.contextmanager
+    def _counting(self):
+        """Count metrics locally, and record them at once at the end.
+
+        Nothing is counted unless metrics are enabled.
+
+        """
+        if (not metrics.registry.enabled or
+                getattr(self._local, 'counts', None) is not None):
+            yield
+            return
+        counts = self._local.counts = {}
+        try:
+            yield
+        finally:
+            self._local.counts = None
+            metrics.registry.add(counts)
+
+    def _count_lines(self, fullpath, pos, lazy=False):
+        """Count lines before pos, or defer it in lazy mode or if lazy.
+
+        Returns:
+            tuple: The line count, or None if deferred, and the line
+                index to count it with later.
+
+        """
+        if self.lazy_lineno or lazy:
+            return None, LineIndex(fullpath)
+        with open(fullpath, 'rb') as f:
+            return count_lines(f, pos), None
+
+    def _create_cache_entry(self, fullpath, st=None, from_start=False,
+                            lazy_lineno=False):
+        st = st or os.stat(fullpath)
+        if from_start:
+            pos, line, index = 0, 0, None
+        else:
+            # Reading starts at the current end of file
+            pos = st.st_size
+            line, index = self._count_lines(fullpath, pos, lazy_lineno)
+        cursor = Cursor(fullpath, pos, line, dev=st.st_dev, ino=st.st_ino,
+                        index=index)
         message = create_message(None, cursor)
         self._cache[fullpath] = cursor, message
         return self._cache[fullpath]
 
+    def _restore_cache_entry(self, fullpath, entry, lazy_lineno=False):
+        line, index = entry['line'], None
+        if line is None or self.lazy_lineno:
+            line, index = self._count_lines(fullpath, entry['pos'],
+                                            lazy_lineno)
+        cursor = Cursor(fullpath, entry['pos'], line, dev=entry['dev'],
+                        ino=entry['ino'], index=index)
+        saved = entry['message']
+        text = saved['text']
+        if text is not None:
+            text = text.encode(self.encoding, 'surrogateescape')
+        message = create_message(text, Cursor(
+            fullpath, saved['pos'], saved['line'], dev=entry['dev'],
+            ino=entry['ino'], index=index or LineIndex(fullpath)))
+        self._cache[fullpath] = cursor, message
+        return self._cache[fullpath]
+
+    def checkpoint(self):
+        """Get the states of watched files to save in checkpoint.
+
+        Returns:
+            dict: The states by full path.
+
+        """
+        # Taken first, so that a file initialized meanwhile is in either
+        unmaterialized = list(self._unmaterialized.items())
+        entries = {}
+        for path in list(self._cache):
+            with self._locked(path):
+                cache = self._cache.get(path)
+                if cache is None:
+                    continue
+                cursor, message = cache
+                text = message.text
+                if text is not None:
+                    text = text.decode(self.encoding, 'surrogateescape')
+                entries[path] = {'dev': cursor.dev,
+                                 'ino': cursor.ino,
+                                 'pos': cursor.pos,
+                                 'line': cursor._line,
+                                 'message': {'text': text,
+                                             'pos': message.pos,
+                                             'line': message._line}}
+        for path, st in unmaterialized:
+            if path in entries:
+                continue
+            # Carried over from the last checkpoint until initialized
+            entry = self.checkpoints.entries.get(path)
+            if entry is None:
+                entry = {'dev': st.st_dev,
+                         'ino': st.st_ino,
+                         'pos': st.st_size,
+                         'line': None,
+                         'message': {'text': None,
+                                     'pos': st.st_size,
+                                     'line': None}}
+            entries[path] = entry
+        return entries
+
     def _is_valid_filename(self, filename):
-        return self.filename.match(filename)
+        if not self.filename.match(filename):
+            return False
+        if self.shard is not None:
+            index, count = self.shard
+            basename = os.path.basename(filename)
+            return zlib.crc32(basename.encode()) % count == index
+        return True
 
-    def _is_valid_event(self, event):
-        return (not event.is_directory and
-                self._is_valid_filename(event.src_path))
+    def accepts(self, event):
+        """Check if an event is for a file this handler watches."""
+        if event.is_directory or event.event_type not in _EVENT_TYPES:
+            return False
+        paths = [event.src_path]
+        if event.event_type == 'moved':
+            paths.append(event.dest_path)
+        return any(self._is_valid_filename(path) or
+                   self._get_full_path(path) in self._cache
+                   for path in paths)
 
     def _get_full_path(self, path):
         return os.path.abspath(path)
@@ -119,48 +791,213 @@ class EventHandler(LoggingEventHandler):
     def _remove_from_cache(self, path):
         path = self._get_full_path(path)
         if path in self._cache:
+            self._process_buffered(path)
             del self._cache[path]
+        reader = self._readers.pop(path, None)
+        if reader is not None:
+            reader.close()
+        for src_path, dest_path in list(self._rotated.items()):
+            if dest_path == path:
+                self._rotated.pop(src_path, None)
 
-    def _process_file(self, f):
-        """Process a log file when a modified event triggers.
+    def _is_moved_file(self, src_path, dest_path):
+        """Check the file moved is the one watched at the source path.
 
-        Args:
-            f (stream): A stream object to the modified log file.
+        It is not if the file at the source path has been found replaced
+        by a new one before the move is handled.
 
         """
-        path = self._get_full_path(f.name)
+        cursor, _ = self._cache[src_path]
+        try:
+            st = os.stat(dest_path)
+        except FileNotFoundError:
+            # Moved on again; assume it is
+            return True
+        return (st.st_dev, st.st_ino) == (cursor.dev, cursor.ino)
+
+    def _move_cache_entry(self, src_path, dest_path):
+        if dest_path in self._cache:
+            self._drain(dest_path)
+        cursor, message = self._cache.pop(src_path)
+        cursor.path = dest_path
+        if cursor.index is not None:
+            cursor.index.path = dest_path
+        self._cache[dest_path] = cursor, message
+        if src_path in self._readers:
+            self._readers[dest_path] = self._readers.pop(src_path)
 
+    def _drain(self, path):
+        """Process what is left in a file and stop watching it."""
+        if path not in self._cache:
+            return
+        if path in self._readers:
+            # The open descriptor can still be read even if the file
+            # has been moved or deleted
+            self._process_file(path)
+        self._remove_from_cache(path)
+
+    def _drain_rotated(self, path):
+        """Stop draining the file rotated from a path."""
+        rotated_path = self._rotated.pop(path, None)
+        if rotated_path is not None:
+            log.info('Finished draining %s rotated from %s',
+                     rotated_path, path)
+            self._drain(rotated_path)
+
+    def _check_file(self, path):
+        """Start over a watched file if it is replaced or truncated."""
         cursor, message = self._cache[path]
-        f.seek(cursor.pos)
-
-        while 1:
-            # Read a line from the current position, including the
-            # newline at the end
-            s = f.readline()
-
-            if s == '':
-                # This is effectively an EOF. Although depending on
-                # how buffer flush happens, it could be in the middle
-                # of multiline log message. Here it is assumed that
-                # EOF always contains a full multiline message.
-                if message.text is not None:
-                    self._process_message(message)
-                message = create_message('', cursor)
-
-                self._cache[path] = cursor, message
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        if (st.st_dev, st.st_ino) != (cursor.dev, cursor.ino):
+            log.info('%s has been replaced', path)
+            self._drain(path)
+        elif st.st_size < cursor.pos:
+            log.info('%s has been truncated', path)
+            self._remove_from_cache(path)
+        else:
+            return
+        self._create_cache_entry(path, st, from_start=True)
+
+    def _get_reader(self, path, cursor):
+        """Get the reader of a file, opening it again if closed.
+
+        Returns:
+            TailReader: The reader, or None if the file of the cursor
+                cannot be opened.
+
+        """
+        reader = self._readers.get(path)
+        if reader is not None:
+            self._readers.move_to_end(path)
+            return reader
+        try:
+            reader = TailReader(path, cursor.pos)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            # E.g., too many open files; read on the next event
+            log.error('Failed to open %s: %s', path, e)
+            return None
+        st = reader.stat()
+        if (cursor.dev is not None and
+                (st.st_dev, st.st_ino) != (cursor.dev, cursor.ino)):
+            # Replaced since its reader was closed
+            reader.close()
+            return None
+        if cursor.index is not None:
+            cursor.index.follow(reader.fileno())
+        self._readers[path] = reader
+        self._close_idle_readers(path)
+        return reader
+
+    def _close_idle_readers(self, keep):
+        """Close the least recently read files beyond the limit.
+
+        Files being read by other threads and rotated files still
+        drained are left open.
+
+        """
+        excess = len(self._readers) - self.max_open_files
+        if excess <= 0:
+            return
+        draining = set(self._rotated.values())
+        for path in list(self._readers):
+            if excess <= 0:
                 break
+            if path == keep or path in draining:
+                continue
+            lock = self._file_lock(path)
+            try:
+                if not lock.acquire(blocking=False):
+                    continue
+                try:
+                    reader = self._readers.pop(path, None)
+                    if reader is not None:
+                        reader.close()
+                        excess -= 1
+                        entry = self._cache.get(path)
+                        if entry is not None and entry[0].index is not None:
+                            entry[0].index.close()
+                finally:
+                    lock.release()
+            finally:
+                self._unref_file_locks([path])
+
+    def _process_file(self, path):
+        """Process lines appended to a watched file.
+
+        Args:
+            path (str): The full path to the file.
+
+        """
+        with self._counting():
+            self._read_file(path)
+
+    def _read_file(self, path):
+        cursor, message = self._cache[path]
+        reader = self._get_reader(path, cursor)
+        if reader is None:
+            return
+
+        start = cursor.pos
+        lines = 0
+        read = reader.read_lines()
+        try:
+            for line, pos in read:
+                cursor.advance(pos)
+                message = self._build_message(cursor, message, line)
+                lines += 1
+        finally:
+            # Leave the reader and the cache where the cursor is even if
+            # a line fails, so that reading resumes past it
+            read.close()
+            self._cache[path] = cursor, message
+        counts = getattr(self._local, 'counts', None)
+        if lines and counts is not None:
+            _count(counts, _LINES_READ, lines)
+            _count(counts, _BYTES_READ, cursor.pos - start)
 
-            cursor.line += 1
-            cursor.pos = f.tell()
+        if message.text and self._flusher is not None:
+            # EOF could be in the middle of a multiline message
+            self._flusher.add(path, (path, message, cursor.pos, False))
+        else:
+            # Assume EOF always ends a full multiline message
+            if message.text:
+                self._process_message(message)
+            message = create_message(None, cursor)
 
-            message = self._build_message(cursor, message, s)
+        self._cache[path] = cursor, message
+
+    def _flush_message(self, item):
+        """Process a message held at EOF unless continued since."""
+        path, message, pos, armed = item
+        with self._locked(path):
+            cache = self._cache.get(path)
+            if cache is None or cache[1] is not message or cache[0].pos != pos:
+                return
+            if not armed:
+                # Held until the next tick at least
+                self._flusher.add(path, (path, message, pos, True))
+                return
+            self._process_buffered(path)
+
+    def _process_buffered(self, path):
+        """Process the message buffered for a file, if any."""
+        cursor, message = self._cache[path]
+        if message.text:
+            self._process_message(message)
+            self._cache[path] = cursor, create_message(None, cursor)
 
     def _build_message(self, cursor, message, line):
         """Build a message from an incoming line.
 
         Args:
             message: TBD.
-            line: An incoming line from the log.
+            line (bytes): An incoming line from the log, without the
+                newline.
 
         Returns:
             message
@@ -171,24 +1008,59 @@ class EventHandler(LoggingEventHandler):
     def _match(self, pattern, obj):
         raise NotImplementedError
 
+    def _candidate_triggers(self, text):
+        """Get the triggers that may match the raw message text."""
+        return self.triggers
+
     def _get_matchable_object(self, obj):
         return obj
 
-    def _render_object(self, obj):
+    def _render_object(self, obj, text):
+        """Render a matched object as the message to route.
+
+        Args:
+            obj: The object matched against triggers.
+            text (bytes): The raw message text.
+
+        """
         return obj
 
     def _process_message(self, message):
-        cursor = message.cursor
+        counts = getattr(self._local, 'counts', None)
+        if counts is None and metrics.registry.enabled:
+            # Processed on its own, e.g., when flushed
+            with self._counting():
+                return self._process_message(message)
+
+        if counts is not None:
+            _count(counts, _MESSAGES)
+        triggers = self._candidate_triggers(message.text)
+        if not triggers:
+            return
+
         obj = self._get_matchable_object(message.text)
+        if obj is None:
+            return
 
-        formatted_text = None
-        for trigger in self.triggers:
-            matched = self._match(trigger['pattern'], obj)
-            if matched:
-                formatted_text = formatted_text or self._render_object(obj)
+        formatted_text = cursor = None
+        for trigger in triggers:
+            if counts is None:
+                matched = self._match(trigger['pattern'], obj)
+            else:
+                start = time.perf_counter()
+                matched = self._match(trigger['pattern'], obj)
+                seconds_key, matches_key = trigger['metric_keys']
+                _count(counts, seconds_key, time.perf_counter() - start)
+                if matched is not None:
+                    _count(counts, matches_key)
+            if matched is not None:
+                if formatted_text is None:
+                    formatted_text = self._render_object(obj, message.text)
+                    cursor = message.cursor
                 for router_config in trigger['routers']:
                     router = self.routers[router_config['name']]
-                    payload = router.payload(formatted_text,
-                                             cursor, matched,
-                                             **router_config.get('args', {}))
-                    router.send(payload)
+                    priority = router_config.get(
+                        'priority', trigger.get('priority', 0))
+                    router.emit(formatted_text, cursor, matched,
+                                priority=priority,
+                                **router_config.get('args', {}))
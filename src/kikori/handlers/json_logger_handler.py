@@ -22,10 +22,11 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import json
 import logging
-import re
 
+from ..utils.json import compile_filter
+from ..utils.json import loads
+from ..utils.json import required_literals
 from .handler import create_message
 from .handler import EventHandler
 
@@ -33,47 +34,42 @@ from .handler import EventHandler
 log = logging.getLogger(__name__)
 
 
-def _load_pattern(pattern):
-    if not isinstance(pattern, dict):
-        return re.compile(pattern)
-    result = {}
-    for key, value in pattern.items():
-        result[key] = _load_pattern(value)
-    return result
-
-
 class JSONLoggerHandler(EventHandler):
 
     def _load_trigger(self, trigger):
-        trigger['pattern'] = _load_pattern(trigger['pattern'])
+        pattern = trigger['pattern']
+        # Substrings of raw lines required to match, so that most
+        # lines are dismissed without being decoded
+        literals = (required_literals(pattern)
+                    if isinstance(pattern, dict) else [])
+        trigger['literals'] = [lit.encode(self.encoding) for lit in literals]
+        trigger['pattern'] = compile_filter(pattern)
         return trigger
 
     def _build_message(self, cursor, message, line):
-        # This must be a complete JSON-parsable line
-        if message.text is None:
-            # This happens when this is the very first message
-            # text line parsed from stream.
-            message.text = line
-        self._process_message(message)
+        # This must be a complete JSON-parsable line, so the
+        # currently buffered message is complete
+        if message.text:
+            self._process_message(message)
 
         # Start buffering the new message
         message = create_message(line, cursor)
         return message
 
     def _match(self, pattern, obj):
-        resultdict = {}
-        if isinstance(pattern, dict):
-            for key, value in pattern:
-                if key not in obj:
-                    return None
-                resultdict = value.match(obj[key])
-        else:
-            if pattern == obj:
-                resultdict = obj
-        return resultdict or None
+        return pattern(obj)
+
+    def _candidate_triggers(self, text):
+        return [trigger for trigger in self.triggers
+                if all(lit in text for lit in trigger['literals'])]
 
     def _get_matchable_object(self, text):
-        return json.loads(text)
+        try:
+            return loads(text)
+        except ValueError:
+            log.warning('Skipped a message not in JSON: %r', text[:80])
+            return None
 
-    def _render_object(self, obj):
-        return json.dumps(obj)
+    def _render_object(self, obj, text):
+        # The line as logged, rather than the object encoded again
+        return text.decode(self.encoding, 'replace')
@@ -27,6 +27,7 @@ import re
 
 from .handler import create_message
 from .handler import EventHandler
+from .trigger_index import TriggerIndex
 
 
 log = logging.getLogger(__name__)
@@ -38,31 +39,40 @@ class TextLoggerHandler(EventHandler):
         trigger['pattern'] = re.compile(trigger['pattern'])
         return trigger
 
+    def apply_triggers(self, triggers):
+        count = super().apply_triggers(triggers)
+        # Set at once, so that candidates are always looked up from
+        # the triggers they are indexed for
+        self._indexed_triggers = self.triggers, TriggerIndex(
+            [t['pattern'] for t in self.triggers], self.encoding)
+        return count
+
     def _build_message(self, cursor, message, line):
         if self.text_pattern.match(line):
             # The message starts from this line, so the currently
             # buffered message is complete
-            if message.text is None:
-                # This happens when this is the very first message
-                # text line parsed from stream.
-                message.text = line
-            self._process_message(message)
+            if message.text:
+                self._process_message(message)
 
             # Start buffering the new message
             message = create_message(line, cursor)
         else:
             # This is a non-first line in a multiline message and
             # should be bufferred.
-            if message.text:
-                message.text += line
+            if message:
+                message.append(line, self.max_lines, self.max_bytes)
         return message
 
     def _match(self, pattern, obj):
         matched = pattern.match(obj)
         return None if matched is None else matched.groupdict()
 
+    def _candidate_triggers(self, text):
+        triggers, index = self._indexed_triggers
+        return [triggers[i] for i in index.candidates(text)]
+
     def _get_matchable_object(self, text):
-        return text.rstrip('\n')
+        return text.decode(self.encoding, 'replace')
 
-    def _render_object(self, obj):
+    def _render_object(self, obj, text):
         return obj
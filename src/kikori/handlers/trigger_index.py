@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from ..utils.regex import literals_regex
+from ..utils.regex import required_literal
+
+
+# With fewer literals than this, testing them one by one is cheaper
+# than a regex scan
+_SCAN_MIN_LITERALS = 8
+
+
+class TriggerIndex:
+    """Index regex patterns by the literals they require.
+
+    Instead of trying every pattern on a text, a single scan of the
+    text for the literals required by the patterns finds candidates;
+    only those need to be tried. Patterns requiring no literal are
+    always candidates. Texts may be given as str or as bytes in the
+    given encoding, so that texts without candidates need not be
+    decoded.
+
+    Args:
+        patterns: Compiled regex patterns.
+        encoding (str): The encoding of bytes texts.
+
+    """
+
+    def __init__(self, patterns, encoding='utf-8'):
+        self._always = []
+        by_literal = {}
+        for i, pattern in enumerate(patterns):
+            literal = required_literal(pattern)
+            if literal is None:
+                self._always.append(i)
+            else:
+                by_literal.setdefault(literal, []).append(i)
+
+        # The scan only reports the longest literal found at each
+        # position, so a literal found implies its prefixes are
+        self._candidates = {}
+        for literal in by_literal:
+            self._candidates[literal] = [
+                i for prefix, indices in by_literal.items()
+                if literal.startswith(prefix) for i in indices]
+            self._candidates[literal.encode(encoding)] = (
+                self._candidates[literal])
+
+        self._literals = {str: list(by_literal),
+                          bytes: [lit.encode(encoding) for lit in by_literal]}
+        self._regex = {}
+        if len(by_literal) >= _SCAN_MIN_LITERALS:
+            for type_, literals in self._literals.items():
+                self._regex[type_] = literals_regex(literals)
+
+    def candidates(self, text):
+        """Find patterns that may match the text.
+
+        Returns:
+            list: Indices of the candidate patterns, in order.
+
+        """
+        regex = self._regex.get(type(text))
+        if regex is None:
+            found = [lit for lit in self._literals[type(text)] if lit in text]
+        else:
+            found = regex.findall(text)
+        if not found:
+            return self._always
+        found = set(found)
+        if len(found) == 1 and not self._always:
+            return self._candidates[found.pop()]
+        indices = set(self._always)
+        for literal in found:
+            indices.update(self._candidates[literal])
+        return sorted(indices)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+log = logging.getLogger(__name__)
+
+
+class KeyedExecutor:
+    """Run tasks in a thread pool, one at a time and in order per key.
+
+    Tasks with different keys run concurrently. A key with more tasks
+    queued yields its worker after each task, so that a busy key does
+    not starve others.
+
+    Args:
+        workers (int): The number of worker threads.
+
+    """
+
+    def __init__(self, workers):
+        self._pool = ThreadPoolExecutor(workers,
+                                        thread_name_prefix='kikori-worker')
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        """Queue a task to call fn with args."""
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((fn, args))
+                return
+            self._queues[key] = collections.deque([(fn, args)])
+        self._pool.submit(self._run, key)
+
+    def _run(self, key):
+        with self._lock:
+            fn, args = self._queues[key][0]
+        try:
+            fn(*args)
+        except Exception:
+            log.exception('Failed to run task for %s', key)
+        with self._lock:
+            queue = self._queues[key]
+            queue.popleft()
+            if not queue:
+                del self._queues[key]
+                return
+        self._pool.submit(self._run, key)
+
+    def shutdown(self):
+        """Wait for all queued tasks to finish."""
+        while 1:
+            with self._lock:
+                if not self._queues:
+                    break
+            time.sleep(0.01)
+        self._pool.shutdown(wait=True)
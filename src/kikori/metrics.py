@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+
+log = logging.getLogger(__name__)
+
+
+#: The type and help of each metric by name
+METRICS = {
+    'kikori_lines_read_total': (
+        'counter', 'Lines read from watched files.'),
+    'kikori_bytes_read_total': (
+        'counter', 'Bytes read from watched files.'),
+    'kikori_messages_total': (
+        'counter', 'Messages built from watched files.'),
+    'kikori_trigger_matches_total': (
+        'counter', 'Messages matched by triggers.'),
+    'kikori_trigger_seconds_total': (
+        'counter', 'Time spent matching messages with triggers.'),
+    'kikori_delivery_seconds': (
+        'histogram', 'Time taken to deliver payloads by routers.'),
+    'kikori_delivery_failures_total': (
+        'counter', 'Payloads routers failed to deliver.'),
+    'kikori_queue_depth': (
+        'gauge', 'Payloads waiting in delivery queues.'),
+    'kikori_queue_dropped_total': (
+        'counter', 'Payloads dropped from full delivery queues by '
+        'priority.'),
+    'kikori_rate_limit_wait_seconds_total': (
+        'counter', 'Seconds spent waiting for rate limits of routers.'),
+    'kikori_outbox_pending': (
+        'gauge', 'Payloads in outboxes waiting to be sent again.'),
+    'kikori_outbox_dropped_total': (
+        'counter', 'Payloads dropped from full outboxes.'),
+    'kikori_payloads_rejected_total': (
+        'counter', 'Payloads rejected by destinations and not sent again.'),
+    'kikori_file_lag_bytes': (
+        'gauge', 'Bytes written to watched files but not read yet.'),
+}
+
+#: The upper bounds of histogram buckets in seconds
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _labels(labels):
+    # Label values are strings, so that keys sort even if some are None
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def key(name, **labels):
+    """Get the key of a counter to increment with :meth:`Registry.add`."""
+    return name, _labels(labels)
+
+
+def _format(name, labels, value):
+    if labels:
+        name += '{' + ','.join('{}="{}"'.format(k, _escape(v))
+                               for k, v in labels) + '}'
+    return '{} {}'.format(name, repr(float(value)))
+
+
+class Registry:
+    """Metrics recorded by the pipeline.
+
+    Counters and histograms are recorded as they change, identified by
+    their names and labels given as keyword arguments, while gauges are
+    collected from registered callables only when exported.
+
+    Args:
+        enabled (bool): Whether to record counters and histograms.
+
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter."""
+        if not self.enabled:
+            return
+        self.add({key(name, **labels): value})
+
+    def add(self, counts):
+        """Increment counters at once.
+
+        Args:
+            counts (dict): The increments by key, as given by
+                :func:`key`.
+
+        """
+        if not self.enabled or not counts:
+            return
+        with self._lock:
+            for k, value in counts.items():
+                self._counters[k] = self._counters.get(k, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram."""
+        if not self.enabled:
+            return
+        k = key(name, **labels)
+        with self._lock:
+            hist = self._histograms.get(k)
+            if hist is None:
+                hist = self._histograms[k] = [0] * len(BUCKETS) + [0, 0.]
+            i = bisect.bisect_left(BUCKETS, value)
+            if i < len(BUCKETS):
+                hist[i] += 1
+            hist[-2] += 1
+            hist[-1] += value
+
+    def register(self, collector):
+        """Register a callable yielding (name, labels, value) gauges."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def unregister(self, collector):
+        with self._lock:
+            self._collectors.remove(collector)
+
+    def totals(self):
+        """Get the values of counters and gauges summed over labels.
+
+        Returns:
+            dict: The values by name, where histograms are given as
+                ``(count, sum)``.
+
+        """
+        counters, histograms = self._snapshot()
+        totals = {}
+        for (name, _), value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+        for (name, _), hist in histograms.items():
+            count, total = totals.get(name, (0, 0.))
+            totals[name] = count + hist[-2], total + hist[-1]
+        return totals
+
+    def _snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                for name, labels, value in collector():
+                    counters[name, _labels(labels)] = value
+            except Exception:
+                log.exception('Failed to collect metrics')
+        return counters, histograms
+
+    def render(self):
+        """Render the metrics in the Prometheus text format."""
+        counters, histograms = self._snapshot()
+        by_name = {}
+        for (name, labels), value in sorted(counters.items()):
+            by_name.setdefault(name, []).append(
+                _format(name, labels, value))
+        for (name, labels), hist in sorted(histograms.items()):
+            lines = by_name.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist):
+                cumulative += count
+                lines.append(_format(name + '_bucket',
+                                     labels + (('le', bound),), cumulative))
+            lines.append(_format(name + '_bucket',
+                                 labels + (('le', '+Inf'),), hist[-2]))
+            lines.append(_format(name + '_count', labels, hist[-2]))
+            lines.append(_format(name + '_sum', labels, hist[-1]))
+
+        out = []
+        for name in sorted(by_name):
+            type_, help_ = METRICS.get(name, ('untyped', ''))
+            out.append('# HELP {} {}'.format(name, help_))
+            out.append('# TYPE {} {}'.format(name, type_))
+            out.extend(by_name[name])
+        return '\n'.join(out) + '\n'
+
+
+#: The registry of this process, which records nothing until enabled
+registry = Registry(enabled=False)
+inc = registry.inc
+observe = registry.observe
+register = registry.register
+unregister = registry.unregister
+
+
+def enable():
+    """Start recording metrics in the registry of this process."""
+    registry.enabled = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class MetricsServer:
+    """Serve the metrics over HTTP and log their summary periodically.
+
+    Args:
+        host (str): The address to serve ``/metrics`` at.
+        port (int): The port to serve at, or None not to serve.
+        interval (float): Seconds between summaries logged, or 0 not to
+            log them.
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=9100, interval=60.):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self._server = None
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.port is not None:
+            self._server = ThreadingHTTPServer((self.host, self.port),
+                                               _RequestHandler)
+            self._server.daemon_threads = True
+            self._start(self._server.serve_forever, 'metrics-server')
+            log.info('Serving metrics at http://%s:%d/metrics',
+                     self.host, self._server.server_address[1])
+        if self.interval:
+            self._start(self._run, 'metrics-summary')
+
+    def _start(self, target, name):
+        t = threading.Thread(target=target, name=name)
+        t.daemon = True
+        t.start()
+        self._threads.append(t)
+
+    def _run(self):
+        last, last_time = registry.totals(), time.monotonic()
+        while not self._stopped.wait(self.interval):
+            totals, now = registry.totals(), time.monotonic()
+            log.info('%s', summarize(last, totals, now - last_time))
+            last, last_time = totals, now
+
+    def close(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for t in self._threads:
+            t.join()
+
+
+def summarize(last, totals, elapsed):
+    """Summarize the change of metric totals in a line.
+
+    Args:
+        last (dict): The totals at the beginning of the period.
+        totals (dict): The totals at the end of the period.
+        elapsed (float): The seconds in the period.
+
+    Returns:
+        str
+
+    """
+    def delta(name):
+        return totals.get(name, 0) - last.get(name, 0)
+
+    count, total = totals.get('kikori_delivery_seconds', (0, 0.))
+    last_count, last_total = last.get('kikori_delivery_seconds', (0, 0.))
+    delivered = count - last_count
+    latency = (total - last_total) / delivered if delivered else 0.
+    return ('Read {:.0f} lines ({:.1f} lines/s, {:.0f} bytes), built {:.0f} '
+            'messages, matched {:.0f}, delivered {} (avg {:.3f}s, {:.0f} '
+            'failed); {:.0f} queued, {:.0f} shed, {:.0f} bytes '
+            'behind').format(
+                delta('kikori_lines_read_total'),
+                delta('kikori_lines_read_total') / elapsed,
+                delta('kikori_bytes_read_total'),
+                delta('kikori_messages_total'),
+                delta('kikori_trigger_matches_total'),
+                delivered, latency,
+                delta('kikori_delivery_failures_total'),
+                totals.get('kikori_queue_depth', 0),
+                delta('kikori_queue_dropped_total'),
+                totals.get('kikori_file_lag_bytes', 0))
@@ -22,4 +22,140 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from watchdog.observers import Observer  # noqa
+import importlib
+import logging
+
+from watchdog.events import FileCreatedEvent
+from watchdog.events import FileDeletedEvent
+from watchdog.events import FileModifiedEvent
+from watchdog.events import FileMovedEvent
+from watchdog.observers.api import BaseObserver
+from watchdog.observers.api import DEFAULT_OBSERVER_TIMEOUT
+from watchdog.utils import platform
+
+
+log = logging.getLogger(__name__)
+
+
+#: The types of events handlers act on. Backends are asked for these
+#: only where they can be, so that inotify does not report every time
+#: a file is opened or closed.
+EVENT_TYPES = [FileCreatedEvent,
+               FileDeletedEvent,
+               FileModifiedEvent,
+               FileMovedEvent]
+
+#: The modules and classes of the emitters of backends
+BACKENDS = {
+    'inotify': ('watchdog.observers.inotify', 'InotifyEmitter'),
+    'fsevents': ('watchdog.observers.fsevents', 'FSEventsEmitter'),
+    'kqueue': ('watchdog.observers.kqueue', 'KqueueEmitter'),
+    'windows': ('watchdog.observers.read_directory_changes',
+                'WindowsApiEmitter'),
+    'polling': ('watchdog.observers.polling', 'PollingEmitter'),
+}
+
+
+def _default_backends():
+    if platform.is_linux():
+        return ['inotify', 'polling']
+    if platform.is_darwin():
+        return ['fsevents', 'kqueue', 'polling']
+    if platform.is_windows():
+        return ['windows', 'polling']
+    if platform.is_bsd():
+        return ['kqueue', 'polling']
+    return ['polling']
+
+
+def _emitter_class(backend):
+    """Get the emitter class of a backend, the best one for ``auto``."""
+    if backend != 'auto':
+        if backend not in BACKENDS:
+            raise ValueError('Unknown observer backend: {}'.format(backend))
+        module, name = BACKENDS[backend]
+        return getattr(importlib.import_module(module), name), backend
+    for backend in _default_backends():
+        try:
+            return _emitter_class(backend)
+        except Exception:
+            log.warning('Observer backend %s is not available', backend)
+    raise RuntimeError('No observer backend is available')
+
+
+class Observer(BaseObserver):
+    """Watch directories with a backend of choice.
+
+    Only the types of events in :data:`EVENT_TYPES` are observed, and
+    events are filtered by the ``accepts`` methods of the handlers of
+    their watches before being queued, so that events for files no
+    handler watches cost the dispatching thread nothing.
+
+    Args:
+        backend (str): One of :data:`BACKENDS`, or ``auto`` to choose the
+            best one available on the platform. Use ``polling`` for
+            file systems not reporting changes, like NFS.
+        interval (float): Seconds between polls with ``polling``.
+
+    """
+
+    def __init__(self, backend='auto', interval=None):
+        emitter_class, self.backend = _emitter_class(backend)
+        if self.backend != 'polling' or interval is None:
+            interval = DEFAULT_OBSERVER_TIMEOUT
+        # The accepts methods of the handlers by watch
+        self._filters = {}
+
+        accepts = self._accepts
+
+        class FilteringEmitter(emitter_class):
+
+            def queue_event(self, event):
+                if accepts(self.watch, event):
+                    super().queue_event(event)
+
+        super().__init__(FilteringEmitter, timeout=interval)
+        log.info('Observing with %s', self.backend)
+
+    def _accepts(self, watch, event):
+        filters = self._filters.get(watch)
+        if filters is None:
+            # Being scheduled; handlers check events anyway
+            return True
+        return any(f is None or f(event) for f in filters)
+
+    def _update_filters(self, watch):
+        # Replace rather than modify, so that emitters read them
+        # without locking
+        handlers = self._handlers.get(watch, ())
+        self._filters[watch] = tuple(getattr(h, 'accepts', None)
+                                     for h in handlers)
+
+    def schedule(self, event_handler, path, recursive=False,
+                 event_filter=EVENT_TYPES):
+        with self._lock:
+            watch = super().schedule(event_handler, path,
+                                     recursive=recursive,
+                                     event_filter=event_filter)
+            self._update_filters(watch)
+        return watch
+
+    def add_handler_for_watch(self, event_handler, watch):
+        with self._lock:
+            super().add_handler_for_watch(event_handler, watch)
+            self._update_filters(watch)
+
+    def remove_handler_for_watch(self, event_handler, watch):
+        with self._lock:
+            super().remove_handler_for_watch(event_handler, watch)
+            self._update_filters(watch)
+
+    def unschedule(self, watch):
+        with self._lock:
+            super().unschedule(watch)
+            self._filters.pop(watch, None)
+
+    def unschedule_all(self):
+        with self._lock:
+            super().unschedule_all()
+            self._filters.clear()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import bz2
+import concurrent.futures
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from . import config
+from .routers.router import Router
+from .shards import Relay
+from .shards import RemoteRouter
+
+
+log = logging.getLogger(__name__)
+
+
+def open_log(path):
+    """Open a log file, or a gzip or bzip2 compressed one, to read."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def find_watch(path, confs):
+    """Find the watch block a file is in the directory of.
+
+    Args:
+        path (str): The path to the file.
+        confs (list): The watch blocks.
+
+    Returns:
+        int: The index of the watch block, or None if not found.
+
+    """
+    path = os.path.abspath(path)
+    for i, conf in enumerate(confs):
+        dir = os.path.abspath(conf['dir'])
+        if os.path.commonpath([path, dir]) == dir:
+            return i
+    return None
+
+
+class ReplayRouter(Router):
+    """Route messages matched in replay with a configured router.
+
+    Args:
+        name (str): The name of the router.
+        router (Router): The configured router.
+        out: The text stream to write payloads to as JSON lines, or
+            None to route messages with the router.
+        limiter (TokenBucket): The limiter of the rate of messages.
+
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, name, router, out=None, limiter=None):
+        super().__init__()
+        self.name = name
+        self.router = router
+        self.out = out
+        self.limiter = limiter
+
+    def emit(self, message, cursor, groupdict, priority=0, **kwargs):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        if self.out is None:
+            self.router.emit(message, cursor, groupdict, priority=priority,
+                             **kwargs)
+            return
+        payload = self.router.payload(message, cursor, groupdict, **kwargs)
+        line = json.dumps({'router': self.name,
+                           'path': cursor.path,
+                           'line': cursor.line,
+                           'payload': payload})
+        with self._lock:
+            self.out.write(line + '\n')
+
+    def close(self, timeout=None):
+        self.router.close(timeout)
+
+
+def replay_file(handler, path):
+    """Run the lines of a file through a handler.
+
+    Returns:
+        int: The number of lines processed.
+
+    """
+    start = time.monotonic()
+    with open_log(path) as f:
+        lines = handler.replay(f, os.path.abspath(path))
+    log.info('Replayed %d lines of %s in %.1fs', lines, path,
+             time.monotonic() - start)
+    return lines
+
+
+# The state of a replay worker process
+_worker = None
+
+
+def _init_worker(conf_path, channel, create_handler):
+    config.init(conf_path)
+    routers = {name: RemoteRouter(name, channel)
+               for name in config.conf.get('routers', {})}
+    globals()['_worker'] = SimpleNamespace(
+        routers=routers, create_handler=create_handler, handlers={})
+
+
+def _replay_in_worker(path, index):
+    handler = _worker.handlers.get(index)
+    if handler is None:
+        handler = _worker.handlers[index] = _worker.create_handler(
+            config.conf['watch'][index], _worker.routers)
+    return replay_file(handler, path)
+
+
+def replay(files, routers, create_handler, workers=1):
+    """Replay log files with the handlers of their watch blocks.
+
+    With more than one worker, files are replayed in worker processes,
+    from which matched messages are relayed to ``routers`` in this
+    process.
+
+    Args:
+        files (list): Tuples of the path to each file and the index of
+            its watch block.
+        routers (dict): The routers by name.
+        create_handler (callable): The function creating a handler from
+            a watch block and routers, which must be picklable to run
+            in worker processes.
+        workers (int): The number of worker processes.
+
+    Returns:
+        int: The number of lines processed.
+
+    """
+    if workers <= 1:
+        handlers = {}
+        lines = 0
+        for path, index in files:
+            if index not in handlers:
+                handlers[index] = create_handler(
+                    config.conf['watch'][index], routers)
+            lines += replay_file(handlers[index], path)
+        return lines
+
+    ctx = multiprocessing.get_context('spawn')
+    channel = ctx.Queue()
+    relay = Relay(channel, routers)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, mp_context=ctx, initializer=_init_worker,
+                initargs=(config.conf_path, channel,
+                          create_handler)) as executor:
+            futures = [executor.submit(_replay_in_worker, path, index)
+                       for path, index in files]
+            return sum(f.result() for f in futures)
+    finally:
+        # Workers have flushed what they relayed by the time they exit
+        relay.close()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+
+log = logging.getLogger(__name__)
+
+
+def _format_time(t):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+
+class Coalescer:
+    """Aggregate matched messages into one digest per window.
+
+    Messages routed with the same router args and priority (and the
+    same value of the ``group_by`` regex group, if given) are grouped.
+    A group is sent as a single payload built from its first message,
+    with its count and first/last occurrence as summary, once
+    ``window`` seconds have passed since its first message or
+    ``max_count`` messages have been aggregated, whichever comes first.
+
+    Args:
+        router: The router digests are delivered with.
+        window (float): Seconds to aggregate messages for.
+        max_count (int): Max number of messages per digest.
+        group_by (str): Name of the regex group to group messages by.
+
+    """
+
+    def __init__(self, router, window=10., max_count=1000, group_by=None):
+        self.router = router
+        self.window = window
+        self.max_count = max_count
+        self.group_by = group_by
+
+        self._groups = {}
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name='coalescer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _key(self, groupdict, args, priority):
+        group = groupdict.get(self.group_by) if self.group_by else None
+        return tuple(sorted(args.items())), group, priority
+
+    def add(self, message, cursor, groupdict, args, priority=0):
+        """Add a matched message to its group."""
+        key = self._key(groupdict, args, priority)
+        now = time.time()
+        with self._cond:
+            group = self._groups.get(key)
+            if group is None:
+                deadline = time.monotonic() + self.window
+                group = SimpleNamespace(message=message,
+                                        cursor=cursor,
+                                        groupdict=groupdict,
+                                        args=args,
+                                        count=0,
+                                        priority=priority,
+                                        first_time=now,
+                                        deadline=deadline)
+                self._groups[key] = group
+                self._cond.notify()
+            group.count += 1
+            group.last_cursor = cursor
+            group.last_time = now
+
+            if group.count < self.max_count:
+                return
+            del self._groups[key]
+        self._send(group)
+
+    def _send(self, group):
+        summary = None
+        if group.count > 1:
+            summary = {'COUNT': group.count,
+                       'FIRST_TIME': _format_time(group.first_time),
+                       'LAST_TIME': _format_time(group.last_time),
+                       'FIRST_LINENO': group.cursor.line,
+                       'LAST_LINENO': group.last_cursor.line}
+        payload = self.router.payload(group.message,
+                                      group.cursor,
+                                      group.groupdict,
+                                      summary=summary,
+                                      **group.args)
+        self.router.deliver(payload, group.priority)
+
+    def _pop_due(self, now):
+        due = [k for k, g in self._groups.items() if g.deadline <= now]
+        return [self._groups.pop(k) for k in due]
+
+    def _run(self):
+        while 1:
+            with self._cond:
+                if self._closed:
+                    break
+                now = time.monotonic()
+                groups = self._pop_due(now)
+                if not groups:
+                    deadline = min((g.deadline for g in self._groups.values()),
+                                   default=None)
+                    self._cond.wait(None if deadline is None
+                                    else deadline - now)
+                    continue
+            for group in groups:
+                try:
+                    self._send(group)
+                except Exception:
+                    log.exception('Failed to send digest')
+
+    def flush(self):
+        """Send all groups regardless of their window."""
+        with self._cond:
+            groups = list(self._groups.values())
+            self._groups.clear()
+        for group in groups:
+            self._send(group)
+
+    def close(self):
+        """Send all groups and stop the timer thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import email.utils
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+log = logging.getLogger(__name__)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url, pool_size=10):
+    """Get the session shared by all clients posting to the URL.
+
+    Args:
+        url (str): The URL the session posts to.
+        pool_size (int): Max number of connections kept alive.
+
+    Returns:
+        requests.Session
+
+    """
+    with _sessions_lock:
+        session = _sessions.get(url)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[url] = session
+        return session
+
+
+def _retry_after(response):
+    """Parse the Retry-After header into seconds, if given."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0.)
+
+
+class HTTPClient:
+    """Post JSON to a URL over pooled keep-alive connections.
+
+    Args:
+        url (str): The URL to post to.
+        pool_size (int): Max number of connections kept alive.
+        keep_alive (bool): Reuse connections across requests.
+        connect_timeout (float): Seconds to wait for a connection.
+        read_timeout (float): Seconds to wait for a response.
+        retries (int): Max number of retries on connection errors,
+            429 and 5xx responses.
+        backoff (float): Seconds to wait before the first retry,
+            doubled on each retry unless Retry-After says otherwise.
+        max_backoff (float): Max seconds to wait between retries.
+
+    """
+
+    def __init__(self,
+                 url,
+                 pool_size=10,
+                 keep_alive=True,
+                 connect_timeout=3.05,
+                 read_timeout=10.,
+                 retries=3,
+                 backoff=1.,
+                 max_backoff=60.):
+        self.url = url
+        self.session = get_session(url, pool_size)
+        self.headers = None if keep_alive else {'Connection': 'close'}
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def post(self, payload):
+        """Post the payload, retrying with backoff on transient errors.
+
+        Returns:
+            requests.Response: The last response received.
+
+        Raises:
+            requests.RequestException: When no response is received
+                after all retries.
+
+        """
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.url,
+                                             json=payload,
+                                             headers=self.headers,
+                                             timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                log.warning('Failed to connect to %s; retrying in %.1fs',
+                            self.url, delay, exc_info=True)
+                wait = delay
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+                if attempt == self.retries:
+                    return response
+                wait = _retry_after(response)
+                if wait is None:
+                    wait = delay
+                log.warning('Got %d from %s; retrying in %.1fs',
+                            response.status_code, self.url, wait)
+            time.sleep(min(wait, self.max_backoff))
+            delay *= 2
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import logging
+import os
+import threading
+
+from ..utils import count_lines
+
+
+log = logging.getLogger(__name__)
+
+
+class Outbox:
+    """A durable on-disk queue of payloads to deliver again.
+
+    Payloads are appended as JSON lines to segment files in a
+    directory, and sent again one at a time by a background thread,
+    backing off while sending fails. Segments are deleted once sent,
+    and the oldest are dropped to keep the directory within its size
+    limit. The position sent up to is saved along with the segments,
+    so that payloads still pending are sent after restart. Only the
+    payload being sent is held in memory.
+
+    Args:
+        send (callable): Called with each payload in the thread;
+            returns True if delivered.
+        path (str): The directory to keep segments in.
+        segment_bytes (int): The size a segment is closed at.
+        max_bytes (int): The size segments are kept within.
+        backoff (float): Seconds to wait after the first failure,
+            doubled per consecutive failure.
+        max_backoff (float): The maximum seconds to wait.
+        name (str): Name used in logs and thread names.
+
+    """
+
+    def __init__(self, send, path, segment_bytes=1 << 20,
+                 max_bytes=100 << 20, backoff=1., max_backoff=300.,
+                 name=None):
+        self.send = send
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.name = name or 'outbox'
+        self.dropped = 0
+
+        self._cond = threading.Condition()
+        self._closed = False
+        self._writer = None
+        self._reader = None
+
+        os.makedirs(path, exist_ok=True)
+        self._segments = sorted(
+            int(f[:-4]) for f in os.listdir(path) if f.endswith('.seg'))
+        if self._segments:
+            self._truncate_torn_line(self._segments[-1])
+        self._sizes = {seq: os.path.getsize(self._segment_path(seq))
+                       for seq in self._segments}
+        self._head, self._offset = self._load_position()
+        self._pending = self._count_pending()
+        if self._pending:
+            log.info('Outbox %s has %d payload(s) pending from before',
+                     self.name, self._pending)
+
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        with self._cond:
+            return self._pending
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path, '{:020d}.seg'.format(seq))
+
+    def _truncate_torn_line(self, seq):
+        """Cut off a line left incomplete by a crash while writing.
+
+        Payloads are appended after it otherwise, so that the first of
+        them would be joined to it and lost as corrupt.
+
+        """
+        with open(self._segment_path(seq), 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end:
+                f.seek(max(end - 4096, 0))
+                chunk = f.read(end - f.tell())
+                i = chunk.rfind(b'\n')
+                if i >= 0:
+                    end -= len(chunk) - i - 1
+                    break
+                end -= len(chunk)
+            if end < size:
+                log.warning('Truncated a torn payload in outbox %s',
+                            self.name)
+                f.truncate(end)
+
+    def _load_position(self):
+        try:
+            with open(os.path.join(self.path, 'position')) as f:
+                head, offset = json.load(f)
+        except (FileNotFoundError, ValueError):
+            head, offset = None, 0
+        if head not in self._sizes:
+            # The segment sent from has been deleted
+            head = self._segments[0] if self._segments else None
+            offset = 0
+        return head, offset
+
+    def _save_position(self):
+        position_path = os.path.join(self.path, 'position')
+        tmp_path = position_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump([self._head, self._offset], f)
+        os.replace(tmp_path, position_path)
+
+    def _count_pending(self, seq=None):
+        """Count the payloads pending in a segment, or all segments."""
+        if seq is None:
+            return sum(self._count_pending(seq) for seq in self._segments
+                       if self._head is not None and seq >= self._head)
+        with open(self._segment_path(seq), 'rb') as f:
+            if seq == self._head:
+                f.seek(self._offset)
+            return count_lines(f)
+
+    def put(self, payload):
+        """Append a payload to be sent again."""
+        line = (json.dumps(payload) + '\n').encode()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Outbox {} is closed'.format(self.name))
+            if (not self._segments or
+                    self._sizes[self._segments[-1]] >= self.segment_bytes):
+                self._add_segment()
+            elif self._writer is None:
+                self._writer = open(self._segment_path(self._segments[-1]),
+                                    'ab')
+            self._writer.write(line)
+            self._writer.flush()
+            self._sizes[self._segments[-1]] += len(line)
+            self._pending += 1
+            while (sum(self._sizes.values()) > self.max_bytes and
+                   len(self._segments) > 1):
+                self._drop_head()
+            self._cond.notify()
+
+    def _add_segment(self):
+        if self._writer is not None:
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+        seq = self._segments[-1] + 1 if self._segments else 0
+        self._segments.append(seq)
+        self._sizes[seq] = 0
+        self._writer = open(self._segment_path(seq), 'ab')
+        if self._head is None:
+            self._head, self._offset = seq, 0
+
+    def _drop_head(self):
+        """Drop the oldest segment to bound disk usage."""
+        n = self._count_pending(self._segments[0])
+        self._pending -= n
+        self.dropped += n
+        log.warning('Outbox %s is full; dropped %d payload(s) '
+                    '(%d dropped so far)', self.name, n, self.dropped)
+        self._remove_head()
+
+    def _remove_head(self):
+        seq = self._segments.pop(0)
+        del self._sizes[seq]
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        os.remove(self._segment_path(seq))
+        self._head = self._segments[0] if self._segments else None
+        self._offset = 0
+        self._save_position()
+
+    def _peek(self):
+        """Read the payload at the head, skipping corrupt lines.
+
+        Returns:
+            tuple: The payload and the offset past it, or None if
+                nothing is pending.
+
+        """
+        while self._pending:
+            if self._offset >= self._sizes[self._head]:
+                # Every segment but the last is complete
+                self._remove_head()
+                continue
+            if self._reader is None:
+                self._reader = open(self._segment_path(self._head), 'rb')
+            self._reader.seek(self._offset)
+            line = self._reader.readline()
+            offset = self._offset + len(line)
+            try:
+                return json.loads(line.decode()), offset
+            except ValueError:
+                log.warning('Skipped a corrupt payload in outbox %s',
+                            self.name)
+                self._offset = offset
+                self._pending -= 1
+        return None
+
+    def _run(self):
+        backoff = self.backoff
+        while 1:
+            with self._cond:
+                while not self._closed and not self._pending:
+                    self._cond.wait()
+                if self._closed:
+                    break
+                peeked = self._peek()
+                if peeked is None:
+                    # Only corrupt lines were pending
+                    continue
+                payload, offset = peeked
+                head = self._head
+
+            if self.send(payload):
+                backoff = self.backoff
+                with self._cond:
+                    # Unless dropped meanwhile
+                    if self._head == head:
+                        self._offset = offset
+                        self._pending -= 1
+                        self._save_position()
+                continue
+
+            log.warning('Failed to deliver payload in outbox %s; retrying '
+                        'in %.1fs (%d pending)', self.name, backoff,
+                        len(self))
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed, backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def close(self):
+        """Stop sending; payloads pending are sent after restart."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._cond:
+            if self._writer is not None:
+                os.fsync(self._writer.fileno())
+                self._writer.close()
+                self._writer = None
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            if not self._pending and self._segments:
+                # Nothing to resume from
+                for seq in list(self._segments):
+                    self._remove_head()
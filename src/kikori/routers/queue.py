@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import collections
+import json
+import logging
+import os
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+OVERFLOW_POLICIES = ('drop_oldest', 'block', 'spill')
+
+
+class DeliveryQueue:
+    """A bounded queue of payloads drained by worker threads.
+
+    Payloads put in the queue are sent by background workers, so that
+    a slow destination does not stall the thread reading log files.
+    Payloads are held in lanes by priority, and those of higher
+    priority are sent first and shed last when the queue overflows.
+
+    Args:
+        send (callable): Called with each payload in a worker thread.
+        size (int): Maximum number of payloads held in memory.
+        workers (int): Number of worker threads.
+        overflow (str): What to do when the queue is full; one of
+            ``drop_oldest``, ``block`` or ``spill``.
+        spill_path (str): File payloads overflow to when ``overflow``
+            is ``spill``.
+        flush_timeout (float): Seconds to wait for pending payloads to
+            be sent on close.
+        name (str): Name used in logs and thread names.
+        limiter (TokenBucket): The limiter of the rate of sends, waited
+            on before taking a payload, so that one of higher priority
+            put meanwhile is sent next.
+
+    """
+
+    def __init__(self,
+                 send,
+                 size=1000,
+                 workers=1,
+                 overflow='drop_oldest',
+                 spill_path=None,
+                 flush_timeout=10.0,
+                 name=None,
+                 limiter=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: {}'.format(overflow))
+        if overflow == 'spill' and not spill_path:
+            raise ValueError('spill_path is required to spill')
+
+        self.send = send
+        self.size = size
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.flush_timeout = flush_timeout
+        self.name = name or 'delivery'
+        self.limiter = limiter
+        self.dropped = 0
+        self.dropped_by_priority = collections.Counter()
+
+        # Lanes of payloads by priority; empty lanes are removed
+        self._lanes = {}
+        self._queued = 0
+        self._cond = threading.Condition()
+        self._unfinished = 0
+        self._spilled = 0
+        self._spill_offset = 0
+        self._closed = False
+
+        if overflow == 'spill' and os.path.exists(spill_path):
+            # Payloads spilled before the last shutdown are delivered
+            # ahead of new ones
+            with open(spill_path) as f:
+                self._spilled = sum(1 for _ in f)
+            self._unfinished += self._spilled
+
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run,
+                                 name='{}-{}'.format(self.name, i))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def __len__(self):
+        with self._cond:
+            return self._queued + self._spilled
+
+    def put(self, payload, priority=0):
+        """Put a payload in the queue, applying the overflow policy.
+
+        Args:
+            payload: The payload to send.
+            priority (int): The priority of the payload; higher ones are
+                sent first.
+
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Queue {} is closed'.format(self.name))
+
+            if self.overflow == 'spill':
+                # Once spilling, keep spilling until the spill file is
+                # drained to preserve ordering
+                if self._spilled or self._queued >= self.size:
+                    self._spill(payload, priority)
+                    self._unfinished += 1
+                    self._cond.notify()
+                    return
+            elif self._queued >= self.size:
+                if self.overflow == 'block':
+                    while self._queued >= self.size:
+                        self._cond.wait()
+                elif not self._shed(priority):
+                    return
+
+            self._append(payload, priority)
+            self._unfinished += 1
+            self._cond.notify()
+
+    def _append(self, payload, priority):
+        lane = self._lanes.get(priority)
+        if lane is None:
+            lane = self._lanes[priority] = collections.deque()
+        lane.append(payload)
+        self._queued += 1
+
+    def _pop(self):
+        priority = max(self._lanes)
+        lane = self._lanes[priority]
+        payload = lane.popleft()
+        if not lane:
+            del self._lanes[priority]
+        self._queued -= 1
+        return payload
+
+    def _shed(self, priority):
+        """Drop the oldest payload of the lowest priority to make room.
+
+        Returns:
+            bool: False if the new payload is dropped instead, as all
+                those queued have higher priority.
+
+        """
+        lowest = min(self._lanes)
+        shed_new = lowest > priority
+        if shed_new:
+            lowest = priority
+        else:
+            lane = self._lanes[lowest]
+            lane.popleft()
+            if not lane:
+                del self._lanes[lowest]
+            self._queued -= 1
+            self._unfinished -= 1
+        self.dropped += 1
+        self.dropped_by_priority[lowest] += 1
+        if self.dropped % 1000 == 1:
+            log.warning('Delivery queue %s full; dropped oldest payload of '
+                        'priority %d (%d dropped so far)',
+                        self.name, lowest, self.dropped)
+        return not shed_new
+
+    def _spill(self, payload, priority):
+        with open(self.spill_path, 'a') as f:
+            f.write(json.dumps([priority, payload]) + '\n')
+        self._spilled += 1
+
+    def _unspill(self):
+        """Move spilled payloads back in memory, up to the queue size."""
+        with open(self.spill_path) as f:
+            f.seek(self._spill_offset)
+            while self._queued < self.size:
+                line = f.readline()
+                if not line:
+                    break
+                item = json.loads(line)
+                if not isinstance(item, list):
+                    # Spilled without priority by an older version
+                    item = 0, item
+                self._append(item[1], item[0])
+                self._spilled -= 1
+            self._spill_offset = f.tell()
+        if not self._spilled:
+            os.remove(self.spill_path)
+            self._spill_offset = 0
+
+    def _get(self):
+        with self._cond:
+            while not self._queued:
+                if self._closed:
+                    # Anything still spilled is delivered on restart
+                    return None
+                if self._spilled:
+                    self._unspill()
+                    continue
+                self._cond.wait()
+            payload = self._pop()
+            self._cond.notify_all()
+            return payload
+
+    def _done(self):
+        with self._cond:
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def _run(self):
+        while 1:
+            if self.limiter is not None:
+                self.limiter.wait()
+            payload = self._get()
+            if payload is None:
+                break
+            try:
+                self.send(payload)
+            except Exception:
+                log.exception('Failed to deliver payload via %s', self.name)
+            finally:
+                self._done()
+
+    def flush(self, timeout=None):
+        """Wait until all queued payloads have been sent.
+
+        Returns:
+            bool: True if the queue was drained within the timeout.
+
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._unfinished <= 0,
+                                       timeout)
+
+    def close(self, timeout=None):
+        """Flush pending payloads and stop the workers."""
+        timeout = self.flush_timeout if timeout is None else timeout
+        if not self.flush(timeout):
+            log.warning('Delivery queue %s closed with %d payload(s) unsent',
+                        self.name, len(self))
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        with self._cond:
+            if self._spilled and self._spill_offset:
+                self._compact_spill()
+
+    def _compact_spill(self):
+        """Drop the already delivered head of the spill file."""
+        tmp_path = self.spill_path + '.tmp'
+        with open(self.spill_path) as src, open(tmp_path, 'w') as dst:
+            src.seek(self._spill_offset)
+            for line in src:
+                dst.write(line)
+        os.replace(tmp_path, self.spill_path)
+        self._spill_offset = 0
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+import time
+
+
+class TokenBucket:
+    """Limit the rate of sends, allowing bursts up to a size.
+
+    Tokens accrue at ``rate`` per second up to ``burst``, and each send
+    takes one, waiting for it if none is left. Tokens are reserved in
+    the order they are asked for, so that concurrent senders are served
+    first come, first served.
+
+    Args:
+        rate (float): Tokens accrued per second.
+        burst (int): The maximum number of tokens held.
+
+    """
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.burst = burst
+        self.waited = 0.
+
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def _sleep(self, delay):
+        if delay > 0:
+            with self._lock:
+                self.waited += delay
+            time.sleep(delay)
+
+    def wait(self):
+        """Wait until a token is available, without taking it."""
+        with self._lock:
+            self._refill()
+            delay = (1 - self._tokens) / self.rate
+        self._sleep(delay)
+
+    def acquire(self):
+        """Take a token, waiting until it accrues if none is left."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            delay = -self._tokens / self.rate
+        self._sleep(delay)
@@ -22,16 +22,109 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import logging
 import socket
+import time
+
+from .. import metrics
+
+
+log = logging.getLogger(__name__)
 
 
 class Router:
 
     def __init__(self):
+        self.name = None
         self.hostname = socket.gethostname()
+        self.queue = None
+        self.coalescer = None
+        self.outbox = None
+        self.limiter = None
 
     def send(self, payload):
         raise NotImplementedError('Override me')
 
+    def payload(self, message, cursor, groupdict, summary=None, **kwargs):
+        raise NotImplementedError('Override me')
+
+    def emit(self, message, cursor, groupdict, priority=0, **kwargs):
+        """Route a matched message, coalescing it if configured."""
+        if self.coalescer is not None:
+            self.coalescer.add(message, cursor, groupdict, kwargs, priority)
+        else:
+            self.deliver(self.payload(message, cursor, groupdict, **kwargs),
+                         priority)
+
+    def deliver(self, payload, priority=0):
+        """Send the payload, via the delivery queue if one is attached."""
+        if self.queue is None:
+            return self.transmit(payload)
+        self.queue.put(payload, priority)
+
+    def transmit(self, payload):
+        """Send the payload, recording how long it takes.
+
+        With an outbox attached, a payload that fails to be sent is put
+        in the outbox to be sent again, as are those after it until the
+        outbox is drained, so that they are delivered in order.
+
+        """
+        if self.outbox is None:
+            return self._send_measured(payload)
+        if len(self.outbox):
+            self.outbox.put(payload)
+            return None
+        if not self.resend(payload):
+            self.outbox.put(payload)
+
+    def resend(self, payload):
+        """Send a payload, returning False if it is to be sent again.
+
+        Only payloads that failed for connection errors, 429 or 5xx
+        are to be sent again. Those rejected with other responses would
+        never be delivered, and are dropped.
+
+        """
+        try:
+            response = self._send_measured(payload)
+        except Exception:
+            log.exception('Failed to deliver payload via %s', self.name)
+            return False
+        if getattr(response, 'ok', True):
+            return True
+        status = getattr(response, 'status_code', None)
+        if status is None or status == 429 or status >= 500:
+            return False
+        log.error('Dropped a payload to %s rejected with %d', self.name,
+                  status)
+        metrics.inc('kikori_payloads_rejected_total', router=self.name)
+        return True
+
+    def _send_measured(self, payload):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = self.send(payload)
+        except Exception:
+            metrics.inc('kikori_delivery_failures_total', router=self.name)
+            raise
+        finally:
+            metrics.observe('kikori_delivery_seconds',
+                            time.monotonic() - start, router=self.name)
+        if not getattr(response, 'ok', True):
+            metrics.inc('kikori_delivery_failures_total', router=self.name)
+        return response
+
+    def close(self, timeout=None):
+        """Flush messages and payloads pending delivery."""
+        if self.coalescer is not None:
+            self.coalescer.close()
+        if self.queue is not None:
+            self.queue.close(timeout)
+        if self.outbox is not None:
+            self.outbox.close()
+
     def send_hello(self):
         raise NotImplementedError('Override me')
@@ -22,11 +22,91 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import requests
+import functools
+import logging
 
+from ..utils.template import compile_template
+from .http import HTTPClient
 from .router import Router
 
 
+log = logging.getLogger(__name__)
+
+
+class _Renderer:
+    """Build payloads with a set of templates parsed once.
+
+    Renderers are shared by routers with the same templates, and each
+    keeps the last payload built, so that a message routed to several
+    of them with the same args is rendered once.
+
+    """
+
+    def __init__(self, hostname, color, title, text, footer, channel,
+                 digest):
+        self.hostname = hostname
+        self.color = color
+        self.title = compile_template(title)
+        self.text = compile_template(text)
+        self.footer = compile_template(footer)
+        self.channel = channel
+        self.digest = compile_template(digest)
+        # The line number is counted only if referred to
+        self._lineno = any('LINENO' in t.fields
+                           for t in [self.title, self.text, self.footer])
+        self._digest_lineno = self._lineno or 'LINENO' in self.digest.fields
+        self._last = None
+
+    def payload(self, message, cursor, groupdict, summary=None):
+        if summary is None:
+            last = self._last
+            if (last is not None and last[0] is message and
+                    last[1] is cursor and last[2] is groupdict):
+                return last[3]
+
+        values = {'HOSTNAME': self.hostname,
+                  'LOGFILE': cursor.path,
+                  'MESSAGE': message}
+        values.update(groupdict)
+        if summary:
+            values.update(summary)
+        if ('LINENO' not in values and
+                (self._digest_lineno if summary else self._lineno)):
+            line = cursor.line
+            # Unknown if the file can no longer be read
+            values['LINENO'] = '?' if line is None else line
+
+        title = self.title.render(values)
+        text = self.text.render(values)
+        footer = self.footer.render(values)
+
+        payload = {
+            'fallback': title + '(' + footer + ')',
+            'attachments': [{
+                'color': self.color,
+                'title': title,
+                'text': text,
+                'footer': footer,
+                'mrkdwn_in': ['text']}],
+            'username': 'kikori',
+            'icon_emoji': ':evergreen_tree:'}
+        if self.channel:
+            payload['channel'] = self.channel
+        if summary:
+            pretext = self.digest.render(values)
+            payload['fallback'] = pretext + ': ' + payload['fallback']
+            payload['attachments'][0]['pretext'] = pretext
+        else:
+            # Replaced at once, so that threads see a consistent entry
+            self._last = message, cursor, groupdict, payload
+        return payload
+
+
+@functools.lru_cache(maxsize=256)
+def _renderer(*args):
+    return _Renderer(*args)
+
+
 class Slack(Router):
 
     def __init__(self,
@@ -35,17 +115,32 @@ class Slack(Router):
                  color=None,
                  title=None,
                  text=None,
-                 footer=None):
+                 footer=None,
+                 digest=None,
+                 http=None):
         super().__init__()
         self.webhook_url = webhook_url
+        self.http = HTTPClient(webhook_url, **(http or {}))
         self.channel = channel
         self.color = color or '#eeeeee'
         self.title = title or 'Message from {HOSTNAME}'
         self.text = text or '```{MESSAGE}```'
         self.footer = footer or '{HOSTNAME}:{LOGFILE}:{LINENO}'
+        self.digest = digest or ('{COUNT} occurrences from {FIRST_TIME} '
+                                 '(line {FIRST_LINENO}) to {LAST_TIME} '
+                                 '(line {LAST_LINENO})')
+        # Templates are parsed on startup, so that errors in them are
+        # found early
+        self._renderer = _renderer(self.hostname, self.color, self.title,
+                                   self.text, self.footer, self.channel,
+                                   self.digest)
 
     def send(self, payload):
-        return requests.post(self.webhook_url, json=payload)
+        response = self.http.post(payload)
+        if not response.ok:
+            log.error('Slack responded with %d: %s',
+                      response.status_code, response.text)
+        return response
 
     def send_hello(self):
         import kikori
@@ -58,31 +153,32 @@ class Slack(Router):
             payload['channel'] = self.channel
         return self.send(payload)
 
-    def payload(self, message, cursor, groupdict, color=None, title=None,
-                text=None, footer=None, channel=None):
-        format_args = {'HOSTNAME': self.hostname,
-                       'LOGFILE': cursor.path,
-                       'LINENO': cursor.line,
-                       'MESSAGE': message}
-        format_args.update(**groupdict)
+    def payload(self, message, cursor, groupdict, summary=None, color=None,
+                title=None, text=None, footer=None, channel=None,
+                digest=None):
+        """Build a payload for a matched message.
 
-        color = color or self.color
-        title = (title or self.title).format(**format_args)
-        text = (text or self.text).format(**format_args)
-        footer = (footer or self.footer).format(**format_args)
-        channel = channel or self.channel
+        Args:
+            message (str): The matched message.
+            cursor: The cursor at the message.
+            groupdict (dict): Named groups matched in the message.
+            summary (dict): COUNT, FIRST_TIME, LAST_TIME, FIRST_LINENO
+                and LAST_LINENO of the messages coalesced into this
+                one, if any.
 
-        payload = {
-            'fallback': title + '(' + footer + ')',
-            'attachments': [{
-                'color': color,
-                'title': title,
-                'text': text,
-                'footer': footer,
-                'mrkdwn_in': ['text']}],
-            'username': 'kikori',
-            'icon_emoji': ':evergreen_tree:'}
-        if channel:
-            payload['channel'] = channel
+        Returns:
+            dict: The payload, which is shared with other routers it
+                has been built for and must not be modified.
 
-        return payload
+        """
+        if color or title or text or footer or channel or digest:
+            renderer = _renderer(self.hostname,
+                                 color or self.color,
+                                 title or self.title,
+                                 text or self.text,
+                                 footer or self.footer,
+                                 channel or self.channel,
+                                 digest or self.digest)
+        else:
+            renderer = self._renderer
+        return renderer.payload(message, cursor, groupdict, summary)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from . import config
+from .handlers.handler import Cursor
+from .routers.router import Router
+
+
+log = logging.getLogger(__name__)
+
+
+class RemoteRouter(Router):
+    """Relay matched messages from a shard process to the parent.
+
+    Args:
+        name (str): The name of the router in the parent process.
+        channel (multiprocessing.Queue): The queue to the parent.
+
+    """
+
+    def __init__(self, name, channel):
+        super().__init__()
+        self.name = name
+        self.channel = channel
+
+    def emit(self, message, cursor, groupdict, **kwargs):
+        # The line index cannot cross processes, so the line number is
+        # resolved here
+        cursor = Cursor(cursor.path, cursor.pos, cursor.line,
+                        dev=cursor.dev, ino=cursor.ino)
+        self.channel.put((self.name, message, cursor, groupdict, kwargs))
+
+    def send_hello(self):
+        pass
+
+
+class Relay:
+    """Emit messages relayed from shard processes with the routers.
+
+    Args:
+        channel (multiprocessing.Queue): The queue from the shards.
+        routers (dict): The routers by name.
+
+    """
+
+    def __init__(self, channel, routers):
+        self.channel = channel
+        self.routers = routers
+        self._thread = threading.Thread(target=self._run, name='relay')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while 1:
+            item = self.channel.get()
+            if item is None:
+                break
+            name, message, cursor, groupdict, kwargs = item
+            try:
+                self.routers[name].emit(message, cursor, groupdict, **kwargs)
+            except Exception:
+                log.exception('Failed to route message from %s',
+                              cursor.path)
+
+    def close(self):
+        """Stop after emitting all messages relayed so far."""
+        self.channel.put(None)
+        self._thread.join()
+
+
+def run_shards(routers, count, target, *args, reload_routers=None):
+    """Run shard processes until interrupted.
+
+    Each shard process runs ``target(index, channel, *args)``, where
+    the messages put in ``channel`` by :class:`RemoteRouter` are
+    emitted with ``routers`` in this process, so that alerts are
+    delivered once no matter which shard matched them. When the config
+    is reloaded, the shards are signaled to reload theirs.
+
+    Args:
+        routers (dict): The routers by name.
+        count (int): The number of shard processes.
+        target (callable): The function to run in each process.
+        reload_routers (callable): The function to apply changes in
+            routers with when the config is reloaded.
+
+    """
+    # Spawn rather than fork, since this process already runs threads
+    ctx = multiprocessing.get_context('spawn')
+    channel = ctx.Queue()
+    relay = Relay(channel, routers)
+
+    processes = []
+    for index in range(count):
+        p = ctx.Process(target=target,
+                        args=(index, channel) + args,
+                        name='kikori-shard-{}'.format(index))
+        p.start()
+        processes.append(p)
+    log.info('Started %d shard processes', count)
+
+    try:
+        while all(p.is_alive() for p in processes):
+            time.sleep(1)
+            if config.reloaded.is_set():
+                config.reloaded.clear()
+                if reload_routers is not None:
+                    try:
+                        reload_routers()
+                    except Exception:
+                        log.exception('Failed to reload routers')
+                for p in processes:
+                    os.kill(p.pid, signal.SIGUSR1)
+        log.error('A shard process exited unexpectedly; shutting down')
+    except KeyboardInterrupt:
+        pass
+
+    for p in processes:
+        if p.is_alive():
+            p.terminate()
+    for p in processes:
+        p.join()
+    relay.close()
@@ -22,6 +22,14 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import bisect
+import logging
+import os
+import threading
+import weakref
+
+
+log = logging.getLogger(__name__)
 
 
 def blocks(f, size=65536):
@@ -32,5 +40,148 @@ def blocks(f, size=65536):
         yield b
 
 
-def count_lines(f):
-    return sum(b.count('\n') for b in blocks(f))
+def read_lines(f, size=1 << 20):
+    """Read all lines of a binary stream in large chunks.
+
+    Args:
+        f: A binary stream.
+        size (int): The number of bytes to read at a time.
+
+    Yields:
+        tuple: Each line, without its newline, and the offset past it.
+            The last line is yielded even without a newline.
+
+    """
+    pos = 0
+    partial = b''
+    for chunk in blocks(f, size):
+        if partial:
+            chunk = partial + chunk
+        lines = chunk.split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            pos += len(line) + 1
+            yield line, pos
+    if partial:
+        yield partial, pos + len(partial)
+
+
+def count_lines(f, end=None, size=1 << 20):
+    """Count newlines in a binary stream from its current position.
+
+    Args:
+        f: A binary stream.
+        end (int): The position to stop counting at; EOF if None.
+        size (int): The number of bytes to read at a time.
+
+    Returns:
+        int
+
+    """
+    if end is None:
+        return sum(b.count(b'\n') for b in blocks(f, size))
+    n = 0
+    remaining = end - f.tell()
+    while remaining > 0:
+        b = f.read(min(size, remaining))
+        if not b:
+            break
+        n += b.count(b'\n')
+        remaining -= len(b)
+    return n
+
+
+class LineIndex:
+    """Map byte offsets in a file to line numbers, counted on demand.
+
+    The line numbers at every ``interval`` bytes and at the last
+    offset looked up are remembered, so that a lookup only counts
+    newlines from the nearest remembered offset before it.
+
+    Newlines are counted through a descriptor given by :meth:`follow`
+    if any, so that they are counted even after the file is moved or
+    deleted, and otherwise by opening the file at its path.
+
+    Args:
+        path (str): The path to the file.
+        interval (int): The number of bytes between remembered offsets.
+
+    """
+
+    def __init__(self, path, interval=1 << 24):
+        self.path = path
+        self.interval = interval
+        self._offsets = [0]
+        self._lines = [0]
+        self._last = 0, 0
+        self._lock = threading.Lock()
+        self._fd = None
+        self._close_fd = None
+
+    def follow(self, fd):
+        """Count newlines through a duplicate of an open descriptor.
+
+        The duplicate is kept open until :meth:`close` or until the
+        index is no longer referred to.
+
+        """
+        fd = os.dup(fd)
+        with self._lock:
+            self._close()
+            self._fd = fd
+            self._close_fd = weakref.finalize(self, os.close, fd)
+
+    def close(self):
+        """Close the descriptor being followed, if any."""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._close_fd is not None:
+            self._close_fd()
+            self._fd = self._close_fd = None
+
+    def line_at(self, pos):
+        """Get the number of newlines before a byte offset.
+
+        Returns:
+            int: The number of newlines, or None if the file can no
+                longer be read.
+
+        """
+        with self._lock:
+            i = bisect.bisect_right(self._offsets, pos) - 1
+            offset, line = self._offsets[i], self._lines[i]
+            if offset < self._last[0] <= pos:
+                offset, line = self._last
+            if offset == pos:
+                return line
+            try:
+                if self._fd is not None:
+                    offset, line = self._count(self._fd, offset, line, pos)
+                else:
+                    with open(self.path, 'rb', buffering=0) as f:
+                        offset, line = self._count(f.fileno(), offset, line,
+                                                   pos)
+            except OSError as e:
+                log.warning('Failed to count lines of %s: %s', self.path, e)
+                return None
+            self._last = offset, line
+            return line
+
+    def _count(self, fd, offset, line, pos, size=1 << 20):
+        # Read with pread, which leaves the offset of a descriptor
+        # shared with a reader as it is
+        while offset < pos:
+            end = min((offset // self.interval + 1) * self.interval, pos)
+            while offset < end:
+                b = os.pread(fd, min(size, end - offset), offset)
+                if not b:
+                    # Truncated; the line at the end is as good as any
+                    return offset, line
+                line += b.count(b'\n')
+                offset += len(b)
+            if offset % self.interval == 0 and offset > self._offsets[-1]:
+                self._offsets.append(offset)
+                self._lines.append(line)
+        return offset, line
@@ -22,36 +22,185 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import re
 
+try:
+    import orjson as _json
+except ImportError:
+    try:
+        import ujson as _json
+    except ImportError:
+        import json as _json
 
-def filter_json(x, y):
-    """Given matching specification `x`, extract matching items from `y`.
+from .regex import required_literals as _required_regex_literals
+
+
+#: Decode a JSON document from str or UTF-8 encoded bytes, with the
+#: fastest decoder installed; all of them raise ValueError on errors
+loads = _json.loads
+
+_MISSING = object()
+
+# Escaped by some encoders, e.g., / by PHP and <, > and & by Go
+_UNSAFE_CHARS = frozenset('"\\/<>&')
+
+
+def _is_verbatim(text):
+    # Whether an encoder writes the string as-is in a JSON document
+    return all(' ' <= c <= '~' and c not in _UNSAFE_CHARS for c in text)
+
+
+def required_literals(x):
+    """Get the strings any JSON line matching a specification contains.
+
+    Keys are required as quoted strings and regex values by their
+    required literals, as long as they appear verbatim in encoded
+    JSON.
 
     Args:
-        x (dict): The matching specification.
-        y: A valid JSON object.
+        x (dict): The matching specification, with regex values not
+            yet compiled.
 
     Returns:
-        Matched item(s) from y.
+        list: The required literals as str.
 
     """
-    result = {}
+    literals = []
     for key, value in x.items():
-        if key not in y:
-            return None
+        if _is_verbatim(key):
+            literals.append('"' + key + '"')
         if isinstance(value, dict):
-            result[key] = filter_json(value, y[key])
+            literals.extend(required_literals(value))
+        elif isinstance(value, str):
+            literals.extend(lit for lit in _required_regex_literals(value)
+                            if _is_verbatim(lit))
+    return literals
+
+
+def _equals(x, y):
+    # Unlike in Python, true is not 1 in JSON
+    return x == y and isinstance(x, bool) == isinstance(y, bool)
+
+
+# The order matchers are tried in; equality is the most selective and
+# cheapest to test
+_EQUALS, _ANY_OF, _REGEX = range(3)
+
+
+def _compile_value(x):
+    """Compile a value of a matching specification.
+
+    Returns:
+        tuple: The rank of the matcher and the matcher, which returns
+            the groupdict if matched or None.
+
+    """
+    if isinstance(x, list):
+        alternatives = [_compile_value(item)[1] for item in x]
+
+        def any_of(y):
+            for matcher in alternatives:
+                matched = matcher(y)
+                if matched is not None:
+                    return matched
+            return None
+
+        return _ANY_OF, any_of
+
+    if isinstance(x, str):
+        x = re.compile(x)
+    if not hasattr(x, 'match'):
+        def equals(y):
+            return {} if _equals(x, y) else None
+
+        return _EQUALS, equals
+
+    match = x.match
+
+    def regex(y):
+        if isinstance(y, str):
+            m = match(y)
+        elif isinstance(y, (int, float)) and not isinstance(y, bool):
+            # Numbers are matched as written in JSON
+            m = match(str(y))
         else:
-            result[key] = _match_json_value(value, y[key])
-    return result
+            return None
+        return None if m is None else m.groupdict()
 
+    return _REGEX, regex
 
-def _match_json_value(x, y):
-    if isinstance(x, (int, float)):
-        return y if x == y else None
-    elif isinstance(x, list):
-        raise NotImplementedError
+
+def _flatten(x, path, result):
+    if isinstance(x, dict):
+        for key, value in x.items():
+            _flatten(value, path + (key,), result)
     else:
-        # Must be regex match object
-        m = x.match(y)
-        return m.groupdict() if m else None
+        rank, matcher = _compile_value(x)
+        result.append((rank, len(path), path, matcher))
+
+
+def compile_filter(x):
+    """Compile a matching specification into a function matching JSON.
+
+    Values of the specification are matched by key paths, and can be
+    regexes, which also match numbers as written in JSON, other
+    scalars to equal, or lists of alternatives. Matchers are tried in
+    the order of their selectivity, so that most mismatches are found
+    by a few dict lookups.
+
+    Args:
+        x: The matching specification, usually a dict.
+
+    Returns:
+        function: A function taking a decoded JSON object and returning
+            the groupdict merged over all regex matches, or None if
+            not matched.
+
+    """
+    matchers = []
+    _flatten(x, (), matchers)
+    matchers.sort(key=lambda m: m[:2])
+    matchers = [(path, matcher) for _, _, path, matcher in matchers]
+
+    def match(y):
+        groupdict = {}
+        for path, matcher in matchers:
+            value = y
+            for key in path:
+                if not isinstance(value, dict):
+                    return None
+                value = value.get(key, _MISSING)
+                if value is _MISSING:
+                    return None
+            matched = matcher(value)
+            if matched is None:
+                return None
+            groupdict.update(matched)
+        return groupdict
+
+    return match
+
+
+def _extract(x, y):
+    if not isinstance(x, dict):
+        return y
+    return {key: _extract(value, y[key]) for key, value in x.items()}
+
+
+def filter_json(x, y):
+    """Given matching specification `x`, extract matching items from `y`.
+
+    Values are matched as by :func:`compile_filter`, which is better
+    to use to match many objects against the same specification.
+
+    Args:
+        x (dict): The matching specification.
+        y: A valid JSON object.
+
+    Returns:
+        Matched item(s) from y, or None if not matched.
+
+    """
+    if compile_filter(x)(y) is None:
+        return None
+    return _extract(x, y)
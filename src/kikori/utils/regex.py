@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+if hasattr(sre_parse, 'POSSESSIVE_REPEAT'):
+    _REPEATS.add(sre_parse.POSSESSIVE_REPEAT)
+
+
+def _collect(items, run, runs):
+    """Collect runs of literals from parsed regex items.
+
+    Args:
+        items: A sequence of parsed regex items.
+        run (list): Characters of the run of literals preceding items.
+        runs (list): The list completed runs are appended to.
+
+    Returns:
+        list: Characters of the run of literals at the end of items.
+
+    """
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+        elif (op is sre_parse.SUBPATTERN and
+              not av[1] & sre_parse.SRE_FLAG_IGNORECASE):
+            # A group matches in line with its surroundings
+            run = _collect(av[-1], run, runs)
+        else:
+            runs.append(''.join(run))
+            run = []
+            if op in _REPEATS and av[0] >= 1:
+                # Whatever a repeated item requires is required at
+                # least once
+                runs.append(''.join(_collect(av[2], [], runs)))
+    return run
+
+
+class _DecodingPattern:
+    """Match bytes against a str pattern by decoding them."""
+
+    def __init__(self, pattern, encoding):
+        self.pattern = pattern
+        self.encoding = encoding
+
+    def match(self, b):
+        return self.pattern.match(b.decode(self.encoding, 'replace'))
+
+
+def compile_bytes(pattern, encoding='utf-8'):
+    """Compile a str regex to match bytes of encoded text.
+
+    An ASCII pattern is compiled as a bytes pattern, in which case
+    character classes for digits, word characters and whitespace only
+    match ASCII characters. Any other pattern matches by decoding the
+    bytes first.
+
+    Args:
+        pattern (str): The regex.
+        encoding (str): The encoding of the bytes to match.
+
+    Returns:
+        An object with a ``match`` method taking bytes.
+
+    """
+    try:
+        return re.compile(pattern.encode('ascii'))
+    except (UnicodeEncodeError, re.error):
+        return _DecodingPattern(re.compile(pattern), encoding)
+
+
+def required_literals(pattern):
+    """Find literal substrings contained in every match of a pattern.
+
+    Args:
+        pattern: A regex string or compiled str pattern.
+
+    Returns:
+        list: The literal strings, longest first.
+
+    """
+    if isinstance(pattern, str):
+        pattern = re.compile(pattern)
+    if pattern.flags & re.IGNORECASE:
+        return []
+    runs = []
+    runs.append(''.join(_collect(sre_parse.parse(pattern.pattern,
+                                                 pattern.flags),
+                                 [], runs)))
+    return sorted(sorted(set(r for r in runs if r)), key=len, reverse=True)
+
+
+def required_literal(pattern):
+    """Find the longest literal contained in every match of a pattern.
+
+    Returns:
+        str: The literal, or None if no literal is required.
+
+    """
+    literals = required_literals(pattern)
+    return literals[0] if literals else None
+
+
+def _trie_regex(trie):
+    """Build a regex string from a trie of literals.
+
+    A key of '' in a trie node marks the end of a literal. Alternatives
+    are ordered such that the longest literal at a position matches.
+
+    """
+    branches = [re.escape(c) + _trie_regex(child)
+                for c, child in sorted(trie.items()) if c]
+    if not branches:
+        return ''
+    if len(branches) == 1:
+        regex = branches[0]
+        if '' in trie:
+            regex = '(?:{})?'.format(regex)
+        return regex
+    regex = '(?:{})'.format('|'.join(branches))
+    if '' in trie:
+        regex += '?'
+    return regex
+
+
+def literals_regex(literals):
+    """Compile a regex finding all literal occurrences, overlapping ones
+    included.
+
+    At each position of a string, the longest of the literals starting
+    there is captured; any other literal starting there is a prefix of
+    it.
+
+    Args:
+        literals (list): Non-empty literal strings, all str or all
+            bytes.
+
+    Returns:
+        re.Pattern: A pattern to use with ``findall``.
+
+    """
+    encoding = None
+    if literals and isinstance(literals[0], bytes):
+        # Build the regex from str, whose characters are the bytes
+        encoding = 'latin-1'
+        literals = [lit.decode(encoding) for lit in literals]
+    trie = {}
+    for literal in literals:
+        node = trie
+        for c in literal:
+            node = node.setdefault(c, {})
+        node[''] = {}
+    regex = '(?=({}))'.format(_trie_regex(trie))
+    if encoding:
+        regex = regex.encode(encoding)
+    return re.compile(regex)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+
+
+class TailReader:
+    """Read lines appended to a file through a descriptor kept open.
+
+    The file is read in large binary chunks, split into lines and their
+    offsets tracked arithmetically. An incomplete line at the end of
+    file is held back until its newline is written.
+
+    Args:
+        path (str): The path to the file.
+        pos (int): The byte offset to start reading from.
+        size (int): The number of bytes to read at a time.
+
+    """
+
+    def __init__(self, path, pos=0, size=1 << 20):
+        self.path = path
+        self.size = size
+        self._f = open(path, 'rb', buffering=0)
+        self._f.seek(pos)
+        self._partial = b''
+        self.pos = pos
+
+    def __repr__(self):
+        return 'TailReader(path={!r}, pos={!r})'.format(self.path, self.pos)
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def stat(self):
+        """Stat the file being read, even if moved or deleted."""
+        return os.fstat(self._f.fileno())
+
+    def read_lines(self):
+        """Read lines appended since the last read.
+
+        The position is advanced line by line, so that if the generator
+        is closed before exhausted, the lines not yielded are read again
+        next time.
+
+        Yields:
+            tuple: Each line, without its newline, and the offset past
+                its newline.
+
+        """
+        done = False
+        try:
+            while 1:
+                chunk = self._f.read(self.size)
+                if not chunk:
+                    break
+                if self._partial:
+                    chunk = self._partial + chunk
+                lines = chunk.split(b'\n')
+                self._partial = lines.pop()
+                for line in lines:
+                    self.pos += len(line) + 1
+                    yield line, self.pos
+            done = True
+        finally:
+            if not done and not self._f.closed:
+                # Drop the rest of the chunk read ahead of the position
+                self._f.seek(self.pos)
+                self._partial = b''
+
+    def close(self):
+        self._f.close()
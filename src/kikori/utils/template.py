@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import functools
+import string
+
+
+def _root(name):
+    """Get the key a field looks up, e.g., ``a`` for ``a.b[0]``."""
+    for i, c in enumerate(name):
+        if c in '.[':
+            return name[:i]
+    return name
+
+
+class Template:
+    """A template for ``str.format_map`` parsed once.
+
+    The fields a template refers to are known before rendering, so
+    that values costly to get are only got when referred to, and a
+    template without fields is rendered without formatting.
+
+    Args:
+        source (str): The template.
+
+    Raises:
+        ValueError: If the template is malformed.
+
+    """
+
+    def __init__(self, source):
+        self.source = source
+        parsed = list(string.Formatter().parse(source))
+        #: The keys of values the template refers to
+        self.fields = frozenset(_root(name) for _, name, _, _ in parsed
+                                if name is not None)
+        self._constant = None
+        if not self.fields:
+            self._constant = ''.join(literal for literal, _, _, _ in parsed)
+
+    def __repr__(self):
+        return 'Template({!r})'.format(self.source)
+
+    def render(self, values):
+        """Render the template.
+
+        Args:
+            values (dict): The values by key.
+
+        Returns:
+            str
+
+        """
+        if self._constant is not None:
+            return self._constant
+        return self.source.format_map(values)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_template(source):
+    """Get the template parsed from a source, parsing it only once."""
+    return Template(source)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import concurrent.futures
+import json
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+
+log = logging.getLogger(__name__)
+
+
+def _key(conf):
+    # What a handler is created from, other than its triggers
+    return json.dumps({k: v for k, v in conf.items() if k != 'triggers'},
+                      sort_keys=True, default=str)
+
+
+def _depth(conf):
+    # Specific files are looked for in the directory itself only
+    return conf.get('depth', 0 if 'files' in conf else None)
+
+
+def _watch_paths(dir, depth=None):
+    """Get the directories to watch, and whether recursively.
+
+    A watch block with its depth limited is watched by a non-recursive
+    watch per directory within the depth, rather than by a recursive
+    one covering the whole tree.
+
+    Returns:
+        list: Tuples of the directory and whether to watch it
+            recursively.
+
+    """
+    if depth is None:
+        return [(dir, True)]
+    paths = []
+    base_depth = dir.rstrip(os.sep).count(os.sep)
+    for root, dirs, _ in os.walk(dir):
+        if root.rstrip(os.sep).count(os.sep) - base_depth >= depth:
+            dirs[:] = []
+        paths.append((root, False))
+    return paths
+
+
+class Watches:
+    """The handlers of watch blocks scheduled with an observer.
+
+    Watch blocks are updated in place, so that reloading the config
+    only changes what has changed: the triggers of a block are replaced
+    in its handler, and a block changed otherwise gets a new handler
+    that takes over the states of the files of the old one rather than
+    counting their lines anew. A directory is only scheduled anew if no
+    other block watches it. The directories within the depth of a block
+    are walked anew on every update, so that subdirectories created
+    later are watched once the config is reloaded.
+
+    Args:
+        observer (Observer): The observer to schedule handlers with.
+        create_handler (callable): The function creating a handler
+            from a watch block.
+        checkpoints (CheckpointStore): The checkpoint store handlers
+            register with.
+
+    """
+
+    def __init__(self, observer, create_handler, checkpoints=None):
+        self.observer = observer
+        self.create_handler = create_handler
+        self.checkpoints = checkpoints
+        self._watches = []
+
+    def update(self, confs):
+        """Apply watch blocks.
+
+        Args:
+            confs (list): The watch blocks.
+
+        """
+        unmatched = {}
+        for w in self._watches:
+            unmatched.setdefault(w.key, []).append(w)
+
+        # Triggers are loaded and handlers created before any is
+        # applied, so that if one fails, e.g., for an invalid pattern,
+        # the blocks are left as they are
+        kept = []
+        added = []
+        try:
+            for conf in confs:
+                key = _key(conf)
+                if unmatched.get(key):
+                    w = unmatched[key].pop(0)
+                    kept.append(
+                        (w, w.handler.load_triggers(conf['triggers']),
+                         _watch_paths(conf['dir'], _depth(conf))))
+                else:
+                    added.append((key, conf, self.create_handler(conf),
+                                  _watch_paths(conf['dir'], _depth(conf))))
+        except Exception:
+            for _, _, handler, _ in added:
+                self._close(handler)
+            raise
+
+        for w, triggers, _ in kept:
+            count = w.handler.apply_triggers(triggers)
+            if count:
+                log.info('Loaded %d trigger(s) for %s', count, w.dir)
+        removed = [w for ws in unmatched.values() for w in ws]
+        self._watches = [w for w, _, _ in kept]
+        kept_paths = ({p for _, _, paths in kept for p in paths} |
+                      {p for _, _, _, paths in added for p in paths})
+        unscheduled = set()
+        for w in removed:
+            for path, watch in zip(w.paths, w.watches):
+                if path in kept_paths:
+                    # Still watched by other blocks
+                    self.observer.remove_handler_for_watch(w.handler, watch)
+                elif path not in unscheduled:
+                    self.observer.unschedule(watch)
+                    unscheduled.add(path)
+            self._close(w.handler)
+            log.info('Stopped watching %s', w.dir)
+        for w, _, paths in kept:
+            self._rewatch(w, paths, kept_paths, unscheduled)
+
+        if not added:
+            return
+        with concurrent.futures.ThreadPoolExecutor(
+                thread_name_prefix='init') as executor:
+            for key, conf, handler, paths in added:
+                self._add(key, conf, handler, paths, removed, executor)
+
+    def _rewatch(self, w, paths, kept_paths, unscheduled):
+        """Watch the directories of a block as walked anew.
+
+        Directories created within the depth of the block since it was
+        walked are scheduled, and ones no longer found unscheduled.
+
+        """
+        if paths == w.paths:
+            return
+        old = dict(zip(w.paths, w.watches))
+        for path, watch in old.items():
+            if path in paths:
+                continue
+            if path in kept_paths:
+                # Still watched by other blocks
+                self.observer.remove_handler_for_watch(w.handler, watch)
+            elif path not in unscheduled:
+                self.observer.unschedule(watch)
+                unscheduled.add(path)
+        w.paths, w.watches = [], []
+        for path in paths:
+            watch = old.get(path)
+            if watch is None:
+                try:
+                    watch = self.observer.schedule(w.handler, path[0],
+                                                   recursive=path[1])
+                except OSError as e:
+                    # E.g., removed since walked
+                    log.warning('Failed to watch %s: %s', path[0], e)
+                    continue
+                log.info('Watching %s for %s', path[0], w.dir)
+            w.paths.append(path)
+            w.watches.append(watch)
+
+    def _close(self, handler):
+        handler.close()
+        if self.checkpoints is not None:
+            self.checkpoints.unregister(handler.checkpoint)
+
+    def _add(self, key, conf, handler, paths, removed, executor):
+        start = time.monotonic()
+        for w in removed:
+            if w.dir == conf['dir']:
+                handler.adopt(w.handler)
+        count = handler.init(conf['dir'], _depth(conf), executor,
+                             lazy=conf.get('init', 'eager') == 'lazy')
+        watches = [self.observer.schedule(handler, path, recursive=recursive)
+                   for path, recursive in paths]
+        self._watches.append(SimpleNamespace(
+            key=key, dir=conf['dir'], handler=handler, paths=paths,
+            watches=watches))
+        log.info('Watching %s with %d watch(es); found %d file(s) '
+                 'in %.2fs', conf['dir'], len(watches), count,
+                 time.monotonic() - start)
+
+    def lag(self):
+        """Get the bytes written to watched files but not read yet.
+
+        Returns:
+            dict: The bytes by full path.
+
+        """
+        result = {}
+        for w in self._watches:
+            result.update(w.handler.lag())
+        return result
+
+    def close(self):
+        """Process pending events and close the handlers."""
+        for w in self._watches:
+            w.handler.close()
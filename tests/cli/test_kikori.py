@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import copy
+
+import pytest
+
+from kikori import config
+from kikori.cli.kikori import _create_routers
+from kikori.cli.kikori import _reload_routers
+from kikori.routers.outbox import Outbox
+from kikori.routers.slack import Slack
+
+
+def test_reload_router_with_outbox(tmpdir, monkeypatch):
+    conf = {'routers': {'ops': {
+        'type': 'slack',
+        'webhook_url': 'http://localhost/',
+        'queue': {'spill_path': str(tmpdir.join('ops.spill')),
+                  'overflow': 'spill'},
+        'outbox': {'path': str(tmpdir.join('outbox')), 'backoff': 10}}}}
+    monkeypatch.setattr(config, 'conf', conf)
+
+    def send(self, payload):
+        raise ConnectionError('down')
+    monkeypatch.setattr(Slack, 'send', send)
+
+    events = []
+    init, close = Outbox.__init__, Outbox.close
+
+    def record_init(self, *args, **kwargs):
+        events.append('open')
+        init(self, *args, **kwargs)
+
+    def record_close(self):
+        close(self)
+        events.append('close')
+    monkeypatch.setattr(Outbox, '__init__', record_init)
+    monkeypatch.setattr(Outbox, 'close', record_close)
+
+    routers = _create_routers(no_hello=True)
+    confs = copy.deepcopy(conf['routers'])
+    old = routers['ops']
+    old.transmit({'text': 'pending'})
+    assert len(old.outbox) == 1
+
+    conf['routers']['ops']['args'] = {'channel': '#ops'}
+    _reload_routers(routers, confs)
+    new = routers['ops']
+    assert new is not old
+    # Never open at once
+    assert events == ['open', 'close', 'open']
+    assert len(new.outbox) == 1
+    assert new.queue is not None
+    new.close()
+
+
+def test_reload_invalid_router(monkeypatch):
+    conf = {'routers': {
+        'ops': {'type': 'slack', 'webhook_url': 'http://localhost/'},
+        'dev': {'type': 'slack', 'webhook_url': 'http://localhost/'}}}
+    monkeypatch.setattr(config, 'conf', conf)
+    routers = _create_routers(no_hello=True)
+    confs = copy.deepcopy(conf['routers'])
+    old = dict(routers)
+
+    conf['routers'] = {
+        'ops': {'type': 'slack', 'webhook_url': 'http://localhost/',
+                'args': {'channel': '#ops'}},
+        'dev': {'type': 'slack', 'webhook_url': 'http://localhost/',
+                'args': {'title': 'oops {'}}}
+    with pytest.raises(ValueError):
+        _reload_routers(routers, confs)
+    # Left as they are, to be reloaded again
+    assert routers == old
+    assert 'args' not in confs['ops']
+
+    del conf['routers']['dev']
+    _reload_routers(routers, confs)
+    assert list(routers) == ['ops']
+    assert routers['ops'] is not old['ops']
+    for router in routers.values():
+        router.close()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import glob
+import json
+import os
+
+import pytest
+
+from kikori.cli.noisyapp import Writer
+
+
+def test_message_is_deterministic(tmpdir):
+    path = str(tmpdir.join('app.log'))
+    a, b = (Writer(path, traceback_ratio=0.5, seed=1) for _ in range(2))
+    assert ([a.message('now') for _ in range(100)] ==
+            [b.message('now') for _ in range(100)])
+
+
+def test_json_message(tmpdir):
+    w = Writer(str(tmpdir.join('app.json')), format='json',
+               traceback_ratio=1.)
+    [line] = w.message('now')
+    record = json.loads(line)
+    assert record['level'] == 'ERROR'
+    assert record['exc_info'].startswith('Traceback')
+
+
+@pytest.mark.parametrize('rotate_mode', ['rename', 'copytruncate'])
+def test_rotation(tmpdir, rotate_mode):
+    path = str(tmpdir.join('app.log'))
+    w = Writer(path, rotate_mode=rotate_mode, keep=2)
+    f = open(path, 'a')
+    for i in range(3):
+        f.write('{}\n'.format(i))
+        f.flush()
+        f = w._rotate(f)
+    f.write('3\n')
+    f.close()
+    assert w.rotations == 3
+    assert [open(p).read() for p in [path, path + '.1', path + '.2']] == [
+        '3\n', '2\n', '1\n']
+    assert not os.path.exists(path + '.3')
+
+
+@pytest.mark.parametrize('rotate_mode', ['rename', 'copytruncate'])
+def test_run(tmpdir, rotate_mode):
+    path = str(tmpdir.join('app.log'))
+    w = Writer(path, rate=1000., rotate=0.1, rotate_mode=rotate_mode,
+               keep=100, duration=0.35)
+    count, rotations = w.run()
+    # As many as the writer gets to in time, which varies with load
+    assert rotations <= 3
+    assert len(glob.glob(path + '.*')) == rotations
+    # No line is lost by rotation
+    assert sum(1 for p in glob.glob(path + '*') for _ in open(p)) == count
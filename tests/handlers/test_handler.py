@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import concurrent.futures
+import os
+import time
+
+from watchdog.events import FileCreatedEvent
+from watchdog.events import FileDeletedEvent
+from watchdog.events import FileModifiedEvent
+from watchdog.events import FileMovedEvent
+
+from kikori import metrics
+from kikori.handlers.handler import Cursor
+from kikori.handlers.handler import Message
+from kikori.handlers.text_logger_handler import TextLoggerHandler
+from kikori.routers.router import Router
+
+
+class StubRouter(Router):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, message, cursor, groupdict, **kwargs):
+        self.messages.append((message, cursor))
+
+
+def _handler(router, **kwargs):
+    return TextLoggerHandler(r'.*\.log$',
+                             r'^\d+:',
+                             [{'pattern': r'^\d+:ERROR:.*',
+                               'routers': [{'name': 'stub'}]}],
+                             {'stub': router},
+                             **kwargs)
+
+
+def test_lazy_lineno(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('1:INFO:a\n2:INFO:b\n')
+    router = StubRouter()
+    handler = _handler(router, lazy_lineno=True)
+    handler.init(str(tmpdir))
+    cursor, _ = handler._cache[str(log)]
+    assert cursor._line is None
+
+    log.write('3:ERROR:c\n  more\n4:INFO:d\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    [(message, cursor)] = router.messages
+    assert message == '3:ERROR:c\n  more'
+    assert cursor.line == 3
+
+
+def test_lazy_lineno_of_deleted_file(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('1:INFO:a\n')
+    router = StubRouter()
+    handler = _handler(router, lazy_lineno=True)
+    handler.init(str(tmpdir))
+    log.write('2:INFO:b\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+
+    # Drained through the descriptor still open
+    log.write('3:ERROR:c\n4:INFO:d\n', mode='a')
+    os.remove(str(log))
+    handler.dispatch(FileDeletedEvent(str(log)))
+    [(message, cursor)] = router.messages
+    assert (message, cursor.line) == ('3:ERROR:c', 3)
+    assert str(log) not in handler._cache
+    assert str(log) not in handler._file_locks
+
+
+def test_lazy_init(tmpdir):
+    log = tmpdir.join('a', 'b', 'app.log')
+    log.write('1:ERROR:a\n2:INFO:b\n', ensure=True)
+    tmpdir.join('app.log').write('1:ERROR:a\n')
+    router = StubRouter()
+    handler = _handler(router)
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        assert handler.init(str(tmpdir), executor=executor, lazy=True) == 2
+    assert not handler._cache
+    # Not materialized by events of others
+    handler.dispatch(FileModifiedEvent(str(tmpdir.join('app.log'))))
+    assert str(log) in handler._unmaterialized
+
+    log.write('3:ERROR:c\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    [(message, cursor)] = router.messages
+    assert (message, cursor.line) == ('3:ERROR:c', 3)
+    assert not handler._unmaterialized
+    # Lines are not counted on the first event
+    assert handler._cache[str(log)][0]._line is None
+
+
+def test_init_depth(tmpdir):
+    for path in ['app.log', 'a/app.log', 'a/b/app.log', 'a/app.txt']:
+        tmpdir.join(path).write('', ensure=True)
+    handler = _handler(StubRouter())
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        found = sorted(path for path, _ in handler.scan(str(tmpdir), 1,
+                                                        executor))
+    assert found == [str(tmpdir.join('a', 'app.log')),
+                     str(tmpdir.join('app.log'))]
+    assert handler.init(str(tmpdir), depth=0) == 1
+
+
+def test_message_limits():
+    message = Message(b'1:ERROR:a', Cursor('/log', 10, 1))
+    for line in [b'  b', b'  c', b'  d']:
+        message.append(line, max_lines=2)
+    assert message.text == b'1:ERROR:a\n  b\n[2 more line(s) truncated]'
+
+    message = Message(b'1:ERROR:a', Cursor('/log', 10, 1))
+    for line in [b'  b', b'  cc', b'  d']:
+        message.append(line, max_bytes=13)
+    assert message.text == b'1:ERROR:a\n  b\n[2 more line(s) truncated]'
+    assert len(message) == 13
+
+
+def test_message_cursor():
+    cursor = Cursor('/log', 10, 1, dev=1, ino=2)
+    message = Message(b'1:ERROR:a', cursor)
+    cursor.advance(20)
+    message.append(b'  b')
+    snapshot = message.cursor
+    assert (snapshot.path, snapshot.pos, snapshot.line) == ('/log', 10, 1)
+    assert (snapshot.dev, snapshot.ino) == (1, 2)
+    cursor.advance(30)
+    assert (snapshot.pos, snapshot.line) == (10, 1)
+    assert not hasattr(message, '__dict__')
+    assert not hasattr(cursor, '__dict__')
+
+
+def test_metrics(tmpdir, monkeypatch):
+    registry = metrics.Registry(enabled=False)
+    monkeypatch.setattr(metrics, 'registry', registry)
+    log = tmpdir.join('app.log')
+    log.write('')
+    handler = _handler(StubRouter())
+    handler.init(str(tmpdir))
+    log.write('1:ERROR:a\n2:INFO:b\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    assert registry.totals() == {}
+
+    registry.enabled = True
+    log.write('3:ERROR:c\n  more\n4:INFO:d\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    totals = registry.totals()
+    assert totals['kikori_lines_read_total'] == 3
+    assert totals['kikori_bytes_read_total'] == 26
+    assert totals['kikori_messages_total'] == 2
+    assert totals['kikori_trigger_matches_total'] == 1
+    assert 'kikori_lines_read_total{path' not in registry.render()
+
+
+def test_truncated_message(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('')
+    router = StubRouter()
+    handler = _handler(router, max_lines=3)
+    handler.init(str(tmpdir))
+    log.write('1:ERROR:a\n' + '  more\n' * 5 + '2:INFO:b\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    [(message, _)] = router.messages
+    assert message == '1:ERROR:a\n  more\n  more\n[3 more line(s) truncated]'
+
+
+def test_flush_timeout(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('')
+    router = StubRouter()
+    handler = _handler(router, flush_timeout=0.05)
+    handler.init(str(tmpdir))
+
+    # Continued after EOF
+    log.write('1:ERROR:a\n  more\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    log.write('  rest\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    assert router.messages == []
+    for _ in range(100):
+        if router.messages:
+            break
+        time.sleep(0.01)
+    [(message, cursor)] = router.messages
+    assert (message, cursor.line) == ('1:ERROR:a\n  more\n  rest', 1)
+
+    # Flushed on close
+    log.write('2:ERROR:b\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    handler.close()
+    assert [m for m, _ in router.messages][1:] == ['2:ERROR:b']
+
+
+def test_max_open_files(tmpdir):
+    paths = [str(tmpdir.join('{}.log'.format(i))) for i in range(4)]
+    for path in paths:
+        open(path, 'w').close()
+    router = StubRouter()
+    handler = _handler(router, max_open_files=2)
+    handler.init(str(tmpdir))
+
+    for i in range(3):
+        for path in paths:
+            with open(path, 'a') as f:
+                f.write('{}:ERROR:x\n'.format(i))
+            handler.dispatch(FileModifiedEvent(path))
+            assert len(handler._readers) <= 2
+    for path in paths:
+        messages = [(m, cursor.line) for m, cursor in router.messages
+                    if cursor.path == path]
+        assert messages == [('{}:ERROR:x'.format(i), i + 1)
+                            for i in range(3)]
+
+    # Not read from where the closed file has been read up to
+    os.rename(paths[1], paths[0])
+    handler._process_file(paths[0])
+    assert len(router.messages) == 12
+    handler.close()
+
+
+def _messages(router):
+    return [(message, cursor.path) for message, cursor in router.messages]
+
+
+def test_rotation(tmpdir):
+    path = str(tmpdir.join('app.log'))
+    rotated_path = str(tmpdir.join('app.log.1'))
+    open(path, 'w').close()
+    router = StubRouter()
+    handler = _handler(router)
+    handler.init(str(tmpdir))
+
+    # The writer keeps writing to the rotated file until it reopens
+    writer = open(path, 'a', buffering=1)
+    writer.write('1:ERROR:before\n')
+    os.rename(path, rotated_path)
+    writer.write('2:ERROR:rotated\n')
+    handler.dispatch(FileMovedEvent(path, rotated_path))
+    writer.write('3:ERROR:late\n')
+    writer.close()
+
+    with open(path, 'w') as writer:
+        writer.write('4:ERROR:new\n')
+    handler.dispatch(FileCreatedEvent(path))
+    handler.dispatch(FileModifiedEvent(path))
+
+    assert _messages(router) == [('1:ERROR:before', rotated_path),
+                                 ('2:ERROR:rotated', rotated_path),
+                                 ('3:ERROR:late', rotated_path),
+                                 ('4:ERROR:new', path)]
+    assert set(handler._cache) == {path}
+    # Not kept for the rotated file no longer watched
+    assert set(handler._file_locks) == {path}
+
+
+def test_rotation_seen_as_replacement(tmpdir):
+    path = str(tmpdir.join('app.log'))
+    rotated_path = str(tmpdir.join('app.log.1'))
+    open(path, 'w').close()
+    router = StubRouter()
+    handler = _handler(router)
+    handler.init(str(tmpdir))
+
+    with open(path, 'a') as writer:
+        writer.write('1:INFO:opened\n')
+        handler.dispatch(FileModifiedEvent(path))
+        writer.write('2:ERROR:before\n')
+    os.rename(path, rotated_path)
+    with open(path, 'w') as writer:
+        writer.write('3:ERROR:new\n')
+
+    # The new file is modified before the move is handled
+    handler.dispatch(FileModifiedEvent(path))
+    handler.dispatch(FileMovedEvent(path, rotated_path))
+    handler.dispatch(FileCreatedEvent(path))
+    handler.dispatch(FileModifiedEvent(path))
+
+    assert _messages(router) == [('2:ERROR:before', path),
+                                 ('3:ERROR:new', path)]
+
+
+def test_truncation(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('1:INFO:old\n2:INFO:old\n')
+    router = StubRouter()
+    handler = _handler(router)
+    handler.init(str(tmpdir))
+
+    log.write('3:ERROR:new\n')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    assert _messages(router) == [('3:ERROR:new', str(log))]
+    assert router.messages[0][1].line == 1
+
+
+def test_debounce(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('')
+    router = StubRouter()
+    handler = _handler(router, debounce=60, debounce_bytes=100)
+    handler.init(str(tmpdir))
+
+    for i in range(3):
+        log.write('{}:ERROR:x\n'.format(i), mode='a')
+        handler.dispatch(FileModifiedEvent(str(log)))
+    assert router.messages == []
+
+    log.write('3:ERROR:{}\n'.format('x' * 100), mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    assert len(router.messages) == 4
+
+    log.write('4:ERROR:x\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    assert len(router.messages) == 4
+    handler.close()
+    assert len(router.messages) == 5
+
+
+def test_workers(tmpdir):
+    paths = [str(tmpdir.join('{}.log'.format(i))) for i in range(8)]
+    for path in paths:
+        open(path, 'w').close()
+    router = StubRouter()
+    handler = _handler(router, workers=4)
+    handler.init(str(tmpdir))
+
+    for i in range(20):
+        for path in paths:
+            with open(path, 'a') as f:
+                f.write('{}:ERROR:x\n'.format(i))
+            handler.dispatch(FileModifiedEvent(path))
+    handler.close()
+
+    for path in paths:
+        messages = [m for m, cursor in router.messages if cursor.path == path]
+        assert messages == ['{}:ERROR:x'.format(i) for i in range(20)]
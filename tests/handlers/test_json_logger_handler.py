@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from watchdog.events import FileModifiedEvent
+
+from kikori.handlers.json_logger_handler import JSONLoggerHandler
+
+from .test_handler import StubRouter
+
+
+def _handler(*patterns):
+    return JSONLoggerHandler(r'.*\.log$',
+                             '',
+                             [{'pattern': pattern, 'routers': []}
+                              for pattern in patterns],
+                             {})
+
+
+def test_candidate_triggers():
+    handler = _handler({'level': '^ERROR$'},
+                       {'http': {'status': '^5'}})
+    error, http = handler.triggers
+    assert handler._candidate_triggers(
+        b'{"level": "ERROR", "msg": "failed"}') == [error]
+    assert handler._candidate_triggers(
+        b'{"level": "INFO", "http": {"status": "503"}}') == [http]
+    assert handler._candidate_triggers(
+        b'{"level": "INFO", "msg": "ok"}') == []
+
+
+def test_get_matchable_object():
+    handler = _handler({'level': '^ERROR$'})
+    assert handler._get_matchable_object(b'{"level": "ERROR"}') == {
+        'level': 'ERROR'}
+    assert handler._get_matchable_object(b'{"level": ') is None
+
+
+def test_render_object_reuses_line():
+    handler = _handler({'level': '^ERROR$'})
+    text = b'{"level":"ERROR",  "msg":"\\u00e9"}'
+    obj = handler._get_matchable_object(text)
+    assert handler._render_object(obj, text) == text.decode()
+
+
+def test_process_file(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('')
+    router = StubRouter()
+    handler = JSONLoggerHandler(
+        r'.*\.log$', '',
+        [{'pattern': {'level': '^(?P<level>ERROR|CRITICAL)$'},
+          'routers': [{'name': 'stub'}]}],
+        {'stub': router})
+    handler.init(str(tmpdir))
+
+    log.write('{"level": "INFO"}\nnot json\n'
+              '{"level": "ERROR", "msg": "a"}\n'
+              '{"level": "CRITICAL", "msg": "b"}\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    assert [(message, cursor.line) for message, cursor in router.messages] == [
+        ('{"level": "ERROR", "msg": "a"}', 3),
+        ('{"level": "CRITICAL", "msg": "b"}', 4)]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import re
+
+import pytest
+
+from kikori.handlers.trigger_index import TriggerIndex
+
+
+PATTERNS = [r'^\d+:ERROR:.*', r'^\d+:ERR', r'.*', r'^\d+:WARNING:.*db']
+
+
+@pytest.mark.parametrize('encode', [False, True])
+@pytest.mark.parametrize('n_dummies', [0, 20])
+@pytest.mark.parametrize('text, expected', [
+    ('1:ERROR:db', [0, 1, 2]),
+    ('1:ERR', [1, 2]),
+    ('1:WARNING:db', [2, 3]),
+    ('1:INFO:db', [2]),
+])
+def test_candidates(n_dummies, encode, text, expected):
+    # Dummy patterns switch the index to a regex scan
+    patterns = PATTERNS + ['dummy{}'.format(i) for i in range(n_dummies)]
+    index = TriggerIndex([re.compile(p) for p in patterns])
+    if encode:
+        text = text.encode('utf-8')
+    assert index.candidates(text) == expected
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import time
+from types import SimpleNamespace
+
+from kikori.routers.coalescer import Coalescer
+from kikori.routers.router import Router
+
+
+class StubRouter(Router):
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def payload(self, message, cursor, groupdict, summary=None, **kwargs):
+        return {'message': message,
+                'count': summary['COUNT'] if summary else 1,
+                'kwargs': kwargs}
+
+    def send(self, payload):
+        self.sent.append(payload)
+
+
+def _cursor(line):
+    return SimpleNamespace(path='/log', pos=0, line=line)
+
+
+def test_coalesce_by_count():
+    router = StubRouter()
+    router.coalescer = Coalescer(router, window=60, max_count=3)
+    for i in range(7):
+        router.emit('m{}'.format(i), _cursor(i), {}, title='t')
+    assert [p['count'] for p in router.sent] == [3, 3]
+    assert [p['message'] for p in router.sent] == ['m0', 'm3']
+    router.close()
+    assert [p['count'] for p in router.sent] == [3, 3, 1]
+    assert router.sent[-1]['kwargs'] == {'title': 't'}
+
+
+def test_coalesce_by_group_and_args():
+    router = StubRouter()
+    router.coalescer = Coalescer(router, window=60, group_by='level')
+    router.emit('a', _cursor(1), {'level': 'ERROR'}, title='t')
+    router.emit('b', _cursor(2), {'level': 'WARNING'}, title='t')
+    router.emit('c', _cursor(3), {'level': 'ERROR'}, title='t')
+    router.emit('d', _cursor(4), {'level': 'ERROR'}, title='u')
+    router.close()
+    assert sorted((p['message'], p['count']) for p in router.sent) == [
+        ('a', 2), ('b', 1), ('d', 1)]
+
+
+def test_coalesce_by_window():
+    router = StubRouter()
+    router.coalescer = Coalescer(router, window=0.01)
+    router.emit('a', _cursor(1), {})
+    router.emit('b', _cursor(2), {})
+    for _ in range(100):
+        if router.sent:
+            break
+        time.sleep(0.01)
+    assert router.sent == [{'message': 'a', 'count': 2, 'kwargs': {}}]
+    router.close()
+
+
+def test_coalesce_by_priority():
+    router = StubRouter()
+    delivered = []
+    router.deliver = lambda payload, priority=0: delivered.append(
+        (payload['message'], payload['count'], priority))
+    router.coalescer = Coalescer(router, window=60, max_count=3)
+    router.emit('a', _cursor(1), {}, priority=0)
+    router.emit('b', _cursor(2), {}, priority=1)
+    router.emit('c', _cursor(3), {}, priority=0)
+    router.close()
+    assert sorted(delivered) == [('a', 2, 0), ('b', 1, 1)]
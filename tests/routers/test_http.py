@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from types import SimpleNamespace
+
+import pytest
+
+from kikori.routers import http
+from kikori.routers.http import get_session
+from kikori.routers.http import HTTPClient
+
+
+class StubSession:
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.posted = []
+
+    def post(self, url, **kwargs):
+        self.posted.append(kwargs['json'])
+        return self.responses.pop(0)
+
+
+def _response(status_code, headers=None):
+    return SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(http.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_session_shared_per_url():
+    assert get_session('http://a/') is get_session('http://a/')
+    assert get_session('http://a/') is not get_session('http://b/')
+
+
+def test_retry_honors_retry_after(sleeps):
+    client = HTTPClient('http://test/', backoff=1.)
+    client.session = StubSession(_response(429, {'Retry-After': '7'}),
+                                 _response(503),
+                                 _response(200))
+    assert client.post({}).status_code == 200
+    assert sleeps == [7., 2.]
+
+
+def test_retry_gives_up(sleeps):
+    client = HTTPClient('http://test/', retries=1)
+    client.session = StubSession(_response(500), _response(502))
+    assert client.post({}).status_code == 502
+    assert len(sleeps) == 1
+
+
+def test_no_retry_on_client_error(sleeps):
+    client = HTTPClient('http://test/')
+    client.session = StubSession(_response(400))
+    assert client.post({}).status_code == 400
+    assert sleeps == []
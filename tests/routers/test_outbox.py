@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from kikori import metrics
+from kikori.routers.outbox import Outbox
+from kikori.routers.router import Router
+
+
+class _Sender:
+
+    def __init__(self, ok=True):
+        self.ok = threading.Event()
+        if ok:
+            self.ok.set()
+        self.sent = []
+        self.done = threading.Condition()
+
+    def __call__(self, payload):
+        if not self.ok.is_set():
+            return False
+        with self.done:
+            self.sent.append(payload)
+            self.done.notify_all()
+        return True
+
+    def wait(self, n, timeout=5):
+        with self.done:
+            return self.done.wait_for(lambda: len(self.sent) >= n, timeout)
+
+
+def test_resends_in_order_after_failures(tmpdir):
+    sender = _Sender(ok=False)
+    outbox = Outbox(sender, str(tmpdir), backoff=0.01, max_backoff=0.01)
+    for i in range(10):
+        outbox.put({'i': i})
+    assert len(outbox) == 10
+    sender.ok.set()
+    assert sender.wait(10)
+    outbox.close()
+    assert [p['i'] for p in sender.sent] == list(range(10))
+    assert len(outbox) == 0
+    assert not [f for f in os.listdir(str(tmpdir)) if f.endswith('.seg')]
+
+
+def test_pending_survive_restart(tmpdir):
+    sender = _Sender(ok=False)
+    outbox = Outbox(sender, str(tmpdir), segment_bytes=20, backoff=10)
+    for i in range(5):
+        outbox.put({'i': i})
+    outbox.close()
+
+    sender = _Sender()
+    outbox = Outbox(sender, str(tmpdir))
+    assert sender.wait(5)
+    outbox.close()
+    assert [p['i'] for p in sender.sent] == list(range(5))
+
+
+def test_drops_oldest_segments_over_max_bytes(tmpdir):
+    sender = _Sender(ok=False)
+    # Each payload is 9 bytes, so segments hold two
+    outbox = Outbox(sender, str(tmpdir), segment_bytes=18, max_bytes=40,
+                    backoff=10)
+    for i in range(10):
+        outbox.put({'i': i})
+    assert outbox.dropped == 6
+    assert len(outbox) == 4
+    outbox.close()
+
+    sender = _Sender()
+    outbox = Outbox(sender, str(tmpdir))
+    assert sender.wait(4)
+    outbox.close()
+    assert [p['i'] for p in sender.sent] == [6, 7, 8, 9]
+
+
+def test_skips_corrupt_lines(tmpdir):
+    with open(str(tmpdir.join('{:020d}.seg'.format(0))), 'wb') as f:
+        f.write(b'{"i": 0}\n{"i": \n{"i": 2}\n')
+    sender = _Sender()
+    outbox = Outbox(sender, str(tmpdir))
+    assert sender.wait(2)
+    outbox.close()
+    assert sender.sent == [{'i': 0}, {'i': 2}]
+
+
+class _FlakyRouter(Router):
+
+    def __init__(self):
+        super().__init__()
+        self.name = 'flaky'
+        self.up = False
+        self.sent = []
+
+    def send(self, payload):
+        if not self.up:
+            raise ConnectionError('down')
+        self.sent.append(payload)
+
+
+def test_transmit_keeps_order_behind_pending(tmpdir):
+    router = _FlakyRouter()
+    router.outbox = Outbox(router.resend, str(tmpdir), backoff=10)
+    router.transmit(0)
+    with router.outbox._cond:
+        # Sent while the outbox is not retrying yet
+        router.up = True
+        router.transmit(1)
+    assert router.sent in ([], [0])
+    router.close()
+
+    sent = router.sent
+    router = _FlakyRouter()
+    router.up = True
+    router.outbox = Outbox(router.resend, str(tmpdir))
+    for _ in range(500):
+        if not len(router.outbox):
+            break
+        time.sleep(0.01)
+    router.close()
+    assert sent + router.sent == [0, 1]
+
+
+def test_put_after_torn_line(tmpdir):
+    # Left by a crash in the middle of a write
+    with open(str(tmpdir.join('{:020d}.seg'.format(0))), 'wb') as f:
+        f.write(b'{"i": 0}\n{"i": ')
+    sender = _Sender()
+    outbox = Outbox(sender, str(tmpdir))
+    assert sender.wait(1)
+    outbox.put({'i': 1})
+    assert sender.wait(2)
+    outbox.close()
+    assert sender.sent == [{'i': 0}, {'i': 1}]
+
+
+def test_survives_only_corrupt_lines(tmpdir):
+    with open(str(tmpdir.join('{:020d}.seg'.format(0))), 'wb') as f:
+        f.write(b'{"i": \n')
+    sender = _Sender()
+    outbox = Outbox(sender, str(tmpdir))
+    outbox.put({'i': 1})
+    assert sender.wait(1)
+    outbox.close()
+    assert sender.sent == [{'i': 1}]
+
+
+class _RejectingRouter(Router):
+
+    def __init__(self, status_code):
+        super().__init__()
+        self.name = 'rejecting'
+        self.status_code = status_code
+
+    def send(self, payload):
+        return SimpleNamespace(ok=False, status_code=self.status_code)
+
+
+def test_resend_drops_rejected_payloads(monkeypatch):
+    monkeypatch.setattr(metrics.registry, 'enabled', True)
+    rejected = metrics.registry.totals().get(
+        'kikori_payloads_rejected_total', 0)
+    for status_code in (429, 500, 503):
+        assert not _RejectingRouter(status_code).resend({})
+    for status_code in (400, 404, 410):
+        assert _RejectingRouter(status_code).resend({})
+    assert metrics.registry.totals()[
+        'kikori_payloads_rejected_total'] == rejected + 3
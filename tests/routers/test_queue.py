@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+
+import pytest
+
+from kikori.routers.queue import DeliveryQueue
+
+
+def test_sends_all_payloads():
+    sent = []
+    q = DeliveryQueue(sent.append, size=10, workers=2, overflow='block')
+    for i in range(100):
+        q.put({'i': i})
+    q.close()
+    assert sorted(p['i'] for p in sent) == list(range(100))
+
+
+def _blocked_queue(**kwargs):
+    release = threading.Event()
+    sent = []
+
+    def send(payload):
+        release.wait()
+        sent.append(payload)
+
+    q = DeliveryQueue(send, size=2, workers=1, **kwargs)
+    return q, release, sent
+
+
+def test_drop_oldest():
+    q, release, sent = _blocked_queue(overflow='drop_oldest')
+    q.put(0)
+    assert q.flush(0.1) is False
+    for i in range(1, 5):
+        q.put(i)
+    release.set()
+    q.close()
+    assert sent == [0, 3, 4]
+    assert q.dropped == 2
+
+
+def test_spill(tmpdir):
+    spill_path = str(tmpdir.join('spill'))
+    q, release, sent = _blocked_queue(overflow='spill', spill_path=spill_path)
+    for i in range(10):
+        q.put(i)
+    release.set()
+    q.close()
+    assert sent == list(range(10))
+    assert not tmpdir.join('spill').exists()
+
+
+def test_spill_requires_path():
+    with pytest.raises(ValueError):
+        DeliveryQueue(print, overflow='spill')
+
+
+def test_higher_priority_sent_first():
+    q, release, sent = _blocked_queue(overflow='block')
+    q.put('first')
+    # Wait for the worker to block on the first payload
+    assert q.flush(0.1) is False
+    q.put('warning', priority=0)
+    q.put('error', priority=1)
+    release.set()
+    q.close()
+    assert sent == ['first', 'error', 'warning']
+
+
+def test_drop_oldest_sheds_lowest_priority():
+    q, release, sent = _blocked_queue(overflow='drop_oldest')
+    q.put('first')
+    assert q.flush(0.1) is False
+    q.put('error', priority=1)
+    q.put('warning', priority=0)
+    # Sheds the warning, then the new warning itself
+    q.put('critical', priority=2)
+    q.put('warning', priority=0)
+    release.set()
+    q.close()
+    assert sent == ['first', 'critical', 'error']
+    assert q.dropped == 2
+    assert q.dropped_by_priority == {0: 2}
+
+
+def test_spill_keeps_priority(tmpdir):
+    spill_path = str(tmpdir.join('spill'))
+    q, release, sent = _blocked_queue(overflow='spill', spill_path=spill_path)
+    q.put(0)
+    assert q.flush(0.1) is False
+    for i in range(1, 4):
+        q.put(i)
+    # Spilled after 3
+    q.put(4, priority=1)
+    release.set()
+    q.close()
+    assert sent == [0, 1, 2, 4, 3]
+    assert not tmpdir.join('spill').exists()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from kikori.handlers.handler import Cursor
+from kikori.routers.slack import Slack
+
+
+class CountingCursor(Cursor):
+
+    __slots__ = ('counted',)
+
+    @property
+    def line(self):
+        self.counted = True
+        return self._line
+
+
+def test_payload():
+    slack = Slack('http://127.0.0.1:1/', channel='#ops',
+                  footer='{LOGFILE}')
+    cursor = CountingCursor('/var/log/app.log', 100, 10)
+    cursor.counted = False
+    payload = slack.payload('1:ERROR:a', cursor, {'level': 'ERROR'},
+                            title='{level} logged!', color='#ff0000')
+    assert payload['channel'] == '#ops'
+    [attachment] = payload['attachments']
+    assert attachment['title'] == 'ERROR logged!'
+    assert attachment['color'] == '#ff0000'
+    assert attachment['footer'] == '/var/log/app.log'
+    # Not referred to
+    assert not cursor.counted
+
+    payload = slack.payload('1:ERROR:a', cursor, {'level': 'ERROR'},
+                            summary={'COUNT': 2, 'FIRST_TIME': 't0',
+                                     'LAST_TIME': 't1', 'FIRST_LINENO': 10,
+                                     'LAST_LINENO': 12})
+    assert payload['attachments'][0]['pretext'].startswith('2 occurrences')
+
+
+def test_payload_shared():
+    slacks = [Slack('http://127.0.0.1:{}/'.format(i)) for i in (1, 2)]
+    cursor = Cursor('/var/log/app.log', 100, 10)
+    groupdict = {}
+    first, second = [slack.payload('1:ERROR:a', cursor, groupdict,
+                                   title='Error!')
+                     for slack in slacks]
+    assert first is second
+    assert slacks[0].payload('1:ERROR:a', cursor, groupdict) is not first
+    assert slacks[0].payload('1:ERROR:a', Cursor('/var/log/app.log', 200, 11),
+                             groupdict, title='Error!') is not first
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+
+from watchdog.events import FileModifiedEvent
+
+from kikori.checkpoint import CheckpointStore
+from kikori.handlers.text_logger_handler import TextLoggerHandler
+from kikori.routers.router import Router
+
+
+class StubRouter(Router):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, message, cursor, groupdict, **kwargs):
+        self.messages.append((message, cursor.line))
+
+
+def _handler(router, checkpoints):
+    return TextLoggerHandler(r'.*\.log$',
+                             r'^\d+:',
+                             [{'pattern': r'^\d+:ERROR:.*',
+                               'routers': [{'name': 'stub'}]}],
+                             {'stub': router},
+                             checkpoints=checkpoints)
+
+
+def test_resume_from_checkpoint(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('1:ERROR:before start\n')
+    path = str(tmpdir.join('checkpoint.json'))
+
+    checkpoints = CheckpointStore(path)
+    router = StubRouter()
+    _handler(router, checkpoints).init(str(tmpdir))
+    checkpoints.close()
+    assert router.messages == []
+
+    log.write('2:ERROR:while down\n3:INFO:while down\n', mode='a')
+
+    checkpoints = CheckpointStore(path)
+    _handler(router, checkpoints).init(str(tmpdir))
+    assert router.messages == [('2:ERROR:while down', 2)]
+
+
+def test_replaced_file_is_not_resumed(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('1:ERROR:before start\n')
+    path = str(tmpdir.join('checkpoint.json'))
+
+    checkpoints = CheckpointStore(path)
+    _handler(StubRouter(), checkpoints).init(str(tmpdir))
+    checkpoints.close()
+
+    log.remove()
+    tmpdir.join('other').write('1:ERROR:other\n')
+    tmpdir.join('other').move(log)
+
+    checkpoints = CheckpointStore(path)
+    assert checkpoints.get(str(log), os.stat(str(log))) is None
+
+
+def test_lazy_init_checkpointed(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('1:ERROR:before start\n')
+    path = str(tmpdir.join('checkpoint.json'))
+
+    checkpoints = CheckpointStore(path)
+    router = StubRouter()
+    _handler(router, checkpoints).init(str(tmpdir), lazy=True)
+    checkpoints.close()
+    log.write('2:ERROR:while down\n', mode='a')
+
+    # Carried over while not initialized
+    checkpoints = CheckpointStore(path)
+    handler = _handler(router, checkpoints)
+    handler.init(str(tmpdir), lazy=True)
+    checkpoints.save()
+    log.write('3:ERROR:after restart\n', mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+    assert router.messages == [('2:ERROR:while down', 2),
+                               ('3:ERROR:after restart', 3)]
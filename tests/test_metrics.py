@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import requests
+
+from kikori.metrics import MetricsServer
+from kikori.metrics import registry
+from kikori.metrics import Registry
+from kikori.metrics import summarize
+
+
+def test_render():
+    r = Registry()
+    r.inc('kikori_lines_read_total', 3, path='/a.log')
+    r.inc('kikori_lines_read_total', 2, path='/a.log')
+    r.inc('kikori_lines_read_total', path='/b "c".log')
+    r.observe('kikori_delivery_seconds', .02, router='ops')
+    r.observe('kikori_delivery_seconds', 120., router='ops')
+    r.register(lambda: [('kikori_queue_depth', {'router': 'ops'}, 4)])
+
+    lines = r.render().splitlines()
+    assert lines[:7] == [
+        '# HELP kikori_delivery_seconds '
+        'Time taken to deliver payloads by routers.',
+        '# TYPE kikori_delivery_seconds histogram',
+        'kikori_delivery_seconds_bucket{router="ops",le="0.005"} 0.0',
+        'kikori_delivery_seconds_bucket{router="ops",le="0.01"} 0.0',
+        'kikori_delivery_seconds_bucket{router="ops",le="0.025"} 1.0',
+        'kikori_delivery_seconds_bucket{router="ops",le="0.05"} 1.0',
+        'kikori_delivery_seconds_bucket{router="ops",le="0.1"} 1.0',
+    ]
+    assert 'kikori_delivery_seconds_bucket{router="ops",le="60.0"} 1.0' \
+        in lines
+    assert 'kikori_delivery_seconds_bucket{router="ops",le="+Inf"} 2.0' \
+        in lines
+    assert 'kikori_delivery_seconds_count{router="ops"} 2.0' in lines
+    assert 'kikori_lines_read_total{path="/a.log"} 5.0' in lines
+    assert 'kikori_lines_read_total{path="/b \\"c\\".log"} 1.0' in lines
+    assert '# TYPE kikori_queue_depth gauge' in lines
+    assert 'kikori_queue_depth{router="ops"} 4.0' in lines
+
+    totals = r.totals()
+    assert totals['kikori_lines_read_total'] == 6
+    assert totals['kikori_delivery_seconds'] == (2, 120.02)
+
+
+def test_disabled():
+    r = Registry(enabled=False)
+    r.inc('kikori_lines_read_total', 3)
+    r.add({('kikori_messages_total', ()): 1})
+    r.observe('kikori_delivery_seconds', .02)
+    assert r.totals() == {}
+
+
+def test_summarize():
+    last = {'kikori_lines_read_total': 10,
+            'kikori_delivery_seconds': (1, 1.)}
+    totals = {'kikori_lines_read_total': 30,
+              'kikori_delivery_seconds': (3, 2.),
+              'kikori_file_lag_bytes': 512}
+    assert summarize(last, totals, 10.) == (
+        'Read 20 lines (2.0 lines/s, 0 bytes), built 0 messages, '
+        'matched 0, delivered 2 (avg 0.500s, 0 failed); 0 queued, '
+        '0 shed, 512 bytes behind')
+
+
+def test_server(monkeypatch):
+    monkeypatch.setattr(registry, 'enabled', True)
+    registry.inc('kikori_messages_total', path='/test_server.log')
+    server = MetricsServer(port=0, interval=0)
+    server.start()
+    try:
+        url = 'http://127.0.0.1:{}'.format(server._server.server_address[1])
+        response = requests.get(url + '/metrics')
+        assert response.status_code == 200
+        assert ('kikori_messages_total{path="/test_server.log"} 1.0'
+                in response.text.splitlines())
+        assert requests.get(url + '/').status_code == 404
+    finally:
+        server.close()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import time
+
+import pytest
+from watchdog.events import FileSystemEventHandler
+
+from kikori.observers import Observer
+
+
+class RecordingHandler(FileSystemEventHandler):
+
+    def __init__(self):
+        self.events = []
+
+    def accepts(self, event):
+        return event.src_path.endswith('.log')
+
+    def dispatch(self, event):
+        # Not filtered here, so that only events the observer queues
+        # are recorded
+        self.events.append(event)
+
+
+@pytest.mark.parametrize('backend', ['auto', 'polling'])
+def test_queues_accepted_events_only(tmpdir, backend):
+    observer = Observer(backend, interval=0.05)
+    handler = RecordingHandler()
+    observer.schedule(handler, str(tmpdir))
+    observer.start()
+    try:
+        time.sleep(0.2)
+        tmpdir.join('app.txt').write('a\n')
+        tmpdir.join('app.log').write('a\n')
+        for _ in range(100):
+            if handler.events:
+                break
+            time.sleep(0.02)
+        time.sleep(0.2)
+    finally:
+        observer.stop()
+        observer.join()
+    assert handler.events
+    paths = {e.src_path for e in handler.events}
+    assert paths == {str(tmpdir.join('app.log'))}
+    assert {e.event_type for e in handler.events} <= {'created', 'modified'}
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        Observer('carrier_pigeon')
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import gzip
+import io
+import json
+
+from kikori import config
+from kikori.cli.kikori import _replay
+from kikori.handlers.text_logger_handler import TextLoggerHandler
+from kikori.replay import find_watch
+from kikori.replay import replay_file
+from kikori.replay import ReplayRouter
+from kikori.routers.slack import Slack
+
+from .handlers.test_handler import StubRouter
+
+
+def _handler(router):
+    return TextLoggerHandler(r'.*\.log$',
+                             r'^\d+:',
+                             [{'pattern': r'^\d+:ERROR:.*',
+                               'routers': [{'name': 'stub',
+                                            'args': {'title': 'x'}}]}],
+                             {'stub': router})
+
+
+def test_replay_file(tmpdir):
+    path = str(tmpdir.join('app.log.1.gz'))
+    with gzip.open(path, 'wb') as f:
+        f.write(b'1:ERROR:a\n  more\n2:INFO:b\n3:ERROR:c')
+    router = StubRouter()
+    assert replay_file(_handler(router), path) == 4
+    assert [(message, cursor.line) for message, cursor in router.messages] \
+        == [('1:ERROR:a\n  more', 1), ('3:ERROR:c', 4)]
+
+
+def test_replay_router_output(tmpdir):
+    out = io.StringIO()
+    slack = Slack('http://localhost/', channel='#ops')
+    router = ReplayRouter('ops', slack, out)
+    handler = _handler(router)
+    handler.replay(io.BytesIO(b'1:ERROR:a\n'), '/var/log/app.log')
+    [line] = out.getvalue().splitlines()
+    record = json.loads(line)
+    assert (record['router'], record['path'], record['line']) == (
+        'ops', '/var/log/app.log', 1)
+    assert record['payload']['attachments'][0]['title'] == 'x'
+
+
+def test_find_watch():
+    confs = [{'dir': '/var/log/a'}, {'dir': '/var/log/b/'}]
+    assert find_watch('/var/log/b/app.log.1.gz', confs) == 1
+    assert find_watch('/var/log/ab/app.log', confs) is None
+
+
+def test_replay_output_sends_nothing(tmpdir, monkeypatch):
+    outbox = tmpdir.join('outbox')
+    segment = outbox.join('{:020d}.seg'.format(0))
+    segment.write('{"text": "pending"}\n', ensure=True)
+    log = tmpdir.join('app.log')
+    log.write('1:ERROR:a\n')
+    monkeypatch.setattr(config, 'conf', {
+        'routers': {'ops': {'type': 'slack',
+                            'webhook_url': 'http://localhost/',
+                            'rate_limit': {'rate': 0.001},
+                            'outbox': {'path': str(outbox)}}},
+        'watch': [{'dir': str(tmpdir),
+                   'filename': r'.*\.log$',
+                   'text_pattern': r'^\d+:',
+                   'triggers': [{'pattern': r'^\d+:ERROR:.*',
+                                 'routers': [{'name': 'ops'}]}]}]})
+    sent = []
+    monkeypatch.setattr(Slack, 'send', lambda self, payload: sent.append(
+        payload))
+    output = tmpdir.join('out.jsonl')
+    _replay([str(log)], output=str(output))
+    assert len(output.readlines()) == 1
+    assert sent == []
+    assert segment.check()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import multiprocessing
+import pickle
+import queue
+
+from kikori import config
+from kikori.cli.kikori import _create_handler
+from kikori.cli.kikori import _watch_confs
+from kikori.handlers.handler import Cursor
+from kikori.shards import Relay
+from kikori.shards import RemoteRouter
+from kikori.shards import run_shards
+from kikori.utils import LineIndex
+
+from .handlers.test_handler import StubRouter
+
+
+def test_remote_router(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('1:INFO:a\n2:ERROR:b\n')
+    channel = queue.Queue()
+    router = RemoteRouter('ops', channel)
+    cursor = Cursor(str(log), 9, dev=1, ino=2, index=LineIndex(str(log)))
+    router.emit('2:ERROR:b', cursor, {'level': 'ERROR'}, title='x')
+
+    # As put through a multiprocessing queue
+    item = pickle.loads(pickle.dumps(channel.get_nowait()))
+    name, message, cursor, groupdict, kwargs = item
+    assert (name, message, groupdict, kwargs) == (
+        'ops', '2:ERROR:b', {'level': 'ERROR'}, {'title': 'x'})
+    assert (cursor.path, cursor.pos, cursor.line) == (str(log), 9, 1)
+    assert (cursor.dev, cursor.ino, cursor.index) == (1, 2, None)
+
+
+def test_relay():
+    channel = queue.Queue()
+    router = StubRouter()
+    relay = Relay(channel, {'ops': router})
+    cursor = Cursor('/var/log/app.log', 9, 1)
+    channel.put(('removed', '1:ERROR:a', cursor, {}, {}))
+    channel.put(('ops', '2:ERROR:b', cursor, {}, {}))
+    relay.close()
+    assert router.messages == [('2:ERROR:b', cursor)]
+
+
+def test_watch_confs_by_dir(monkeypatch):
+    confs = [{'dir': '/var/log/{}'.format(i)} for i in range(5)]
+    monkeypatch.setattr(config, 'conf', {'watch': confs})
+    assert _watch_confs() == confs
+    assert _watch_confs((0, 2, 'dir')) == confs[0::2]
+    assert _watch_confs((1, 2, 'dir')) == confs[1::2]
+    assert _watch_confs((1, 2, 'file')) == confs
+
+
+def test_handlers_by_file():
+    conf = {'dir': '/var/log', 'filename': r'.*\.log$',
+            'text_pattern': r'^\d+:', 'triggers': []}
+    handlers = [_create_handler(conf, {}, shard=(i, 3, 'file'))
+                for i in range(3)]
+    paths = ['/var/log/{}.log'.format(i) for i in range(30)]
+    shards = [[p for p in paths if h._is_valid_filename(p)]
+              for h in handlers]
+    assert sorted(sum(shards, [])) == sorted(paths)
+    assert all(shards)
+    # By base name, so that a file stays in its shard when rotated
+    assert handlers[0]._is_valid_filename('/var/log/a/0.log') == \
+        handlers[0]._is_valid_filename('/var/log/b/0.log')
+
+
+def _shard(index, channel, path, barrier):
+    RemoteRouter('ops', channel).emit(
+        '{}:ERROR:x'.format(index), Cursor(path, index, index), {})
+    # Not to be terminated before the other emits
+    barrier.wait()
+
+
+def test_run_shards(tmpdir):
+    router = StubRouter()
+    barrier = multiprocessing.get_context('spawn').Barrier(2)
+    # Returns once a shard has exited
+    run_shards({'ops': router}, 2, _shard, str(tmpdir.join('app.log')),
+               barrier)
+    assert sorted((message, cursor.line)
+                  for message, cursor in router.messages) == [
+        ('0:ERROR:x', 0), ('1:ERROR:x', 1)]
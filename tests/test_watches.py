@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import re
+
+import pytest
+
+from watchdog.events import FileModifiedEvent
+
+from kikori.handlers.text_logger_handler import TextLoggerHandler
+from kikori.observers import Observer
+from kikori.watches import Watches
+
+from .handlers.test_handler import StubRouter
+
+
+def _conf(dir, pattern=r'^\d+:ERROR:.*', **kwargs):
+    conf = {'dir': dir,
+            'filename': r'.*\.log$',
+            'triggers': [{'pattern': pattern,
+                          'routers': [{'name': 'stub'}]}]}
+    conf.update(kwargs)
+    return conf
+
+
+def _watches(router, created):
+    def create_handler(conf):
+        handler = TextLoggerHandler(conf['filename'], r'^\d+:',
+                                    conf['triggers'], {'stub': router},
+                                    debounce=conf.get('debounce', 0.))
+        created.append(handler)
+        return handler
+
+    return Watches(Observer(), create_handler)
+
+
+def _write(log, handler, text):
+    log.write(text, mode='a')
+    handler.dispatch(FileModifiedEvent(str(log)))
+
+
+def test_update_triggers(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('1:ERROR:a\n')
+    router, created = StubRouter(), []
+    watches = _watches(router, created)
+    watches.update([_conf(str(tmpdir))])
+    [handler] = created
+    trigger = handler.triggers[0]
+
+    watches.update([_conf(str(tmpdir), r'^\d+:WARNING:.*')])
+    assert created == [handler]
+    _write(log, handler, '2:ERROR:b\n3:WARNING:c\n')
+    assert [m for m, _ in router.messages] == ['3:WARNING:c']
+
+    watches.update([_conf(str(tmpdir))])
+    assert handler.triggers[0] is not trigger
+    assert handler.set_triggers([_conf('')['triggers'][0]]) == 0
+
+
+def test_update_block(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('1:ERROR:a\n')
+    router, created = StubRouter(), []
+    watches = _watches(router, created)
+    watches.update([_conf(str(tmpdir))])
+    _write(log, created[0], '2:INFO:b\n')
+
+    # The file is read on from where the replaced handler stopped
+    watches.update([_conf(str(tmpdir), debounce=0.)])
+    old, new = created
+    assert str(log) in new._cache and str(log) not in old._cache
+    assert len(watches.observer.emitters) == 1
+    _write(log, new, '3:ERROR:c\n')
+    [(message, cursor)] = router.messages
+    assert (message, cursor.line) == ('3:ERROR:c', 3)
+
+    watches.update([])
+    assert not watches.observer.emitters
+
+
+def test_depth(tmpdir):
+    for path in ['app.log', 'a/app.log', 'a/b/app.log', 'c/app.log']:
+        tmpdir.join(path).write('1:INFO:a\n', ensure=True)
+    router, created = StubRouter(), []
+    watches = _watches(router, created)
+    watches.update([_conf(str(tmpdir), depth=1)])
+    [handler] = created
+    assert sorted(os.path.relpath(p, str(tmpdir)) for p in handler._cache) == [
+        'a/app.log', 'app.log', 'c/app.log']
+    assert len(watches.observer.emitters) == 3
+
+    # Shared with another block watching the directory only
+    watches.update([_conf(str(tmpdir), depth=1),
+                    _conf(str(tmpdir), depth=0, debounce=0.)])
+    assert len(watches.observer.emitters) == 3
+    watches.update([_conf(str(tmpdir), depth=0, debounce=0.)])
+    assert len(watches.observer.emitters) == 1
+    watches.update([])
+    assert not watches.observer.emitters
+
+
+def test_update_invalid(tmpdir):
+    tmpdir.join('a').ensure(dir=True)
+    router, created = StubRouter(), []
+    watches = _watches(router, created)
+    watches.update([_conf(str(tmpdir))])
+    [handler] = created
+    triggers = handler.triggers
+
+    with pytest.raises(re.error):
+        watches.update([_conf(str(tmpdir), r'^\d+:WARNING:.*'),
+                        _conf(str(tmpdir.join('a')), '(')])
+    # Left as they are
+    assert handler.triggers is triggers
+    assert len(watches.observer.emitters) == 1
+    watches.update([])
+
+
+def test_depth_rewalked(tmpdir):
+    router, created = StubRouter(), []
+    watches = _watches(router, created)
+    watches.update([_conf(str(tmpdir), depth=1),
+                    _conf(str(tmpdir), depth=2, debounce=0.)])
+    assert len(watches.observer.emitters) == 1
+
+    tmpdir.join('a', 'b').ensure(dir=True)
+    watches.update([_conf(str(tmpdir), depth=1),
+                    _conf(str(tmpdir), depth=2, debounce=0.)])
+    assert len(watches.observer.emitters) == 3
+    log = tmpdir.join('a', 'app.log')
+    log.write('1:ERROR:a\n')
+    # Picked up on its first event
+    created[0].dispatch(FileModifiedEvent(str(log)))
+    [(message, _)] = router.messages
+    assert message == '1:ERROR:a'
+
+    tmpdir.join('a').remove()
+    watches.update([_conf(str(tmpdir), depth=1),
+                    _conf(str(tmpdir), depth=2, debounce=0.)])
+    assert len(watches.observer.emitters) == 1
+    watches.update([])
+    assert not watches.observer.emitters
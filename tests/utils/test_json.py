@@ -24,11 +24,47 @@
 # SOFTWARE.
 import pytest
 
+from kikori.utils.json import compile_filter
 from kikori.utils.json import filter_json
+from kikori.utils.json import required_literals
 
 
 @pytest.mark.parametrize('x, y, expected', [
     ({'x': 1}, {'x': 1, 'y': 2}, {'x': 1}),
+    ({'x': 1}, {'x': 2, 'y': 2}, None),
+    ({'x': {'y': [1, 2]}}, {'x': {'y': 2}}, {'x': {'y': 2}}),
+    ({'x': {'y': 1}}, {'x': 1}, None),
+    ({'x': '^a'}, {'x': 'ab', 'y': 'a'}, {'x': 'ab'}),
 ])
 def test_filter_json(x, y, expected):
     assert filter_json(x, y) == expected
+
+
+@pytest.mark.parametrize('x, expected', [
+    ({'level': '^ERROR$'}, ['"level"', 'ERROR']),
+    ({'http': {'status': 500}}, ['"http"', '"status"']),
+    ({'path': '^/api/v1'}, ['"path"']),
+    ({'say "hi"': '^café'}, []),
+    ({'msg': '^<b>a&b'}, ['"msg"']),
+])
+def test_required_literals(x, expected):
+    assert required_literals(x) == expected
+
+
+@pytest.mark.parametrize('x, y, expected', [
+    ({'level': '^ERROR$'}, {'level': 'ERROR', 'msg': 'x'}, {}),
+    ({'level': '^ERROR$'}, {'level': 'INFO'}, None),
+    ({'level': '^ERROR$'}, {'msg': 'x'}, None),
+    ({'http': {'status': 500}}, {'http': {'status': 500}}, {}),
+    ({'http': {'status': 500}}, {'http': 500}, None),
+    ({'http': {'status': r'^(?P<status>5\d\d)$'}},
+     {'http': {'status': 503}}, {'status': '503'}),
+    ({'ok': False}, {'ok': 0}, None),
+    ({'level': ['ERROR', 'CRITICAL']}, {'level': 'CRITICAL'}, {}),
+    ({'level': ['ERROR', 'CRITICAL']}, {'level': 'INFO'}, None),
+    ({'level': '^(?P<level>[A-Z]+)$', 'user': {'id': '(?P<uid>\\d+)'}},
+     {'level': 'ERROR', 'user': {'id': '42'}},
+     {'level': 'ERROR', 'uid': '42'}),
+])
+def test_compile_filter(x, y, expected):
+    assert compile_filter(x)(y) == expected
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import re
+
+import pytest
+
+from kikori.utils.regex import literals_regex
+from kikori.utils.regex import required_literals
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    (r'.*', []),
+    (r'^abc', ['abc']),
+    (r'^\d+:ERROR:.*', [':ERROR:']),
+    (r'a(?P<x>bc)d', ['abcd']),
+    (r'a(b|c)d', ['a', 'd']),
+    (r'ab(cd)?ef', ['ab', 'ef']),
+    (r'(?:xy)+z', ['xy', 'z']),
+    (r'ab(?i:cd)ef', ['ab', 'ef']),
+    (re.compile(r'abc', re.I), []),
+])
+def test_required_literals(pattern, expected):
+    assert required_literals(pattern) == expected
+
+
+@pytest.mark.parametrize('literals, text, expected', [
+    (['ERR', 'ERROR'], 'xERRORx', ['ERROR']),
+    (['ERROR', 'ROR!'], 'ERROR!', ['ERROR', 'ROR!']),
+    (['a.b', 'b'], 'axb a.b', ['b', 'a.b', 'b']),
+])
+def test_literals_regex(literals, text, expected):
+    assert literals_regex(literals).findall(text) == expected
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from kikori.utils.tail import TailReader
+
+
+def test_read_lines(tmpdir):
+    path = tmpdir.join('log')
+    path.write_binary(b'skipped\nfirst\nsec')
+    reader = TailReader(str(path), pos=8, size=4)
+    assert list(reader.read_lines()) == [(b'first', 14)]
+    assert reader.pos == 14
+
+    path.write(b'ond\n\nthird\n', mode='ab')
+    assert list(reader.read_lines()) == [(b'second', 21),
+                                         (b'', 22),
+                                         (b'third', 28)]
+    assert list(reader.read_lines()) == []
+    reader.close()
+
+
+def test_read_lines_closed_early(tmpdir):
+    path = tmpdir.join('log')
+    path.write_binary(b'l1\nl2\nl3\n')
+    reader = TailReader(str(path))
+    lines = reader.read_lines()
+    assert next(lines) == (b'l1', 3)
+    lines.close()
+    assert reader.pos == 3
+
+    path.write(b'l4\n', mode='ab')
+    assert list(reader.read_lines()) == [(b'l2', 6), (b'l3', 9),
+                                         (b'l4', 12)]
+    reader.close()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import pytest
+
+from kikori.utils.template import compile_template
+from kikori.utils.template import Template
+
+
+@pytest.mark.parametrize('source, fields', [
+    ('Error logged!', set()),
+    ('{{literal}}', set()),
+    ('{level} at {LOGFILE}:{LINENO}', {'level', 'LOGFILE', 'LINENO'}),
+    ('{a.b} {c[0]!r:>10}', {'a', 'c'}),
+])
+def test_fields(source, fields):
+    assert Template(source).fields == fields
+
+
+def test_render():
+    assert Template('{{literal}}').render({}) == '{literal}'
+    template = Template('{level!r:>9} logged!')
+    assert template.render({'level': 'ERROR'}) == "  'ERROR' logged!"
+    with pytest.raises(KeyError):
+        template.render({})
+    assert compile_template('{x}') is compile_template('{x}')
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import io
+import os
+import random
+
+from kikori.utils import count_lines
+from kikori.utils import LineIndex
+from kikori.utils import read_lines
+
+
+def test_count_lines():
+    f = io.BytesIO(b'a\nb\nc\n')
+    assert count_lines(f) == 3
+    f.seek(1)
+    assert count_lines(f, end=4, size=1) == 2
+
+
+def test_read_lines():
+    f = io.BytesIO(b'a\n\nbc\nd')
+    assert list(read_lines(f, size=2)) == [
+        (b'a', 2), (b'', 3), (b'bc', 6), (b'd', 7)]
+
+
+def test_line_index(tmpdir):
+    data = b''.join(b'x' * (i % 7) + b'\n' for i in range(1000))
+    path = tmpdir.join('log')
+    path.write_binary(data)
+    index = LineIndex(str(path), interval=100)
+    rnd = random.Random(0)
+    for pos in [0, len(data), 1, 100, 99] + [
+            rnd.randrange(len(data)) for _ in range(100)]:
+        assert index.line_at(pos) == data[:pos].count(b'\n')
+
+
+def test_line_index_follow(tmpdir):
+    path = tmpdir.join('log')
+    path.write_binary(b'a\nb\nc\n')
+    index = LineIndex(str(path))
+    with open(str(path), 'rb') as f:
+        index.follow(f.fileno())
+    os.remove(str(path))
+    assert index.line_at(4) == 2
+    index.close()
+    # Unknown once it can no longer be read
+    assert index.line_at(6) is None